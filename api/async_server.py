@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+并发本地服务器
+
+基于 asyncio 接受连接并支持 HTTP/1.1 keep-alive，OPTIONS 和 /metrics 直接在事件循环中响应，异步任务查询在默认线程池中执行，
+CPU 密集的去水印请求交给有界线程池执行。排队的请求超过上限时立即返回 503 和 Retry-After，
+单个请求超过时限返回 504
+
+用法:
+    python -m api.async_server [--port 5000] [--workers N] [--max-queue N] [--timeout 120]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import math
+import os
+import sys
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from api.index import cors_headers, handler, process_job, warmup
+from api.jobs import JOB_WORKERS, start_job_manager
+from api.models import set_inpaint_pool_size
+from api.multipart import MAX_BODY_SIZE
+from api.tracing import render_prometheus
+
+PORT = 5000
+# 空闲连接保持时间（秒）
+KEEP_ALIVE_TIMEOUT = 5
+# 请求头最大字节数
+MAX_HEADER_SIZE = 64 * 1024
+
+
+class AsyncServer:
+    def __init__(self, workers=None, max_queue=None, timeout=120.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = self.workers * 4 if max_queue is None else max_queue
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='watermark')
+        # 正在执行和排队的请求数
+        self.in_flight = 0
+        # 请求耗时的指数移动平均，用于估算 Retry-After
+        self.avg_seconds = 1.0
+
+    # 估算排队请求全部完成所需的秒数
+    def retry_after(self):
+        return max(1, math.ceil(self.avg_seconds * self.in_flight / self.workers))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.write_response(writer, 431, {'error': 'Request header too large'}, keep_alive=False)
+                    break
+
+                method, target, version, headers = self.parse_head(head)
+                if method is None:
+                    await self.write_response(writer, 400, {'error': 'Malformed request'}, keep_alive=False)
+                    break
+
+                keep_alive = self.is_keep_alive(version, headers)
+
+                if 'chunked' in headers.get('transfer-encoding', '').lower():
+                    await self.write_response(writer, 411, {'error': 'Content-Length required'}, keep_alive=False)
+                    break
+                try:
+                    length = int(headers.get('content-length') or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await self.write_response(writer, 400, {'error': 'Invalid Content-Length'}, keep_alive=False)
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.write_response(writer, 413, {'error': f'Request body exceeds {MAX_BODY_SIZE} bytes'},
+                                              keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+
+                status, response_headers, response_body = await self.dispatch(method, target, headers, body)
+                await self.write_response(writer, status, response_body, response_headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    # 解析请求行和请求头
+    def parse_head(self, head):
+        try:
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            return None, None, None, None
+        headers = {}
+        for line in lines[1:]:
+            key, sep, value = line.partition(':')
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        return method.upper(), target, version, headers
+
+    def is_keep_alive(self, version, headers):
+        connection = headers.get('connection', '').lower()
+        if version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    async def dispatch(self, method, target, headers, body):
+        url = urllib.parse.urlsplit(target)
+
+        # 预检请求和监控接口不进入线程池
+        if method == 'OPTIONS':
+            return 200, {}, b''
+        if method == 'GET' and url.path.rstrip('/').endswith('/metrics'):
+            return 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}, render_prometheus().encode('utf-8')
+        if method == 'GET':
+            # 任务查询（可能是长轮询）使用默认线程池，不占用去水印的工作线程
+            event = {
+                'httpMethod': 'GET',
+                'headers': headers,
+                'path': url.path,
+                'queryStringParameters': dict(urllib.parse.parse_qsl(url.query)),
+                'rawResponseBody': True,
+            }
+            response = await asyncio.get_running_loop().run_in_executor(None, handler, event, None)
+            return response['statusCode'], response.get('headers') or {}, response.get('body', b'')
+        if method != 'POST':
+            return 405, {}, {'error': 'Method not allowed'}
+
+        # 准入控制：排队的请求超过上限时直接拒绝
+        if self.in_flight >= self.workers + self.max_queue:
+            return 503, {'Retry-After': str(self.retry_after())}, {'error': 'Server is busy, retry later'}
+
+        event = {
+            'httpMethod': 'POST',
+            'headers': headers,
+            'body': body,
+            'isBase64Encoded': False,
+            'path': url.path,
+            'queryStringParameters': dict(urllib.parse.parse_qsl(url.query)),
+            'rawResponseBody': True,
+        }
+
+        self.in_flight += 1
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        future = self.executor.submit(handler, event, None)
+        # 超时后线程中的任务仍在运行，执行结束（或排队时被取消）后才释放准入名额
+        future.add_done_callback(lambda _: self.call_in_loop(loop, self.request_done, started))
+        try:
+            response = await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            # 线程中的任务无法中断，只是不再等待它的结果
+            return 504, {}, {'error': f'Request timed out after {self.timeout:.0f}s'}
+
+        response_body = response.get('body', b'')
+        if response.get('isBase64Encoded'):
+            response_body = base64.b64decode(response_body)
+        return response['statusCode'], response.get('headers') or {}, response_body
+
+    # 请求在线程池中执行结束，在事件循环线程中更新计数
+    def request_done(self, started):
+        self.in_flight -= 1
+        self.avg_seconds = 0.8 * self.avg_seconds + 0.2 * (time.perf_counter() - started)
+
+    @staticmethod
+    def call_in_loop(loop, callback, *args):
+        try:
+            loop.call_soon_threadsafe(callback, *args)
+        except RuntimeError:
+            # 服务器已经停止，事件循环已关闭
+            pass
+
+    async def write_response(self, writer, status, body, headers=None, keep_alive=True):
+        all_headers = dict(cors_headers)
+        if headers:
+            all_headers.update(headers)
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+        all_headers.setdefault('Content-Type', 'application/json')
+        all_headers['Content-Length'] = str(len(body))
+        if keep_alive:
+            all_headers['Connection'] = 'keep-alive'
+            all_headers['Keep-Alive'] = f'timeout={KEEP_ALIVE_TIMEOUT}'
+        else:
+            all_headers['Connection'] = 'close'
+
+        try:
+            phrase = HTTPStatus(status).phrase
+        except ValueError:
+            phrase = ''
+        head = f'HTTP/1.1 {status} {phrase}\r\n' + ''.join(f'{k}: {v}\r\n' for k, v in all_headers.items()) + '\r\n'
+        writer.write(head.encode('latin-1'))
+        writer.write(body)
+        await writer.drain()
+
+    async def serve(self, host='', port=PORT):
+        server = await asyncio.start_server(self.handle_connection, host or None, port, limit=MAX_HEADER_SIZE)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='并发本地服务器')
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=None, help='执行去水印的线程数，默认等于 CPU 核数')
+    parser.add_argument('--max-queue', type=int, default=None, help='最多排队的请求数，默认为线程数的 4 倍')
+    parser.add_argument('--timeout', type=float, default=120.0, help='单个请求的超时时间（秒）')
+    parser.add_argument('--warmup', action='store_true', help='启动前加载并预热模型')
+    parser.add_argument('--job-workers', type=int, default=JOB_WORKERS, help='异步任务的工作线程数，0 表示不启用')
+    args = parser.parse_args(argv)
+
+    # 会话池大小与线程数一致（环境变量显式指定时除外），避免线程排队等待同一个推理会话，
+    # 自动选择的推理线程数也按会话池大小平分 CPU
+    workers = args.workers or os.cpu_count() or 1
+    if 'WATERMARK_SESSION_POOL_SIZE' not in os.environ:
+        set_inpaint_pool_size(workers)
+
+    if args.warmup:
+        warmup()
+
+    if args.job_workers > 0:
+        start_job_manager(process_job, args.job_workers)
+
+    app = AsyncServer(workers, args.max_queue, args.timeout)
+    print(f"并发服务器启动，监听端口 {args.port}（{app.workers} 个工作线程，最多排队 {app.max_queue} 个请求）")
+    try:
+        asyncio.run(app.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n服务器停止")
+    finally:
+        app.executor.shutdown(wait=False, cancel_futures=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+修复后端
+
+除了 MI-GAN 模型之外，还提供 OpenCV 的 Telea/NS 修复和用周围颜色填充的快速路径。
+选择器根据每个区域的廉价统计量（掩码大小、周围纹理方差、背景均匀程度）选择后端：
+纯色背景直接填充，细小且周围纹理平坦的区域使用 Telea，其余使用模型；单次请求可以指定后端
+"""
+
+import os
+import threading
+
+import cv2
+import numpy as np
+
+# 周围像素的标准差低于该值时视为纯色背景，直接填充
+FILL_MAX_STD = float(os.environ.get('WATERMARK_BACKEND_FILL_STD', '3'))
+# 周围纹理（拉普拉斯方差）低于该值且掩码足够细时使用 OpenCV 修复
+CLASSIC_MAX_TEXTURE = float(os.environ.get('WATERMARK_BACKEND_TEXTURE_VAR', '60'))
+# 使用 OpenCV 修复的掩码最大半宽（像素），更宽的区域 Telea/NS 会明显模糊
+CLASSIC_MAX_RADIUS = float(os.environ.get('WATERMARK_BACKEND_CLASSIC_RADIUS', '6'))
+# 统计周围像素时环带的宽度和与掩码的间隔
+RING_WIDTH = 5
+RING_GAP = 2
+# OpenCV 修复半径
+OPENCV_RADIUS = 3
+
+
+class InpaintBackend:
+    """修复后端：inpaint(img, mask, policy) 修复 mask 中值为 0 的像素，返回与 img 同尺寸的图像；
+    policy 为分辨率策略（见 api.scaling），只有模型后端使用"""
+
+    name = None
+
+    def inpaint(self, img, mask, policy=None):
+        raise NotImplementedError
+
+
+class ModelBackend(InpaintBackend):
+    """包装模型推理函数，inpaint_fn(img, mask, policy) 由调用方提供"""
+
+    def __init__(self, name, inpaint_fn):
+        self.name = name
+        self.inpaint_fn = inpaint_fn
+
+    def inpaint(self, img, mask, policy=None):
+        return self.inpaint_fn(img, mask, policy)
+
+
+class OpenCVBackend(InpaintBackend):
+    """cv2.inpaint 的 Telea 或 Navier-Stokes 算法"""
+
+    def __init__(self, name, method, radius=OPENCV_RADIUS):
+        self.name = name
+        self.method = method
+        self.radius = radius
+
+    def inpaint(self, img, mask, policy=None):
+        hole = np.where(mask < 128, 255, 0).astype(np.uint8)
+        # cv2.inpaint 只支持单通道和三通道图像，alpha 通道保持不变
+        if img.ndim == 3 and img.shape[2] == 4:
+            return np.dstack((cv2.inpaint(np.ascontiguousarray(img[:, :, :3]), hole, self.radius, self.method),
+                              img[:, :, 3]))
+        return cv2.inpaint(img, hole, self.radius, self.method)
+
+
+class FillBackend(InpaintBackend):
+    """用掩码周围像素的中位数颜色填充，适用于纯色背景"""
+
+    name = 'fill'
+
+    def inpaint(self, img, mask, policy=None):
+        hole = mask < 128
+        ring = ring_mask(hole)
+        result = img.copy()
+        if ring.any():
+            result[hole] = np.median(img[ring], axis=0).astype(img.dtype)
+        return result
+
+
+# 掩码外侧的环带：与掩码间隔 gap 像素（避开水印的抗锯齿边缘），宽度为 width
+def ring_mask(hole, width=RING_WIDTH, gap=RING_GAP):
+    hole = hole.astype(np.uint8)
+    outer = cv2.dilate(hole, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * (gap + width) + 1,) * 2)) > 0
+    inner = cv2.dilate(hole, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * gap + 1,) * 2)) > 0
+    return outer & ~inner
+
+
+# 选择后端用的统计量：掩码面积、最大半宽、周围像素标准差和纹理方差
+def region_stats(img, mask):
+    hole = mask < 128
+    area = int(hole.sum())
+    if not area:
+        return {'area': 0, 'radius': 0.0, 'ring_std': 0.0, 'texture': 0.0}
+
+    # 只在掩码外接矩形附近计算，避免整张图片上的形态学运算
+    ys, xs = np.nonzero(hole)
+    pad = RING_GAP + RING_WIDTH + 1
+    y1, y2 = max(0, ys.min() - pad), min(hole.shape[0], ys.max() + 1 + pad)
+    x1, x2 = max(0, xs.min() - pad), min(hole.shape[1], xs.max() + 1 + pad)
+    hole = hole[y1:y2, x1:x2]
+    crop = img[y1:y2, x1:x2]
+
+    radius = float(cv2.distanceTransform(hole.astype(np.uint8), cv2.DIST_L2, 3).max())
+    ring = ring_mask(hole)
+    if not ring.any():
+        return {'area': area, 'radius': radius, 'ring_std': float('inf'), 'texture': float('inf')}
+
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    ring_std = float(crop[ring].reshape(-1, crop.shape[2] if crop.ndim == 3 else 1).std(axis=0).mean())
+    texture = float(cv2.Laplacian(gray, cv2.CV_32F)[ring].var())
+    return {'area': area, 'radius': radius, 'ring_std': ring_std, 'texture': texture}
+
+
+# 根据统计量选择后端名
+def choose_backend(stats):
+    if stats['ring_std'] <= FILL_MAX_STD:
+        return 'fill'
+    if stats['radius'] <= CLASSIC_MAX_RADIUS and stats['texture'] <= CLASSIC_MAX_TEXTURE:
+        return 'telea'
+    return 'migan'
+
+
+_backends = {
+    'telea': OpenCVBackend('telea', cv2.INPAINT_TELEA),
+    'ns': OpenCVBackend('ns', cv2.INPAINT_NS),
+    'fill': FillBackend(),
+}
+_backends_lock = threading.Lock()
+
+
+# 注册后端，同名后端会被替换
+def register_backend(backend):
+    with _backends_lock:
+        _backends[backend.name] = backend
+
+
+def get_backend(name):
+    backend = _backends.get(name)
+    if backend is None:
+        raise ValueError(f'Unknown inpaint backend: {name}')
+    return backend
+
+
+def backend_names():
+    return sorted(_backends) + ['auto']
+
+
+# 指定的后端是否可能用到模型（自动选择或 migan），用于决定是否预热模型
+def uses_model(name):
+    return name in (None, 'auto', 'migan')
+
+
+# 选择后端：name 为 None 或 'auto' 时按统计量自动选择，否则使用指定的后端
+def select_backend(img, mask, name=None):
+    if name and name != 'auto':
+        return get_backend(name)
+    return get_backend(choose_backend(region_stats(img, mask)))
+
+
+# 解析请求参数中的后端名，未指定时返回 None（自动选择），未知后端抛出 ValueError
+def parse_backend(value):
+    name = (value or '').strip().lower()
+    if not name:
+        return None
+    if name not in backend_names():
+        raise ValueError(f"Unknown inpaint backend: {name} (expected one of {', '.join(backend_names())})")
+    return name
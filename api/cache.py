@@ -0,0 +1,202 @@
+"""
+内容寻址结果缓存
+
+缓存键由解码后像素的哈希和流水线配置组成；内存 LRU 层按字节预算淘汰，
+可选的磁盘层按总大小淘汰最久未使用的条目。不同阶段使用不同的命名空间，
+例如 OCR 原始结果、水印框和最终编码输出分别缓存，修改阈值时可以复用 OCR 结果
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# 是否启用缓存
+CACHE_ENABLED = os.environ.get('WATERMARK_CACHE', '1') != '0'
+# 内存层字节预算
+CACHE_MEMORY_BYTES = int(os.environ.get('WATERMARK_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+# 磁盘层目录，未设置时不启用磁盘缓存
+CACHE_DIR = os.environ.get('WATERMARK_CACHE_DIR', '')
+# 磁盘层字节预算
+CACHE_DISK_BYTES = int(os.environ.get('WATERMARK_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+
+
+# 计算图像像素的内容哈希
+def image_digest(img):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f'{img.shape}|{img.dtype}'.encode('utf-8'))
+    h.update(memoryview(img if img.flags['C_CONTIGUOUS'] else img.copy()).cast('B'))
+    return h.hexdigest()
+
+
+# 由像素哈希和配置生成缓存键
+def make_key(digest, config=None):
+    if not config:
+        return digest
+    encoded = json.dumps(config, sort_keys=True, default=str).encode('utf-8')
+    return digest + '-' + hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+# 估算缓存值占用的字节数
+def _sizeof(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return len(value)
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+class MemoryCache:
+    """按字节预算淘汰的线程安全 LRU 缓存"""
+
+    def __init__(self, max_bytes=CACHE_MEMORY_BYTES):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size=None):
+        if size is None:
+            size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.current_bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.current_bytes = 0
+
+
+class DiskCache:
+    """磁盘缓存，总大小超过预算时删除最久未访问的文件"""
+
+    def __init__(self, directory, max_bytes=CACHE_DISK_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.current_bytes = sum(size for _, _, size in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # 更新访问时间，用于 LRU 淘汰
+            os.utime(path)
+        except OSError:
+            return None
+        try:
+            return pickle.loads(data)
+        except Exception:
+            return None
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            try:
+                replaced = os.path.getsize(path)
+            except OSError:
+                replaced = 0
+            os.replace(tmp, path)
+            self.current_bytes += len(data) - replaced
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        # 淘汰到预算的 90%，避免每次写入都触发扫描
+        target = self.max_bytes * 0.9
+        for path, _, size in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self.current_bytes = total
+
+
+class ResultCache:
+    """内存层 + 可选磁盘层的两级缓存，按命名空间隔离不同阶段的结果"""
+
+    def __init__(self, memory=None, disk=None):
+        self.memory = memory if memory is not None else MemoryCache()
+        self.disk = disk
+
+    def get(self, namespace, key):
+        full_key = f'{namespace}-{key}'
+        value = self.memory.get(full_key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(full_key)
+            if value is not None:
+                self.memory.put(full_key, value)
+        return value
+
+    def put(self, namespace, key, value):
+        full_key = f'{namespace}-{key}'
+        self.memory.put(full_key, value)
+        if self.disk is not None:
+            try:
+                self.disk.put(full_key, value)
+            except OSError as e:
+                print(f"Failed to write cache entry {full_key}: {e}")
+
+    def clear(self):
+        self.memory.clear()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# 获取进程级结果缓存，未启用时返回 None
+def get_cache():
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                disk = DiskCache(CACHE_DIR) if CACHE_DIR else None
+                _cache = ResultCache(MemoryCache(), disk)
+    return _cache
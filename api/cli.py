@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+命令行批量去水印工具
+
+流水线：读取线程 -> 工作进程（每个进程持有一个预热好的 EasyOCR reader 和 ORT 会话）-> 写入线程，
+各阶段之间使用有界队列形成背压；已经存在的输出文件会被跳过，中断后可以直接重新运行继续处理
+
+用法:
+    python -m api.cli INPUT_DIR_OR_MANIFEST OUTPUT_DIR [--workers N]
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import sys
+import threading
+import time
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tif', '.tiff')
+
+# 队列结束标记
+_STOP = None
+# 任务队列已满时检查工作进程是否存活的间隔（秒）
+_PUT_INTERVAL = 0.5
+
+
+# 遍历输入目录或清单文件，生成 (输入路径, 相对路径)
+def iter_inputs(source):
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.join(root, filename)
+                    yield path, os.path.relpath(path, source)
+        return
+
+    # 清单文件：每行一个图片路径，相对路径以清单所在目录为基准
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            path = line if os.path.isabs(line) else os.path.join(base, line)
+            rel = os.path.basename(path) if os.path.isabs(line) else os.path.normpath(line)
+            yield path, rel
+
+
+# 计算输出路径，指定 fmt 时替换扩展名
+def get_output_path(output_dir, rel, fmt=None):
+    if fmt:
+        rel = os.path.splitext(rel)[0] + '.' + fmt
+    return os.path.join(output_dir, rel)
+
+
+# 工作进程：加载并预热模型后循环处理任务
+def _worker_main(tasks, results, inpaint_mode, backend=None, processes=1):
+    from api.sessions import configure_worker_process
+
+    configure_worker_process(processes)
+
+    import cv2
+    import numpy as np
+
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+
+    from api.backends import uses_model
+    from api.index import remove_watermark, warmup
+
+    cv2.setNumThreads(1)
+    # 只使用 OpenCV 或填充后端时不需要模型文件
+    warmup(inpaint=uses_model(backend))
+
+    while True:
+        task = tasks.get()
+        if task is _STOP:
+            break
+        src, dst, data = task
+        try:
+            img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+            if img is None:
+                raise ValueError('Failed to read image')
+            result = remove_watermark(img, inpaint_mode=inpaint_mode, backend=backend)
+            ok, buffer = cv2.imencode(os.path.splitext(dst)[1] or '.png', result)
+            if not ok:
+                raise ValueError('Failed to encode image')
+            results.put((src, dst, buffer.tobytes(), None))
+        except Exception as e:
+            results.put((src, dst, None, str(e)))
+
+
+# 放入有界任务队列；队列满时定期检查工作进程，全部退出时返回 False
+def _put_task(tasks, item, processes):
+    while True:
+        try:
+            tasks.put(item, timeout=_PUT_INTERVAL)
+            return True
+        except queue.Full:
+            if not any(process.is_alive() for process in processes):
+                return False
+
+
+# 读取线程：跳过已有输出，把文件内容放入有界任务队列；工作进程全部退出（启动失败、被 OOM 杀死等）时停止读取
+def _reader_main(inputs, output_dir, fmt, overwrite, tasks, processes, stats):
+    for src, rel in inputs:
+        dst = get_output_path(output_dir, rel, fmt)
+        if not overwrite and os.path.exists(dst):
+            stats['skipped'] += 1
+            continue
+        try:
+            with open(src, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print(f"读取失败 {src}: {e}", file=sys.stderr)
+            stats['unreadable'] += 1
+            continue
+        if not _put_task(tasks, (src, dst, data), processes):
+            stats['aborted'] = True
+            return
+        stats['queued'] += 1
+
+    for _ in processes:
+        if not _put_task(tasks, _STOP, processes):
+            stats['aborted'] = True
+            return
+
+
+# 写入线程：先写临时文件再原子替换，中断时不会留下不完整的输出
+def _writer_main(results, stats, done):
+    while True:
+        try:
+            item = results.get(timeout=0.5)
+        except queue.Empty:
+            if done.is_set():
+                break
+            continue
+
+        src, dst, data, error = item
+        if error is not None:
+            print(f"处理失败 {src}: {error}", file=sys.stderr)
+            stats['failed'] += 1
+            continue
+
+        os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        tmp = dst + '.part'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, dst)
+        stats['written'] += 1
+
+
+# 运行批处理流水线，返回统计信息
+def run_pipeline(source, output_dir, workers=None, queue_size=None, fmt=None,
+                 overwrite=False, inpaint_mode=None, backend=None):
+    workers = workers or os.cpu_count() or 1
+    queue_size = queue_size or workers * 2
+
+    ctx = mp.get_context('spawn')
+    tasks = ctx.Queue(maxsize=queue_size)
+    results = ctx.Queue(maxsize=queue_size)
+    stats = {'queued': 0, 'skipped': 0, 'written': 0, 'failed': 0, 'unreadable': 0, 'lost': 0,
+             'crashed_workers': 0, 'aborted': False}
+
+    processes = [
+        ctx.Process(target=_worker_main, args=(tasks, results, inpaint_mode, backend, workers), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    started = time.perf_counter()
+    done = threading.Event()
+    reader = threading.Thread(
+        target=_reader_main,
+        args=(iter_inputs(source), output_dir, fmt, overwrite, tasks, processes, stats),
+        daemon=True
+    )
+    writer = threading.Thread(target=_writer_main, args=(results, stats, done), daemon=True)
+    reader.start()
+    writer.start()
+
+    reader.join()
+    if stats['aborted']:
+        # 没有进程会再读取任务队列，退出时不等待队列中剩余的数据写完
+        tasks.cancel_join_thread()
+    for process in processes:
+        process.join()
+    done.set()
+    writer.join()
+
+    # 异常退出的工作进程正在处理和尚未取走的任务都不会有结果
+    stats['crashed_workers'] = sum(1 for process in processes if process.exitcode != 0)
+    stats['lost'] = stats['queued'] - stats['written'] - stats['failed']
+
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='批量移除图片水印')
+    parser.add_argument('input', help='输入目录，或每行一个图片路径的清单文件')
+    parser.add_argument('output', help='输出目录')
+    parser.add_argument('--workers', type=int, default=None, help='工作进程数，默认等于 CPU 核数')
+    parser.add_argument('--queue-size', type=int, default=None, help='任务队列长度，默认为工作进程数的两倍')
+    parser.add_argument('--format', choices=['png', 'jpg', 'webp'], default=None, help='输出格式，默认与输入相同')
+    parser.add_argument('--overwrite', action='store_true', help='覆盖已经存在的输出文件')
+    parser.add_argument('--inpaint-mode', choices=['region', 'full', 'tiled'], default=None, help='修复模式')
+    parser.add_argument('--backend', choices=['auto', 'migan', 'telea', 'ns', 'fill'], default=None,
+                        help='修复后端，默认按区域自动选择')
+    args = parser.parse_args(argv)
+
+    stats = run_pipeline(args.input, args.output, args.workers, args.queue_size,
+                         args.format, args.overwrite, args.inpaint_mode, args.backend)
+    rate = stats['written'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    failed = stats['failed'] + stats['unreadable'] + stats['lost']
+    if stats['crashed_workers']:
+        print(f"{stats['crashed_workers']} 个工作进程异常退出，{stats['lost']} 个任务未处理", file=sys.stderr)
+    if stats['aborted']:
+        print("所有工作进程都已退出，中止处理", file=sys.stderr)
+    print(f"完成: 写入 {stats['written']}，跳过 {stats['skipped']}，失败 {failed}，"
+          f"耗时 {stats['seconds']:.1f}s（{rate:.2f} 张/秒）")
+    return 1 if failed or stats['aborted'] or stats['crashed_workers'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+水印检测区域策略
+
+按顺序只在候选区域（默认先右下角，再其他角落）内做检测，并把坐标映射回整张图片；
+所有候选区域都没有找到水印时才回退到整张图片检测
+"""
+
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from api.masks import nms_regions, offset_region
+from api.rules import get_rule_set
+from api.tiles import tile_boxes
+
+# 候选区域，按图片宽高的比例表示 (x1, y1, x2, y2)
+ROI_FRACTIONS = {
+    'bottom-right': (0.6, 0.8, 1.0, 1.0),
+    'bottom-left': (0.0, 0.8, 0.4, 1.0),
+    'top-right': (0.6, 0.0, 1.0, 0.2),
+    'top-left': (0.0, 0.0, 0.4, 0.2),
+    'full': (0.0, 0.0, 1.0, 1.0),
+}
+
+# 候选区域的最小尺寸（像素），避免小图片上区域过小导致文字被截断
+ROI_MIN_WIDTH = 320
+ROI_MIN_HEIGHT = 160
+
+# 默认检测顺序，可通过环境变量覆盖，例如 "bottom-right,top-right"
+DEFAULT_ROIS = [
+    name.strip()
+    for name in os.environ.get('WATERMARK_OCR_ROIS', 'bottom-right,bottom-left,top-right,top-left').split(',')
+    if name.strip()
+]
+
+
+# 分块检测：边长超过分块大小的区域切成互相重叠的分块逐块检测，避免 OCR 检测器缩小大图或分配巨大的得分图；
+# 分块大小为 0 时不分块。重叠宽度需要大于水印文字的高度
+OCR_TILE_SIZE = int(os.environ.get('WATERMARK_OCR_TILE_SIZE', '1536'))
+OCR_TILE_OVERLAP = int(os.environ.get('WATERMARK_OCR_TILE_OVERLAP', '128'))
+# 并行检测分块的线程数
+OCR_TILE_WORKERS = int(os.environ.get('WATERMARK_OCR_TILE_WORKERS', '1'))
+# 重叠区域中重复的框：交集占较小框面积的比例超过该值时视为同一个框
+TILE_NMS_THRESHOLD = 0.5
+
+
+# 计算候选区域在图片上的像素坐标 (x1, y1, x2, y2)
+def get_roi_box(roi, img_shape):
+    h, w = img_shape[:2]
+    fx1, fy1, fx2, fy2 = ROI_FRACTIONS[roi] if isinstance(roi, str) else roi
+
+    x1, x2 = int(round(fx1 * w)), int(round(fx2 * w))
+    y1, y2 = int(round(fy1 * h)), int(round(fy2 * h))
+
+    # 扩展过小的区域，靠近图片边缘的一侧保持不动
+    if x2 - x1 < ROI_MIN_WIDTH:
+        if fx2 >= 1.0:
+            x1 = max(0, x2 - ROI_MIN_WIDTH)
+        else:
+            x2 = min(w, x1 + ROI_MIN_WIDTH)
+    if y2 - y1 < ROI_MIN_HEIGHT:
+        if fy2 >= 1.0:
+            y1 = max(0, y2 - ROI_MIN_HEIGHT)
+        else:
+            y2 = min(h, y1 + ROI_MIN_HEIGHT)
+
+    return x1, y1, x2, y2
+
+
+# 区域是否需要分块检测
+def needs_tiling(shape, tile_size=None):
+    if tile_size is None:
+        tile_size = OCR_TILE_SIZE
+    return bool(tile_size) and max(shape[:2]) > tile_size
+
+
+# 分块调用 detect_fn(tile) 检测，框映射回区域坐标后去掉重叠区域中的重复框
+def detect_tiled(region, detect_fn, tile_size=None, overlap=None, workers=None):
+    if tile_size is None:
+        tile_size = OCR_TILE_SIZE
+    if overlap is None:
+        overlap = OCR_TILE_OVERLAP
+    if workers is None:
+        workers = OCR_TILE_WORKERS
+    if not needs_tiling(region.shape, tile_size):
+        return list(detect_fn(region))
+
+    def detect_tile(box):
+        x1, y1, x2, y2 = box
+        tile = np.ascontiguousarray(region[y1:y2, x1:x2])
+        return [offset_region(r, x1, y1) for r in detect_fn(tile)]
+
+    boxes = tile_boxes(region.shape, tile_size, overlap)
+    if workers > 1:
+        # 每个分块在当前上下文的副本中运行，分块线程中的阶段耗时记入本次请求的 trace
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='watermark-tile') as executor:
+            futures = [executor.submit(contextvars.copy_context().run, detect_tile, box) for box in boxes]
+            results = [future.result() for future in futures]
+    else:
+        results = [detect_tile(box) for box in boxes]
+    return nms_regions([r for tile_regions in results for r in tile_regions], TILE_NMS_THRESHOLD)
+
+
+# 按规则的区域提示过滤整图坐标下的框：框中心必须落在规则允许的候选区域内
+def apply_region_hints(regions, img_shape):
+    rule_set = get_rule_set()
+    kept = []
+    for region in regions:
+        rule = rule_set.get(getattr(region, 'rule', None))
+        if rule is None or not rule.regions:
+            kept.append(region)
+            continue
+        cx, cy = region[0] + region[2] / 2.0, region[1] + region[3] / 2.0
+        for roi in rule.regions:
+            x1, y1, x2, y2 = get_roi_box(roi, img_shape)
+            if x1 <= cx < x2 and y1 <= cy < y2:
+                kept.append(region)
+                break
+    return kept
+
+
+# 在候选区域内依次调用 detect_fn(region) 检测，返回整张图片坐标下的 (x, y, w, h) 列表
+def detect_in_rois(img, detect_fn, rois=None, fallback=True, stop_on_first=True):
+    if rois is None:
+        rois = DEFAULT_ROIS
+
+    regions = []
+    scanned = set()
+    for roi in rois:
+        x1, y1, x2, y2 = get_roi_box(roi, img.shape)
+        # 小图片上多个候选区域可能重合
+        if (x1, y1, x2, y2) in scanned or x2 <= x1 or y2 <= y1:
+            continue
+        scanned.add((x1, y1, x2, y2))
+
+        found = [offset_region(region, x1, y1) for region in detect_fn(np.ascontiguousarray(img[y1:y2, x1:x2]))]
+        regions.extend(apply_region_hints(found, img.shape))
+        if regions and stop_on_first:
+            return regions
+
+    if regions or not fallback:
+        return regions
+
+    # 所有候选区域都没有水印，回退到整张图片检测
+    if (0, 0, img.shape[1], img.shape[0]) in scanned:
+        return regions
+    return apply_region_hints(list(detect_fn(img)), img.shape)
+
+
+# 批量版本：detect_batch_fn(regions) 接收区域列表并返回对应的框列表，
+# 同一候选区域内所有图片的裁剪一起检测，返回每张图片整图坐标下的框列表
+def detect_in_rois_batch(images, detect_batch_fn, rois=None, fallback=True):
+    if rois is None:
+        rois = DEFAULT_ROIS
+
+    results = [[] for _ in images]
+    scanned = [set() for _ in images]
+    pending = list(range(len(images)))
+
+    for roi in rois:
+        if not pending:
+            break
+        indices, offsets, crops = [], [], []
+        for i in pending:
+            x1, y1, x2, y2 = get_roi_box(roi, images[i].shape)
+            if (x1, y1, x2, y2) in scanned[i] or x2 <= x1 or y2 <= y1:
+                continue
+            scanned[i].add((x1, y1, x2, y2))
+            indices.append(i)
+            offsets.append((x1, y1))
+            crops.append(np.ascontiguousarray(images[i][y1:y2, x1:x2]))
+
+        if crops:
+            for i, (x1, y1), boxes in zip(indices, offsets, detect_batch_fn(crops)):
+                results[i] = apply_region_hints([offset_region(region, x1, y1) for region in boxes], images[i].shape)
+        pending = [i for i in pending if not results[i]]
+
+    if not fallback:
+        return results
+
+    # 所有候选区域都没有水印的图片回退到整张图片检测
+    pending = [i for i in pending if (0, 0, images[i].shape[1], images[i].shape[0]) not in scanned[i]]
+    if pending:
+        for i, boxes in zip(pending, detect_batch_fn([images[i] for i in pending])):
+            results[i] = apply_region_hints(list(boxes), images[i].shape)
+    return results
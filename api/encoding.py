@@ -0,0 +1,114 @@
+"""
+响应编码与内容协商
+
+根据 Accept 头或查询参数决定返回原始图片字节（image/png、image/jpeg、image/webp）
+还是旧版的 JSON + base64；未指定格式时返回与输入相同的格式
+"""
+
+import os
+
+import cv2
+
+# 支持的输出格式：扩展名、MIME 类型
+FORMATS = {
+    'png': ('.png', 'image/png'),
+    'jpeg': ('.jpg', 'image/jpeg'),
+    'webp': ('.webp', 'image/webp'),
+}
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+MIME_TO_FORMAT = {mime: fmt for fmt, (_, mime) in FORMATS.items()}
+
+# 默认压缩参数：PNG 压缩级别 0-9（越小越快），JPEG/WebP 质量 1-100
+PNG_COMPRESSION = int(os.environ.get('WATERMARK_PNG_COMPRESSION', '1'))
+JPEG_QUALITY = int(os.environ.get('WATERMARK_JPEG_QUALITY', '95'))
+WEBP_QUALITY = int(os.environ.get('WATERMARK_WEBP_QUALITY', '90'))
+
+
+# 根据文件头判断输入图片格式，无法识别时返回 None
+def detect_format(data):
+    head = bytes(data[:12])
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'jpeg'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
+
+# 规范化格式名，不支持时返回 None
+def normalize_format(fmt):
+    if not fmt:
+        return None
+    fmt = fmt.strip().lower()
+    if fmt.startswith('image/'):
+        return MIME_TO_FORMAT.get(fmt)
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    return fmt if fmt in FORMATS else None
+
+
+# 编码图片，quality 对 PNG 表示压缩级别，对 JPEG/WebP 表示质量
+def encode_image(img, fmt='png', quality=None):
+    fmt = normalize_format(fmt) or 'png'
+    ext = FORMATS[fmt][0]
+    if fmt == 'png':
+        params = [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION if quality is None else quality]
+    elif fmt == 'jpeg':
+        params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY if quality is None else quality]
+    else:
+        params = [cv2.IMWRITE_WEBP_QUALITY, WEBP_QUALITY if quality is None else quality]
+
+    ok, buffer = cv2.imencode(ext, img, params)
+    if not ok:
+        raise ValueError(f'Failed to encode image as {fmt}')
+    return buffer
+
+
+# 解析 Accept 头，返回按优先级排序的 [(媒体类型, q)]
+def parse_accept(accept):
+    entries = []
+    for index, item in enumerate((accept or '').split(',')):
+        parts = item.strip().split(';')
+        media = parts[0].strip().lower()
+        if not media:
+            continue
+        q = 1.0
+        for param in parts[1:]:
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        entries.append((media, q, index))
+    entries.sort(key=lambda entry: (-entry[1], entry[2]))
+    return [(media, q) for media, q, _ in entries if q > 0]
+
+
+# 内容协商，返回 (mode, fmt, quality)，mode 为 'binary' 或 'json'
+def negotiate(accept=None, query=None, input_format=None):
+    query = query or {}
+    default_format = input_format if input_format in FORMATS else 'png'
+
+    quality = query.get('quality')
+    try:
+        quality = int(quality) if quality not in (None, '') else None
+    except ValueError:
+        quality = None
+
+    # 查询参数优先：?format=png|jpeg|webp 返回原始字节，?format=json 返回旧版 JSON
+    requested = (query.get('format') or '').strip().lower()
+    if requested == 'json':
+        return 'json', 'png', quality
+    if requested:
+        return 'binary', normalize_format(requested) or default_format, quality
+
+    # 只有当图片类型的优先级高于 JSON 时才返回原始字节，保持旧客户端的行为
+    for media, _ in parse_accept(accept):
+        if media in ('application/json', 'text/plain', '*/*', 'text/*', 'application/*'):
+            break
+        if media == 'image/*':
+            return 'binary', default_format, quality
+        if media in MIME_TO_FORMAT:
+            return 'binary', MIME_TO_FORMAT[media], quality
+    return 'json', 'png', quality
@@ -1,19 +1,22 @@
 import os
 import sys
+import time
 import cv2
 import numpy as np
-import easyocr
-import onnxruntime as ort
 import tempfile
 from PIL import Image
 from io import BytesIO
 import base64
 import json
+import urllib.parse
+
+# 记录模块导入（冷启动）开始时间
+_import_started = time.perf_counter()
 
 # 设置CORS头
 cors_headers = {
     'Access-Control-Allow-Origin': '*',
-    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
     'Access-Control-Allow-Headers': 'Content-Type'
 }
 
@@ -23,225 +26,751 @@ project_root = os.path.dirname(api_dir)  # 项目根目录
 # 添加项目根目录到 Python 路径
 sys.path.append(project_root)
 
-# 初始化 EasyOCR reader
-reader = easyocr.Reader(['ch_sim', 'en'], gpu=False)
-
-# 获取 inpaint 模型路径
-def get_inpaint_model():
-    # 尝试不同的模型路径
-    possible_paths = [
-        os.path.join(project_root, 'models', 'migan_pipeline_v2.onnx'),
-        os.path.join(project_root, 'migan_pipeline_v2.onnx'),
-        os.path.join(api_dir, 'models', 'migan_pipeline_v2.onnx')
-    ]
-    
-    for model_path in possible_paths:
-        if os.path.exists(model_path):
-            return model_path
-    
-    # 如果没有找到模型，返回默认路径
-    return os.path.join(project_root, 'models', 'migan_pipeline_v2.onnx')
-
-# 预处理图像
-def preprocess_image(img):
-    if len(img.shape) == 3 and img.shape[2] == 3:
-        img_rgb = img.copy()
+from api.backends import ModelBackend, parse_backend, register_backend, select_backend
+from api.cache import get_cache, image_digest, make_key
+from api.detection import (DEFAULT_ROIS, OCR_TILE_OVERLAP, OCR_TILE_SIZE, detect_in_rois, detect_in_rois_batch,
+                           detect_tiled, needs_tiling)
+from api.encoding import FORMATS, detect_format, encode_image, negotiate, parse_accept
+from api.jobs import get_job_manager
+from api.masks import Region, build_mask, normalize_user_mask, parse_boxes, regions_from_mask
+from api.models import get_inpaint_model, get_inpaint_session_pool, get_reader, warmup
+from api.multipart import MultipartError, PartTooLarge, parse_multipart
+from api.regions import blend_crop, extract_crops, inpaint_regions
+from api.rules import get_rule_set
+from api.scaling import get_policy, inpaint_at_scale, parse_policy_params, recomposite
+from api.templates import TEMPLATE_THRESHOLD, get_template_library, match_templates
+from api.tiles import inpaint_tiled
+from api.tracing import TRACING_ENABLED, annotate, current_trace, end_trace, stage, start_trace
+from api.video import CONTAINERS, VideoDecodeError, detect_container, process_bytes
+
+# 请求模式：remove 完整去水印，detect 只返回水印框，inpaint 使用客户端提供的掩码或水印框修复，
+# job 提交异步任务后立即返回任务 ID
+REQUEST_MODES = ('remove', 'detect', 'inpaint', 'job')
+
+# 修复模式：region 只处理水印周围的裁剪块，full 处理整张图片，
+# tiled 在原分辨率下只处理包含水印的固定大小分块（适合超大图片）
+INPAINT_MODE = os.environ.get('WATERMARK_INPAINT_MODE', 'region')
+
+# 分块修复的分块大小、重叠宽度、每次推理的分块数和接缝混合方式（linear 或 gaussian）
+INPAINT_TILE_SIZE = int(os.environ.get('WATERMARK_INPAINT_TILE_SIZE', '512'))
+INPAINT_TILE_OVERLAP = int(os.environ.get('WATERMARK_INPAINT_TILE_OVERLAP', '64'))
+INPAINT_TILE_BATCH = int(os.environ.get('WATERMARK_INPAINT_TILE_BATCH', '4'))
+INPAINT_TILE_BLEND = os.environ.get('WATERMARK_INPAINT_TILE_BLEND', 'linear')
+
+
+# 预处理图像：BGR(A)/灰度图转换为 RGB 并写入 NCHW 的 uint8 张量；传入 out 时直接写入其中，
+# 通道翻转和转置通过视图完成，整个过程只拷贝一次
+def preprocess_image(img, out=None):
+    h, w = img.shape[:2]
+    if out is None:
+        out = np.empty((1, 3, h, w), dtype=np.uint8)
+    if img.ndim == 2:
+        np.copyto(out[0], img, casting='unsafe')
     else:
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-    
-    img_transposed = img_rgb.transpose(2, 0, 1)
-    img_batch = np.expand_dims(img_transposed, axis=0)
-    return img_batch.astype(np.uint8)
+        np.copyto(out[0], img[:, :, 2::-1].transpose(2, 0, 1), casting='unsafe')
+    return out
 
-# 预处理掩码
-def preprocess_mask(mask, img_shape):
-    mask_resized = cv2.resize(mask, (img_shape[1], img_shape[0]))
-    _, mask_binary = cv2.threshold(mask_resized, 127, 255, cv2.THRESH_BINARY)
-    mask_batch = np.expand_dims(np.expand_dims(mask_binary, axis=0), axis=0)
-    return mask_batch.astype(np.uint8)
+# 预处理掩码（内部生成的掩码已经是同尺寸的 0/255 二值图，只在尺寸不一致时缩放并二值化）
+def preprocess_mask(mask, img_shape, out=None):
+    if mask.shape[:2] != tuple(img_shape[:2]):
+        mask = cv2.resize(mask, (img_shape[1], img_shape[0]))
+        _, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+    if out is None:
+        return np.ascontiguousarray(mask[None, None], dtype=np.uint8)
+    np.copyto(out[0, 0], mask, casting='unsafe')
+    return out
 
-# 后处理输出
+# 后处理输出：NCHW 的 RGB 张量转换为 BGR 图像，只分配结果数组
 def postprocess_output(output, img_shape):
-    output = output.squeeze(0)
-    output = output.transpose(1, 2, 0)
-    output = np.clip(output, 0, 255).astype(np.uint8)
-    output = cv2.resize(output, (img_shape[1], img_shape[0]))
-    return output
+    output = output[0]
+    if output.dtype != np.uint8:
+        output = np.clip(output, 0, 255, out=output if output.flags.writeable else None)
+    result = np.empty((output.shape[1], output.shape[2], 3), dtype=np.uint8)
+    np.copyto(result, output[::-1].transpose(1, 2, 0), casting='unsafe')
+    if result.shape[:2] != tuple(img_shape[:2]):
+        result = cv2.resize(result, (img_shape[1], img_shape[0]))
+    return result
 
-# 移除水印
-def remove_watermark(image):
-    # 读取图像
-    img = image
+# 把模型输出的 BGR 图像转换回输入的通道布局：灰度图转回单通道，BGRA 图像保留原来的 alpha 通道
+def match_channels(result, img):
+    if img.ndim == 2:
+        return cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
+    if img.shape[2] == 4:
+        return np.dstack((result, img[:, :, 3]))
+    return result
+
+# 使用 inpaint 模型修复图像中掩码为 0 的区域，大图按策略缩小到工作分辨率后修复
+def run_inpaint(img, mask, policy=None):
+    return inpaint_at_scale(img, mask, run_inpaint_model, policy)
+
+# 在原分辨率下运行 inpaint 模型，输入输出张量使用当前线程复用的缓冲区
+def run_inpaint_model(img, mask):
+    # 推理时才导入，导入本模块不加载 onnxruntime
+    from api.sessions import get_tensor_buffers, run_with_buffers
+    
     h, w = img.shape[:2]
+    buffers = get_tensor_buffers()
+    
+    # 预处理图像和掩码
+    with stage('preprocess'):
+        input_image = preprocess_image(img, buffers.get('image', (1, 3, h, w)))
+        input_mask = preprocess_mask(mask, img.shape, buffers.get('mask', (1, 1, h, w)))
+    
+    # 模型推理（会话在进程内复用），输出直接写入缓冲区
+    with get_inpaint_session_pool().acquire() as session:
+        with stage('inference'):
+            output = run_with_buffers(session, [input_image, input_mask], buffers)
     
-    # 对整个图像进行 OCR 检测
-    right_region = img.copy()
-    right_region_w = w
-    right_region_h = h
-    start_x = 0
-    start_y = 0
+    # 后处理输出
+    with stage('postprocess'):
+        return match_channels(postprocess_output(output, img.shape), img)
+
+# 批量推理：形状相同且模型支持批维度时合并为一次调用
+def run_inpaint_batch(imgs, masks, policy=None):
+    from api.sessions import get_tensor_buffers, run_with_buffers
+    
+    outputs = None
+    max_side = get_policy(policy)['max_side']
+    # 超过工作分辨率的图像需要逐张缩放，不参与批量推理
+    small_enough = not max_side or all(max(img.shape[:2]) <= max_side for img in imgs)
+    if len(imgs) > 1 and len({img.shape for img in imgs}) == 1 and small_enough:
+        with get_inpaint_session_pool().acquire() as session:
+            # 批维度为固定整数时模型不支持批量推理
+            if not isinstance(session.get_inputs()[0].shape[0], int):
+                n, (h, w) = len(imgs), imgs[0].shape[:2]
+                buffers = get_tensor_buffers()
+                with stage('preprocess'):
+                    input_images = buffers.get('image', (n, 3, h, w))
+                    input_masks = buffers.get('mask', (n, 1, h, w))
+                    for i, (img, mask) in enumerate(zip(imgs, masks)):
+                        preprocess_image(img, input_images[i:i + 1])
+                        preprocess_mask(mask, img.shape, input_masks[i:i + 1])
+                with stage('inference'):
+                    outputs = run_with_buffers(session, [input_images, input_masks], buffers)
+    
+    if outputs is None:
+        return [run_inpaint(img, mask, policy) for img, mask in zip(imgs, masks)]
+    with stage('postprocess'):
+        return [match_channels(postprocess_output(outputs[i:i + 1], img.shape), img) for i, img in enumerate(imgs)]
+
+# MI-GAN 模型作为修复后端之一，与 OpenCV 和纯色填充后端一起由选择器按区域选择
+register_backend(ModelBackend('migan', run_inpaint))
+
+# 从 OCR 结果中筛选水印，返回区域坐标下的水印框 (x, y, w, h) 列表
+def filter_ocr_results(results, region_shape):
+    right_region_h, right_region_w = region_shape[:2]
     
     # 初始化区域列表
     text_regions = []
-    doubao_regions = []
-    
-    # 使用 EasyOCR 进行检测
-    results = reader.readtext(right_region)
+    rule_set = get_rule_set()
     
     for (bbox, text, prob) in results:
-        # 转换边界框坐标
-        (top_left, top_right, bottom_right, bottom_left) = bbox
-        top_left = tuple(map(int, top_left))
-        bottom_right = tuple(map(int, bottom_right))
+        # 转换边界框坐标：OCR 返回的四边形可能带旋转，保留四边形并取其外接矩形
+        polygon = np.asarray(bbox, dtype=np.float32).reshape(-1, 2)
+        polygon = np.clip(np.round(polygon), 0, [right_region_w - 1, right_region_h - 1]).astype(np.int32)
+        top_left = (int(polygon[:, 0].min()), int(polygon[:, 1].min()))
+        bottom_right = (int(polygon[:, 0].max()), int(polygon[:, 1].max()))
         
         # 计算宽高
         w_text = bottom_right[0] - top_left[0]
         h_text = bottom_right[1] - top_left[1]
         
-        # 检查是否是水印
-        is_watermark = False
-        is_variant = False
-        
-        # 处理常见的变体形式
-        variant_patterns = [
-            r"豆包.*[AaIi][1l]",  # 豆包A1, 豆包a1, 豆包AI, 豆包Ai
-            r"豆.*[AaIi][1l].*生成",  # 豆A1生成, 豆@A1生成
-            r"豆包.*[0-9]+",  # 豆包41, 豆包123等
-        ]
-        import re
-        for pattern in variant_patterns:
-            if re.search(pattern, text):
-                is_watermark = True
-                is_variant = True
-                break
-        
-        # 如果不是变体，检查基础水印关键词
-        if not is_watermark:
-            watermark_keywords = ["豆包", "AI生成", "豆包AI", "AI", "生成"]
-            for keyword in watermark_keywords:
-                if keyword in text:
-                    is_watermark = True
-                    break
-        
-        # 根据水印类型设置不同的置信度阈值
-        if is_watermark:
-            if is_variant:
-                if prob > 0:
-                    # 直接使用原始检测到的区域，不进行扩展
-                    original_x = top_left[0]
-                    original_y = top_left[1]
-                    original_w = w_text
-                    original_h = h_text
-                    
-                    # 确保区域在图片边界内
-                    original_x = max(0, original_x)
-                    original_y = max(0, original_y)
-                    original_w = min(original_w, right_region_w - original_x)
-                    original_h = min(original_h, right_region_h - original_y)
-                    
-                    text_regions.append((original_x, original_y, original_w, original_h))
-                    doubao_regions.append((original_x, original_y, original_w, original_h))
-            else:
-                if prob > 0.5:
-                    # 直接使用原始检测到的区域，不进行扩展
-                    original_x = top_left[0]
-                    original_y = top_left[1]
-                    original_w = w_text
-                    original_h = h_text
-                    
-                    # 确保区域在图片范围内
-                    original_x = max(0, original_x)
-                    original_y = max(0, original_y)
-                    original_w = min(original_w, right_region_w - original_x)
-                    original_h = min(original_h, right_region_h - original_y)
-                    
-                    text_regions.append((original_x, original_y, original_w, original_h))
-                    doubao_regions.append((original_x, original_y, original_w, original_h))
+        # 按规则判断是否是水印，置信度阈值由命中的规则决定
+        rule = rule_set.classify(text, prob)
+        if rule is not None:
+            # 直接使用原始检测到的区域，不进行扩展，并确保区域在图片范围内
+            original_x = max(0, top_left[0])
+            original_y = max(0, top_left[1])
+            original_w = min(w_text, right_region_w - original_x)
+            original_h = min(h_text, right_region_h - original_y)
+            
+            text_regions.append(Region(original_x, original_y, original_w, original_h, polygon, rule.name, text, prob))
     
-    # 创建全局掩码
-    mask = np.ones((h, w), dtype=np.uint8) * 255
+    return text_regions
+
+# 对图像区域做 OCR，返回区域坐标下的水印框 (x, y, w, h) 列表
+def detect_text_regions(region):
+    # OCR 原始结果按区域像素缓存，与阈值无关
+    cache = get_cache()
+    key = image_digest(region) if cache is not None else None
+    results = cache.get('ocr', key) if cache is not None else None
     
-    for (x, y, w_cnt, h_cnt) in text_regions:
-        # 转换为原图坐标
-        global_x = x + start_x
-        global_y = y + start_y
-        
-        # 确保区域在图片范围内
-        global_x = max(0, global_x)
-        global_y = max(0, global_y)
-        w_cnt = min(w_cnt, w - global_x)
-        h_cnt = min(h_cnt, h - global_y)
-        
-        if w_cnt > 0 and h_cnt > 0:
-            # 在掩码上标记水印区域为黑色（0）
-            mask[global_y:global_y+h_cnt, global_x:global_x+w_cnt] = 0
+    if results is None:
+        # 使用 EasyOCR 进行检测（reader 在第一次使用时加载）
+        reader = get_reader()
+        with stage('ocr'):
+            results = reader.readtext(region)
+        if cache is not None:
+            cache.put('ocr', key, results)
+    
+    return filter_ocr_results(results, region.shape)
+
+# 批量 OCR：形状相同的区域合并为一次检测
+def detect_text_regions_batch(regions):
+    groups = {}
+    for i, region in enumerate(regions):
+        groups.setdefault(region.shape, []).append(i)
+    
+    text_regions = [[] for _ in regions]
+    cache = get_cache()
+    for shape, indices in groups.items():
+        # 已缓存 OCR 结果的区域不再重复检测
+        if cache is not None:
+            pending = []
+            for i in indices:
+                results = cache.get('ocr', image_digest(regions[i]))
+                if results is None:
+                    pending.append(i)
+                else:
+                    text_regions[i] = filter_ocr_results(results, shape)
+            indices = pending
+        if not indices:
+            continue
+        if len(indices) == 1:
+            text_regions[indices[0]] = detect_text_regions(regions[indices[0]])
+            continue
+        reader = get_reader()
+        with stage('ocr'):
+            batch_results = reader.readtext_batched([regions[i] for i in indices])
+        for i, results in zip(indices, batch_results):
+            if cache is not None:
+                cache.put('ocr', image_digest(regions[i]), results)
+            text_regions[i] = filter_ocr_results(results, shape)
+    return text_regions
+
+# 检测区域内的水印，大区域分块检测
+def detect_watermark(region):
+    return detect_tiled(region, detect_watermark_tile)
+
+# 检测单个分块：先用模板匹配，置信度不足时再运行 OCR
+def detect_watermark_tile(region):
+    with stage('template'):
+        template_regions = match_templates(region)
+    if template_regions:
+        return template_regions
+    return detect_text_regions(region)
+
+# 批量检测：模板未命中的区域再批量运行 OCR，需要分块的大区域逐个检测
+def detect_watermark_batch(regions):
+    tiled = [needs_tiling(region.shape) for region in regions]
+    with stage('template'):
+        detected = [[] if tiled[i] else match_templates(region) for i, region in enumerate(regions)]
+    for i, region in enumerate(regions):
+        if tiled[i]:
+            detected[i] = detect_watermark(region)
+    pending = [i for i, boxes in enumerate(detected) if not boxes and not tiled[i]]
+    if pending:
+        for i, boxes in zip(pending, detect_text_regions_batch([regions[i] for i in pending])):
+            detected[i] = boxes
+    return detected
+
+# 影响检测结果的配置，用于缓存键
+def get_detection_config(ocr_rois=None):
+    return {
+        'rois': list(ocr_rois or DEFAULT_ROIS),
+        'rules': get_rule_set().fingerprint,
+        'tiles': [OCR_TILE_SIZE, OCR_TILE_OVERLAP],
+        'template_threshold': TEMPLATE_THRESHOLD,
+        'templates': get_template_library().fingerprint,
+    }
+
+# 影响修复结果的配置，用于缓存键
+def get_inpaint_config(inpaint_mode=None, policy=None, backend=None):
+    model_path = get_inpaint_model()
+    return {
+        'mode': inpaint_mode or INPAINT_MODE,
+        'backend': backend or 'auto',
+        'tiles': [INPAINT_TILE_SIZE, INPAINT_TILE_OVERLAP, INPAINT_TILE_BLEND],
+        'policy': get_policy(policy),
+        'model': model_path,
+        'model_mtime': os.path.getmtime(model_path) if os.path.exists(model_path) else None,
+    }
+
+# 影响最终编码输出的配置，用于缓存键
+def get_output_config(fmt, inpaint_mode=None, ocr_rois=None, policy=None, backend=None):
+    return {
+        'detection': get_detection_config(ocr_rois),
+        'inpaint': get_inpaint_config(inpaint_mode, policy, backend),
+        'format': fmt,
+    }
+
+# 检测整张图片中的水印，结果按像素哈希和检测配置缓存
+def detect_watermark_regions(img, ocr_rois=None, digest=None):
+    cache = get_cache()
+    if cache is None:
+        return detect_in_rois(img, detect_watermark, ocr_rois)
+    
+    if digest is None:
+        digest = image_digest(img)
+    key = make_key(digest, get_detection_config(ocr_rois))
+    text_regions = cache.get('regions', key)
+    if text_regions is None:
+        text_regions = detect_in_rois(img, detect_watermark, ocr_rois)
+        cache.put('regions', key, text_regions)
+    return text_regions
+
+# 移除水印
+def remove_watermark(image, inpaint_mode=None, ocr_rois=None, digest=None, policy=None, backend=None):
+    # 读取图像
+    img = image
+    
+    # 先在候选区域内检测水印，全部未命中时回退到整张图片
+    text_regions = detect_watermark_regions(img, ocr_rois, digest)
     
     # 如果没有检测到水印，直接返回原图
     if not text_regions:
         return img
     
-    # 使用 inpaint 模型去除水印
-    model_path = get_inpaint_model()
-    session = ort.InferenceSession(model_path)
+    # 按区域选择修复后端去除水印
+    return inpaint_watermark(img, text_regions, inpaint_mode, policy, backend=backend)
+
+# 根据已知的水印框修复图像；backend 为 None 或 'auto' 时按区域自动选择修复后端，
+# 传入 choices 列表时依次记录每次修复使用的后端名
+def inpaint_watermark(img, text_regions, inpaint_mode=None, policy=None, mask=None, backend=None, choices=None):
+    if inpaint_mode is None:
+        inpaint_mode = INPAINT_MODE
     
-    # 预处理图像和掩码
-    input_image = preprocess_image(img)
-    input_mask = preprocess_mask(mask, img.shape)
+    # 创建全局掩码（视频等场景可以传入复用的掩码）
+    if mask is None:
+        mask = build_mask(img.shape, text_regions)
     
-    # 模型推理
-    inputs = {
-        session.get_inputs()[0].name: input_image,
-        session.get_inputs()[1].name: input_mask
-    }
-    outputs = session.run(None, inputs)
+    def inpaint_fn(target, target_mask):
+        chosen = select_backend(target, target_mask, backend)
+        if choices is not None:
+            choices.append(chosen.name)
+        return chosen.inpaint(target, target_mask, policy)
     
-    # 后处理输出
-    output_image = postprocess_output(outputs[0], img.shape)
+    # 只修复水印周围的裁剪块，或对整张图片修复
+    if inpaint_mode == 'region':
+        return inpaint_regions(img, mask, text_regions, inpaint_fn)
+    if inpaint_mode == 'tiled':
+        # 只有模型后端需要分块，OpenCV 和填充后端的耗时只与掩码大小有关
+        chosen = select_backend(img, mask, backend)
+        if choices is not None:
+            choices.append(chosen.name)
+        if chosen.name == 'migan':
+            return run_inpaint_tiled(img, mask, policy)
+        return chosen.inpaint(img, mask, policy)
+    return inpaint_fn(img, mask)
+
+# 分块修复：只对包含掩码的分块运行模型，拼接后只把掩码区域合成回原图
+def run_inpaint_tiled(img, mask, policy=None):
+    policy = get_policy(policy)
+    stitched, report = inpaint_tiled(
+        img, mask,
+        lambda imgs, masks: run_inpaint_batch(imgs, masks, policy),
+        INPAINT_TILE_SIZE, INPAINT_TILE_OVERLAP, INPAINT_TILE_BATCH, INPAINT_TILE_BLEND
+    )
+    annotate('inpaint_tiles', report)
+    return recomposite(img, mask, stitched, policy['blend_radius'])
+
+# 修复视频帧（只处理水印周围的裁剪块），可以在工作进程中调用
+def inpaint_frame(frame, text_regions, mask=None, policy=None, backend=None):
+    return inpaint_watermark(frame, text_regions, 'region', policy, mask, backend)
+
+# 批量移除水印，返回与输入一一对应的 {'result': 图像, 'regions': 水印框, 'backends': 修复后端} 或 {'error': 错误信息}；
+# 只有选中模型后端的图像或裁剪块参与批量推理，其余直接在 CPU 上修复
+def remove_watermarks(images, inpaint_mode=None, ocr_rois=None, policy=None, backend=None):
+    if inpaint_mode is None:
+        inpaint_mode = INPAINT_MODE
     
-    return output_image
+    outputs = [None] * len(images)
+    valid = []
+    for i, img in enumerate(images):
+        if img is None or not hasattr(img, 'shape') or img.ndim not in (2, 3) or img.size == 0:
+            outputs[i] = {'error': 'Invalid image'}
+        else:
+            valid.append(i)
+    
+    # 批量检测，失败时逐张检测以隔离出错的图片
+    detected = {}
+    try:
+        batch_regions = detect_in_rois_batch([images[i] for i in valid], detect_watermark_batch, ocr_rois)
+        detected = dict(zip(valid, batch_regions))
+    except Exception:
+        for i in valid:
+            try:
+                detected[i] = detect_in_rois(images[i], detect_watermark, ocr_rois)
+            except Exception as e:
+                outputs[i] = {'error': str(e)}
+    
+    # 收集需要修复的图像或裁剪块，按形状分组批量推理
+    jobs = []
+    for i in valid:
+        if i not in detected:
+            continue
+        img, text_regions = images[i], detected[i]
+        if not text_regions:
+            outputs[i] = {'result': img, 'regions': [], 'backends': []}
+            continue
+        try:
+            mask = build_mask(img.shape, text_regions)
+            if inpaint_mode == 'tiled':
+                # 分块修复内部已经按分块批量推理
+                choices = []
+                result = inpaint_watermark(img, text_regions, 'tiled', policy, mask, backend, choices)
+                outputs[i] = {'result': result, 'regions': text_regions, 'backends': choices}
+                continue
+            if inpaint_mode == 'region':
+                outputs[i] = {'result': img.copy(), 'regions': text_regions, 'backends': []}
+                targets = extract_crops(img, mask, text_regions)
+            else:
+                outputs[i] = {'result': None, 'regions': text_regions, 'backends': []}
+                targets = [(None, img, mask)]
+            for window, target, target_mask in targets:
+                chosen = select_backend(target, target_mask, backend)
+                outputs[i]['backends'].append(chosen.name)
+                if chosen.name == 'migan':
+                    jobs.append((i, window, target, target_mask))
+                else:
+                    place_inpainted(outputs[i], window, target, target_mask, chosen.inpaint(target, target_mask, policy))
+        except Exception as e:
+            outputs[i] = {'error': str(e)}
+    
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job[2].shape, []).append(job)
+    
+    for group in groups.values():
+        try:
+            inpainted = run_inpaint_batch([job[2] for job in group], [job[3] for job in group], policy)
+        except Exception:
+            # 整组失败时逐个重试，只让出错的图片返回错误
+            inpainted = []
+            for job in group:
+                try:
+                    inpainted.append(run_inpaint(job[2], job[3], policy))
+                except Exception as e:
+                    outputs[job[0]] = {'error': str(e)}
+                    inpainted.append(None)
+        
+        for (i, window, crop_img, crop_mask), output in zip(group, inpainted):
+            if output is None or 'error' in outputs[i]:
+                continue
+            try:
+                place_inpainted(outputs[i], window, crop_img, crop_mask, output)
+            except Exception as e:
+                outputs[i] = {'error': str(e)}
+    
+    return outputs
+
+# 把修复结果写回批量输出：整张图片直接替换，裁剪块混合回结果图像
+def place_inpainted(output, window, img, mask, inpainted):
+    if window is None:
+        output['result'] = inpainted
+    else:
+        blend_crop(output['result'], window, img, mask, inpainted)
 
 # 解析 multipart/form-data 请求
 def parse_multipart_form_data(event):
-    import urllib.parse
-    import email
-    from io import BytesIO
-    
     body = event.get('body', '')
     content_type = event.get('headers', {}).get('content-type', '')
     
     if not body or 'multipart/form-data' not in content_type:
         return {}
     
-    # 解析边界
-    boundary = content_type.split('boundary=')[1].encode('utf-8')
-    body = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode('utf-8')
+    # 本地服务器直接传入原始字节，Vercel 传入 base64 字符串
+    if isinstance(body, str):
+        body = base64.b64decode(body) if event.get('isBase64Encoded') else body.encode('utf-8')
     
-    # 解析表单数据
-    form_data = {}
-    message = email.message_from_bytes(b'Content-Type: ' + content_type.encode('utf-8') + b'\n\n' + body)
+    # 字段内容是请求体上的 memoryview 切片，不产生拷贝
+    return parse_multipart(body, content_type)
+
+# 批量处理多个上传文件，单张图片出错不影响其他图片
+def handle_batch(files, debug=False, backend=None, policy=None):
+    if not isinstance(files, list):
+        files = [files]
     
-    for part in message.get_payload():
-        if part.get_content_maintype() == 'multipart':
-            continue
-        
-        name = part.get_param('name', header='content-disposition')
-        filename = part.get_filename()
-        
-        if name:
-            if filename:
-                # 文件字段
-                form_data[name] = {
-                    'filename': filename,
-                    'content': part.get_payload(decode=True)
-                }
-            else:
-                # 普通字段
-                form_data[name] = part.get_payload(decode=True).decode('utf-8')
+    images = []
+    for file_data in files:
+        images.append(cv2.imdecode(np.frombuffer(file_data['content'], np.uint8), cv2.IMREAD_COLOR))
+    
+    results = []
+    for file_data, img, output in zip(files, images, remove_watermarks(images, policy=policy, backend=backend)):
+        item = {'filename': file_data['filename']}
+        if img is None:
+            item['error'] = 'Failed to read image'
+        elif 'error' in output:
+            item['error'] = output['error']
+        else:
+            buffer = encode_image(output['result'], 'png')
+            item['result'] = base64.b64encode(buffer).decode('utf-8')
+            item['backends'] = output['backends']
+            if debug:
+                item['regions'] = describe_regions(output['regions'])
+        results.append(item)
+    
+    return {
+        'statusCode': 200,
+        'headers': cors_headers,
+        'body': json.dumps({'results': results})
+    }
+
+# 视频和动图是否返回原始字节：?format=<容器格式> 或 Accept 中该类型的优先级高于 JSON
+def wants_raw_video(event, container):
+    query = event.get('queryStringParameters') or {}
+    requested = (query.get('format') or '').strip().lower()
+    if requested:
+        return requested != 'json'
+    mime = CONTAINERS[container][1]
+    for media, _ in parse_accept(event.get('headers', {}).get('accept')):
+        if media in (mime, mime.split('/')[0] + '/*'):
+            return True
+        if media in ('application/json', 'text/plain', '*/*', 'text/*', 'application/*'):
+            break
+    return False
+
+# 处理视频或多帧动图：只在关键帧上检测，输出与输入相同的容器格式
+def handle_video(event, data, container):
+    query = event.get('queryStringParameters') or {}
+    try:
+        policy = get_policy(parse_policy_params(query))
+        backend = parse_backend(query.get('backend'))
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    try:
+        with stage('video'):
+            buffer, stats = process_bytes(
+                data, container, detect_watermark_regions,
+                lambda frame, regions, mask: inpaint_frame(frame, regions, mask, policy, backend)
+            )
+    except VideoDecodeError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    if wants_raw_video(event, container):
+        return build_binary_response(event, buffer, CONTAINERS[container][1])
+    
+    payload = {'result': base64.b64encode(buffer).decode('utf-8'), 'format': container}
+    payload.update(stats)
+    return {
+        'statusCode': 200,
+        'headers': cors_headers,
+        'body': json.dumps(payload)
+    }
+
+# 后台任务的处理函数：解码、检测、修复、编码，返回 (结果字节, MIME 类型)
+def process_job(data, params, progress):
+    progress('decode', 0.05)
+    policy = get_policy(params.get('policy'))
+    backend = params.get('backend')
+    container = detect_container(data)
+    if container is not None:
+        progress('video', 0.1)
+        buffer, _ = process_bytes(
+            data, container, detect_watermark_regions,
+            lambda frame, regions, mask: inpaint_frame(frame, regions, mask, policy, backend)
+        )
+        return buffer, CONTAINERS[container][1]
+    
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('Failed to read image')
+    
+    progress('detect', 0.1)
+    text_regions = detect_watermark_regions(img)
+    progress('inpaint', 0.5)
+    result = inpaint_watermark(img, text_regions, policy=policy, backend=backend) if text_regions else img
+    progress('encode', 0.9)
+    buffer = encode_image(result, params['format'], params.get('quality')).tobytes()
+    return buffer, FORMATS[params['format']][1]
+
+# 任务模式：保存输入并返回任务 ID，相同图片和参数的重复提交返回已有的任务
+def handle_job_submit(event, file_data):
+    manager = get_job_manager()
+    if manager is None:
+        return {
+            'statusCode': 501,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Job mode requires a local server with job workers'})
+        }
     
-    return form_data
+    query = event.get('queryStringParameters') or {}
+    try:
+        policy = parse_policy_params(query)
+        get_policy(policy)
+        backend = parse_backend(query.get('backend'))
+    except ValueError as e:
+        return {
+            'statusCode': 400,
+            'headers': cors_headers,
+            'body': json.dumps({'error': str(e)})
+        }
+    # 任务结果总是原始字节：没有通过 ?format= 或 Accept 指定图片格式时与输入格式相同
+    input_format = detect_format(file_data['content'])
+    mode, fmt, quality = negotiate(event.get('headers', {}).get('accept'), query, input_format)
+    if mode == 'json':
+        fmt = input_format or 'png'
+    
+    job, created = manager.submit(
+        file_data['content'], {'format': fmt, 'quality': quality, 'policy': policy, 'backend': backend}
+    )
+    base = urllib.parse.urlsplit(event.get('path') or '/api').path.rstrip('/')
+    base = base[:-len('/jobs')] if base.endswith('/jobs') else base
+    job.update({
+        'deduplicated': not created,
+        'status_url': f"{base}/jobs/{job['id']}",
+        'result_url': f"{base}/jobs/{job['id']}/result",
+    })
+    return {
+        'statusCode': 202,
+        'headers': cors_headers,
+        'body': json.dumps(job)
+    }
+
+# 查询任务：GET .../jobs/<id>?wait=秒数 返回状态（支持长轮询），GET .../jobs/<id>/result 返回结果字节
+def handle_job_get(event):
+    path = urllib.parse.urlsplit(event.get('path') or '').path.rstrip('/')
+    parts = path.split('/')
+    want_result = parts[-1] == 'result'
+    if want_result:
+        parts = parts[:-1]
+    manager = get_job_manager()
+    if len(parts) < 2 or parts[-2] != 'jobs' or manager is None:
+        return {
+            'statusCode': 404,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Not found'})
+        }
+    
+    job_id = parts[-1]
+    query = event.get('queryStringParameters') or {}
+    try:
+        wait = float(query.get('wait') or 0)
+    except ValueError:
+        wait = 0.0
+    job = manager.wait(job_id, wait) if wait > 0 and not want_result else manager.get(job_id)
+    if job is None:
+        return {
+            'statusCode': 404,
+            'headers': cors_headers,
+            'body': json.dumps({'error': 'Job not found or expired'})
+        }
+    
+    if not want_result:
+        return {
+            'statusCode': 200,
+            'headers': cors_headers,
+            'body': json.dumps(job)
+        }
+    if job['status'] != 'done':
+        return {
+            'statusCode': 409,
+            'headers': cors_headers,
+            'body': json.dumps({'error': f"Job is {job['status']}", 'job': job})
+        }
+    return build_binary_response(event, manager.result(job_id), job['content_type'])
+
+# 构建返回原始图片字节的响应；本地服务器直接写出字节，Vercel 需要 base64 编码的响应体
+def build_binary_response(event, data, content_type, extra_headers=None):
+    headers = dict(cors_headers)
+    headers['Content-Type'] = content_type
+    headers['Vary'] = 'Accept'
+    if extra_headers:
+        headers.update(extra_headers)
+        headers['Access-Control-Expose-Headers'] = ', '.join(extra_headers)
+    if event.get('rawResponseBody'):
+        return {'statusCode': 200, 'headers': headers, 'body': data}
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+# 水印框的描述：坐标、四边形、命中的规则、识别出的文字和置信度
+def describe_regions(text_regions):
+    described = []
+    for region in text_regions:
+        item = {
+            'box': [int(v) for v in region[:4]],
+            'rule': getattr(region, 'rule', None),
+            'text': getattr(region, 'text', None),
+            'score': getattr(region, 'score', None),
+        }
+        polygon = getattr(region, 'polygon', None)
+        if polygon is not None:
+            item['polygon'] = polygon.tolist()
+        described.append(item)
+    return described
+
+# 请求模式：?mode= 优先，其次是路径后缀（/api/detect、/api/inpaint、/api/jobs），默认完整去水印
+def get_request_mode(event):
+    query = event.get('queryStringParameters') or {}
+    mode = (query.get('mode') or '').strip().lower()
+    if mode:
+        return mode
+    path = urllib.parse.urlsplit(event.get('path') or '').path.rstrip('/')
+    name = path.rsplit('/', 1)[-1]
+    if name == 'jobs':
+        return 'job'
+    return name if name in ('detect', 'inpaint') else 'remove'
+
+# 仅检测：返回水印框、文字和置信度
+def handle_detect(event, img):
+    with stage('detect'):
+        text_regions = detect_watermark_regions(img)
+    payload = {
+        'watermarked': bool(text_regions),
+        'width': int(img.shape[1]),
+        'height': int(img.shape[0]),
+        'regions': describe_regions(text_regions),
+    }
+    trace = current_trace()
+    if trace is not None and wants_debug(event):
+        payload['timings'] = trace.to_dict()
+    return {
+        'statusCode': 200,
+        'headers': cors_headers,
+        'body': json.dumps(payload)
+    }
+
+# 仅修复的输入：mask 文件字段（白色为水印）或 boxes 字段（JSON [[x, y, w, h], ...]），返回 (水印框, 掩码)
+def parse_inpaint_input(form_data, img_shape):
+    mask_file = form_data.get('mask')
+    if isinstance(mask_file, dict):
+        user_mask = cv2.imdecode(np.frombuffer(mask_file['content'], np.uint8), cv2.IMREAD_GRAYSCALE)
+        if user_mask is None:
+            raise ValueError('Failed to read mask')
+        mask = normalize_user_mask(user_mask, img_shape)
+        return regions_from_mask(mask), mask
+    
+    boxes = form_data.get('boxes')
+    if isinstance(boxes, str) and boxes.strip():
+        text_regions = parse_boxes(boxes, img_shape)
+        return text_regions, build_mask(img_shape, text_regions)
+    
+    raise ValueError('Inpaint mode requires a mask file or a boxes field')
+
+# 请求是否要求返回调试信息（?debug=1）
+def wants_debug(event):
+    query = event.get('queryStringParameters') or {}
+    return query.get('debug') in ('1', 'true', 'timing')
 
 # Vercel 原生 Serverless 函数
 def handler(event, context):
+    # 开启统计或请求调试信息时记录各阶段耗时，并通过 Server-Timing 头返回
+    if event.get('httpMethod') != 'POST' or not (TRACING_ENABLED or wants_debug(event)):
+        return handle_event(event, context)
+    
+    trace, token = start_trace()
+    try:
+        response = handle_event(event, context)
+    finally:
+        end_trace(token)
+    response['headers'] = dict(response.get('headers') or {}, **{'Server-Timing': trace.server_timing()})
+    return response
+
+# 处理单个请求
+def handle_event(event, context):
     try:
         # 处理 OPTIONS 请求
         if event.get('httpMethod') == 'OPTIONS':
@@ -251,22 +780,85 @@ def handler(event, context):
                 'body': ''
             }
         
+        # 查询异步任务的状态和结果
+        if event.get('httpMethod') == 'GET':
+            return handle_job_get(event)
+        
         # 处理 POST 请求
         if event.get('httpMethod') == 'POST':
             # 解析表单数据
-            form_data = parse_multipart_form_data(event)
+            try:
+                with stage('parse'):
+                    form_data = parse_multipart_form_data(event)
+            except PartTooLarge as e:
+                return {
+                    'statusCode': 413,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': str(e)})
+                }
+            except MultipartError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            # 请求模式：完整去水印、仅检测或仅修复
+            request_mode = get_request_mode(event)
+            if request_mode not in REQUEST_MODES:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': f'Unknown mode: {request_mode}'})
+                }
+            
+            # 批量模式：images 字段或多个 image 文件
+            if 'images' in form_data or isinstance(form_data.get('image'), list):
+                if request_mode != 'remove':
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Batch requests only support the remove mode'})
+                    }
+                query = event.get('queryStringParameters') or {}
+                try:
+                    policy = get_policy(parse_policy_params(query))
+                    backend = parse_backend(query.get('backend'))
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': str(e)})
+                    }
+                # 每一项都必须是文件字段，同名的文本字段不能当作图片处理
+                files = form_data['images'] if 'images' in form_data else form_data['image']
+                files = files if isinstance(files, list) else [files]
+                if not all(isinstance(file_data, dict) for file_data in files):
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': 'Image fields must be file uploads'})
+                    }
+                return handle_batch(files, wants_debug(event), backend, policy)
             
             # 检查请求中是否有文件
-            if 'image' not in form_data:
+            if not isinstance(form_data.get('image'), dict):
                 return {
                     'statusCode': 400,
                     'headers': cors_headers,
                     'body': json.dumps({'error': 'No image file provided'})
                 }
             
-            # 读取图像文件
+            # 读取图像文件，视频和多帧动图逐帧处理
             file_data = form_data['image']
-            img = cv2.imdecode(np.frombuffer(file_data['content'], np.uint8), cv2.IMREAD_COLOR)
+            if request_mode == 'job':
+                return handle_job_submit(event, file_data)
+            container = detect_container(file_data['content']) if request_mode == 'remove' else None
+            if container is not None:
+                return handle_video(event, file_data['content'], container)
+            
+            with stage('decode'):
+                img = cv2.imdecode(np.frombuffer(file_data['content'], np.uint8), cv2.IMREAD_COLOR)
             
             if img is None:
                 return {
@@ -275,17 +867,94 @@ def handler(event, context):
                     'body': json.dumps({'error': 'Failed to read image'})
                 }
             
-            # 移除水印
-            result = remove_watermark(img)
+            # 仅检测：不加载修复模型
+            if request_mode == 'detect':
+                return handle_detect(event, img)
             
-            # 将结果转换为 base64
-            _, buffer = cv2.imencode('.png', result)
+            # 单次请求的修复分辨率策略（?max_side=&interpolation=&blend_radius=）和修复后端（?backend=）
+            query = event.get('queryStringParameters') or {}
+            try:
+                policy = get_policy(parse_policy_params(query))
+                backend = parse_backend(query.get('backend'))
+            except ValueError as e:
+                return {
+                    'statusCode': 400,
+                    'headers': cors_headers,
+                    'body': json.dumps({'error': str(e)})
+                }
+            
+            # 内容协商：原始图片字节或旧版 JSON，默认与输入格式相同
+            mode, fmt, quality = negotiate(
+                event.get('headers', {}).get('accept'),
+                event.get('queryStringParameters'),
+                detect_format(file_data['content'])
+            )
+            
+            if request_mode == 'inpaint':
+                # 仅修复：使用客户端提供的掩码或水印框，跳过 OCR
+                try:
+                    text_regions, mask = parse_inpaint_input(form_data, img.shape)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': cors_headers,
+                        'body': json.dumps({'error': str(e)})
+                    }
+                backends = []
+                if text_regions:
+                    result = inpaint_watermark(img, text_regions, policy=policy, mask=mask, backend=backend,
+                                               choices=backends)
+                else:
+                    result = img
+                with stage('encode'):
+                    buffer = encode_image(result, fmt, quality).tobytes()
+            else:
+                # 相同像素和配置的请求直接返回缓存的编码结果和使用的修复后端
+                cache = get_cache()
+                digest = image_digest(img) if cache is not None else None
+                output_key = make_key(
+                    digest, get_output_config(f'{fmt}:{quality}', policy=policy, backend=backend)
+                ) if cache is not None else None
+                cached = cache.get('output', output_key) if cache is not None else None
+                
+                text_regions = None
+                if cached is not None:
+                    buffer, backends = cached
+                else:
+                    # 移除水印
+                    text_regions = detect_watermark_regions(img, digest=digest)
+                    backends = []
+                    result = inpaint_watermark(img, text_regions, policy=policy, backend=backend,
+                                               choices=backends) if text_regions else img
+                    
+                    with stage('encode'):
+                        buffer = encode_image(result, fmt, quality).tobytes()
+                    if cache is not None:
+                        cache.put('output', output_key, (buffer, backends))
+            
+            if mode == 'binary':
+                extra_headers = {'X-Inpaint-Backend': ','.join(dict.fromkeys(backends))} if backends else None
+                return build_binary_response(event, buffer, FORMATS[fmt][1], extra_headers)
+            
+            # 旧版响应：将结果转换为 base64 放在 JSON 中，附带每个修复区域使用的后端
             img_str = base64.b64encode(buffer).decode('utf-8')
+            payload = {'result': img_str, 'backends': backends}
+            
+            # 调试模式下附带各阶段耗时
+            trace = current_trace()
+            if trace is not None and wants_debug(event):
+                payload['timings'] = trace.to_dict()
+            
+            # 调试模式下附带水印框和命中的规则
+            if wants_debug(event):
+                if text_regions is None:
+                    text_regions = detect_watermark_regions(img, digest=digest)
+                payload['regions'] = describe_regions(text_regions)
             
             return {
                 'statusCode': 200,
                 'headers': cors_headers,
-                'body': json.dumps({'result': img_str})
+                'body': json.dumps(payload)
             }
         
         # 不支持的请求方法
@@ -303,3 +972,6 @@ def handler(event, context):
             'headers': cors_headers,
             'body': json.dumps({'error': f'{str(e)} - {error_trace[:200]}'})
         }
+
+# 模块导入耗时（不包含模型加载）
+IMPORT_SECONDS = time.perf_counter() - _import_started
@@ -0,0 +1,335 @@
+"""
+异步任务
+
+大图和视频可能超过单次 Serverless 调用的时限。任务模式下 POST 立即返回任务 ID，
+实际处理由本地服务器中的工作线程完成：任务队列保存在 SQLite 中（进程重启后未完成的任务会重新排队），
+输入和结果以文件形式保存在任务目录下。相同输入和参数的任务只处理一次，
+完成或失败的任务在 TTL 到期后连同文件一起删除
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+
+# 任务目录：SQLite 数据库以及输入、结果文件
+JOB_DIR = os.environ.get('WATERMARK_JOB_DIR', os.path.join(tempfile.gettempdir(), 'watermark-remover-jobs'))
+# 完成或失败的任务保留的秒数
+JOB_TTL = int(os.environ.get('WATERMARK_JOB_TTL', '3600'))
+# 本地服务器默认启动的任务工作线程数
+JOB_WORKERS = int(os.environ.get('WATERMARK_JOB_WORKERS', '1'))
+# 长轮询最长等待秒数
+MAX_WAIT_SECONDS = 30.0
+# 清理过期任务的间隔（秒）
+PURGE_INTERVAL = 60.0
+
+FINISHED = ('done', 'failed')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    params TEXT NOT NULL,
+    content_type TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+'''
+
+# 返回给客户端的字段
+PUBLIC_FIELDS = ('id', 'status', 'stage', 'progress', 'content_type', 'error', 'created', 'updated', 'expires')
+
+
+# 任务的去重键：输入字节和处理参数的哈希
+def job_key(data, params):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(data)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class JobStore:
+    """SQLite 任务队列，每次操作使用独立的连接，可以被多个线程同时使用"""
+
+    def __init__(self, directory=None, ttl=None):
+        self.directory = directory or JOB_DIR
+        self.ttl = JOB_TTL if ttl is None else ttl
+        self.data_dir = os.path.join(self.directory, 'data')
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.db_path = os.path.join(self.directory, 'jobs.sqlite3')
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return _Connection(conn)
+
+    def input_path(self, job_id):
+        return os.path.join(self.data_dir, job_id + '.input')
+
+    def result_path(self, job_id):
+        return os.path.join(self.data_dir, job_id + '.result')
+
+    # 提交任务，返回 (任务, 是否新建)；相同输入和参数的未过期任务直接复用
+    def submit(self, data, params):
+        key = job_key(data, params)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE key = ? AND status != 'failed' AND (expires IS NULL OR expires > ?) "
+                "ORDER BY created DESC LIMIT 1",
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                conn.execute('COMMIT')
+                return dict(row), False
+
+            job_id = uuid.uuid4().hex
+            _write_atomic(self.input_path(job_id), data)
+            conn.execute(
+                "INSERT INTO jobs (id, key, status, stage, progress, params, created, updated) "
+                "VALUES (?, ?, 'queued', 'queued', 0, ?, ?, ?)",
+                (job_id, key, json.dumps(params, sort_keys=True), now, now)
+            )
+            conn.execute('COMMIT')
+        return self.get(job_id), True
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None or (row['expires'] is not None and row['expires'] <= time.time()):
+            return None
+        return dict(row)
+
+    # 取出最早排队的任务并标记为运行中，没有任务时返回 None
+    def claim(self):
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' ORDER BY created LIMIT 1"
+            ).fetchone()
+            if row is None:
+                conn.execute('COMMIT')
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'running', updated = ? WHERE id = ?",
+                (time.time(), row['id'])
+            )
+            conn.execute('COMMIT')
+        job = dict(row)
+        job['status'] = 'running'
+        return job
+
+    def read_input(self, job_id):
+        with open(self.input_path(job_id), 'rb') as f:
+            return f.read()
+
+    def read_result(self, job_id):
+        with open(self.result_path(job_id), 'rb') as f:
+            return f.read()
+
+    def set_progress(self, job_id, stage, progress):
+        with self._connect() as conn:
+            conn.execute(
+                'UPDATE jobs SET stage = ?, progress = ?, updated = ? WHERE id = ?',
+                (stage, float(progress), time.time(), job_id)
+            )
+
+    def finish(self, job_id, data, content_type):
+        _write_atomic(self.result_path(job_id), data)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'done', stage = 'done', progress = 1, content_type = ?, "
+                "updated = ?, expires = ? WHERE id = ?",
+                (content_type, now, now + self.ttl, job_id)
+            )
+        _remove(self.input_path(job_id))
+
+    def fail(self, job_id, error):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', stage = 'failed', error = ?, updated = ?, expires = ? "
+                "WHERE id = ?",
+                (error, now, now + self.ttl, job_id)
+            )
+        _remove(self.input_path(job_id))
+
+    # 进程重启后把中断的任务重新排队
+    def requeue_running(self):
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0 WHERE status = 'running'"
+            ).rowcount
+
+    # 删除过期的任务及其文件，返回删除的任务数
+    def purge_expired(self):
+        with self._connect() as conn:
+            ids = [row['id'] for row in conn.execute(
+                'SELECT id FROM jobs WHERE expires IS NOT NULL AND expires <= ?', (time.time(),)
+            )]
+            for job_id in ids:
+                _remove(self.input_path(job_id))
+                _remove(self.result_path(job_id))
+                conn.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+        return len(ids)
+
+
+class _Connection:
+    """用完即关闭的 SQLite 连接"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, *args):
+        return self.conn.execute(*args)
+
+    def executescript(self, script):
+        return self.conn.executescript(script)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.conn.in_transaction:
+            self.conn.execute('ROLLBACK')
+        self.conn.close()
+
+
+def _write_atomic(path, data):
+    tmp = path + '.part'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class JobManager:
+    """任务工作线程：process_fn(data, params, progress) 返回 (结果字节, MIME 类型)，
+    progress(stage, fraction) 用于上报进度"""
+
+    def __init__(self, process_fn, store=None, workers=None):
+        self.process_fn = process_fn
+        self.store = store or JobStore()
+        self.workers = JOB_WORKERS if workers is None else workers
+        self._changed = threading.Condition()
+        self._threads = []
+        self._stopping = False
+        self._last_purge = 0.0
+
+    def start(self):
+        requeued = self.store.requeue_running()
+        if requeued:
+            print(f"重新排队 {requeued} 个中断的任务")
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'watermark-job-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopping = True
+        self._notify()
+
+    def submit(self, data, params):
+        job, created = self.store.submit(data, params)
+        if created:
+            self._notify()
+        return public_job(job), created
+
+    def get(self, job_id):
+        job = self.store.get(job_id)
+        return public_job(job) if job is not None else None
+
+    # 长轮询：等待任务完成或超时，返回最新状态
+    def wait(self, job_id, timeout):
+        deadline = time.monotonic() + min(max(0.0, timeout), MAX_WAIT_SECONDS)
+        while True:
+            job = self.get(job_id)
+            remaining = deadline - time.monotonic()
+            if job is None or job['status'] in FINISHED or remaining <= 0:
+                return job
+            with self._changed:
+                self._changed.wait(min(remaining, 1.0))
+
+    def result(self, job_id):
+        return self.store.read_result(job_id)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _purge(self):
+        now = time.monotonic()
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = now
+            self.store.purge_expired()
+
+    def _worker(self):
+        while not self._stopping:
+            self._purge()
+            job = self.store.claim()
+            if job is None:
+                with self._changed:
+                    self._changed.wait(1.0)
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job_id = job['id']
+
+        def progress(stage, fraction):
+            self.store.set_progress(job_id, stage, fraction)
+            self._notify()
+
+        try:
+            data = self.store.read_input(job_id)
+            result, content_type = self.process_fn(data, json.loads(job['params']), progress)
+            self.store.finish(job_id, result, content_type)
+        except Exception as e:
+            self.store.fail(job_id, str(e))
+        self._notify()
+
+
+# 任务的公开字段
+def public_job(job):
+    return {field: job.get(field) for field in PUBLIC_FIELDS}
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+# 启动进程内的任务工作线程（由本地服务器调用），重复调用返回同一个实例
+def start_job_manager(process_fn, workers=None, store=None):
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(process_fn, store, workers).start()
+    return _manager
+
+
+# 获取已经启动的任务管理器；Serverless 环境中没有后台线程，返回 None
+def get_job_manager():
+    return _manager
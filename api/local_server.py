@@ -3,23 +3,39 @@
 本地测试服务器，用于模拟Vercel运行时环境，测试Serverless函数
 """
 
+import time
+
+# 进程启动时间，用于统计冷启动耗时
+PROCESS_STARTED = time.perf_counter()
+
 import http.server
-import socketserver
+import sys
 import json
-import base64
-from io import BytesIO
-from api.index import handler
+import urllib.parse
+from api.index import handler, process_job, warmup, IMPORT_SECONDS
+from api.jobs import JOB_WORKERS, start_job_manager
+from api.multipart import PartTooLarge, read_body
+from api.tracing import render_prometheus
 
 PORT = 5000
 
+# 已经记录过首个响应耗时的请求方法
+_first_response_logged = set()
+
 class VercelLocalHandler(http.server.BaseHTTPRequestHandler):
+    def _log_first_response(self, method):
+        """记录进程启动到每种请求方法首次响应的耗时"""
+        if method not in _first_response_logged:
+            _first_response_logged.add(method)
+            print(f"首个 {method} 响应耗时: {time.perf_counter() - PROCESS_STARTED:.3f}s")
+    
     def _set_headers(self, status_code=200, headers=None):
         self.send_response(status_code)
         
         # 设置CORS头
         cors_headers = {
             'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
             'Access-Control-Allow-Headers': 'Content-Type'
         }
         
@@ -27,24 +43,52 @@ class VercelLocalHandler(http.server.BaseHTTPRequestHandler):
         if headers:
             cors_headers.update(headers)
         
+        # 默认返回 JSON，handler 返回图片时使用其 Content-Type
+        if 'Content-Type' not in cors_headers:
+            cors_headers['Content-Type'] = 'application/json'
+        
         # 发送所有头
         for key, value in cors_headers.items():
             self.send_header(key, value)
         
-        self.send_header('Content-Type', 'application/json')
         self.end_headers()
     
     def do_OPTIONS(self):
         """处理OPTIONS请求"""
         self._set_headers(200)
         self.wfile.write(b'')
+        self._log_first_response('OPTIONS')
+    
+    def do_GET(self):
+        """处理GET请求，/metrics 返回 Prometheus 格式的分阶段统计，其余交给 handler（异步任务查询）"""
+        if urllib.parse.urlsplit(self.path).path.rstrip('/').endswith('/metrics'):
+            body = render_prometheus().encode('utf-8')
+            self._set_headers(200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+            self.wfile.write(body)
+            return
+        event = {
+            'httpMethod': 'GET',
+            'headers': {'accept': self.headers.get('Accept', '')},
+            'path': self.path,
+            'queryStringParameters': dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query)),
+            'rawResponseBody': True,
+        }
+        response = handler(event, None)
+        self._set_headers(response['statusCode'], response.get('headers', {}))
+        self.wfile.write(response['body'].encode('utf-8') if isinstance(response['body'], str) else response['body'])
     
     def do_POST(self):
         """处理POST请求"""
         try:
-            # 读取请求体
+            # 读取请求体到预分配的缓冲区
             content_length = int(self.headers['Content-Length'])
-            body = self.rfile.read(content_length)
+            try:
+                body = read_body(self.rfile, content_length)
+            except PartTooLarge as e:
+                self.close_connection = True
+                self._set_headers(413)
+                self.wfile.write(json.dumps({'error': str(e)}).encode('utf-8'))
+                return
             
             # 构建Vercel事件对象
             event = {
@@ -53,12 +97,16 @@ class VercelLocalHandler(http.server.BaseHTTPRequestHandler):
                     'content-type': self.headers.get('Content-Type', ''),
                     'content-length': self.headers.get('Content-Length', ''),
                     'host': self.headers.get('Host', ''),
+                    'accept': self.headers.get('Accept', ''),
                     'user-agent': self.headers.get('User-Agent', '')
                 },
-                'body': body.decode('utf-8') if isinstance(body, bytes) else body,
+                # 请求体以原始字节传给 handler，不做 base64 编码
+                'body': body,
                 'isBase64Encoded': False,
                 'path': self.path,
-                'queryStringParameters': {},
+                'queryStringParameters': dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query)),
+                # 图片响应直接返回原始字节，不做 base64 编码
+                'rawResponseBody': True,
                 'requestContext': {
                     'http': {
                         'method': 'POST',
@@ -68,18 +116,13 @@ class VercelLocalHandler(http.server.BaseHTTPRequestHandler):
                 }
             }
             
-            # 处理multipart/form-data请求
-            if 'multipart/form-data' in self.headers.get('Content-Type', ''):
-                # 对于multipart/form-data，body需要是base64编码
-                event['body'] = base64.b64encode(body).decode('utf-8')
-                event['isBase64Encoded'] = True
-            
             # 调用Vercel handler函数
             response = handler(event, None)
             
             # 发送响应
             self._set_headers(response['statusCode'], response.get('headers', {}))
             self.wfile.write(response['body'].encode('utf-8') if isinstance(response['body'], str) else response['body'])
+            self._log_first_response('POST')
         
         except Exception as e:
             import traceback
@@ -90,7 +133,24 @@ class VercelLocalHandler(http.server.BaseHTTPRequestHandler):
 
 # 启动服务器
 if __name__ == "__main__":
-    with socketserver.TCPServer(("", PORT), VercelLocalHandler) as httpd:
+    # 使用 --concurrent 启动支持并发和 keep-alive 的服务器
+    if '--concurrent' in sys.argv:
+        from api.async_server import main
+        sys.exit(main([arg for arg in sys.argv[1:] if arg != '--concurrent']))
+    
+    print(f"模块导入耗时: {IMPORT_SECONDS:.3f}s，进程启动到就绪: {time.perf_counter() - PROCESS_STARTED:.3f}s")
+    
+    # 使用 --warmup 在监听前加载并预热模型
+    if '--warmup' in sys.argv:
+        stats = warmup()
+        print("模型预热完成: " + ", ".join(f"{k}={v:.3f}s" for k, v in stats.items()))
+    
+    # 异步任务的工作线程，数量由 WATERMARK_JOB_WORKERS 指定，0 表示不启用任务模式
+    if JOB_WORKERS > 0:
+        start_job_manager(process_job, JOB_WORKERS)
+    
+    # 每个连接一个线程：任务查询的长轮询（?wait=）不会阻塞其他请求和预检请求
+    with http.server.ThreadingHTTPServer(("", PORT), VercelLocalHandler) as httpd:
         print(f"本地测试服务器启动，监听端口 {PORT}")
         print(f"访问地址: http://localhost:{PORT}")
         print("按 Ctrl+C 停止服务器")
@@ -0,0 +1,182 @@
+"""
+水印掩码生成
+
+OCR 返回的四边形（可能带旋转）一次性用 fillPoly 光栅化，模板匹配等只有矩形框的结果
+同样转成四边形一起绘制；重叠或相邻的框用并查集合并；可配置的膨胀用于覆盖抗锯齿边缘。
+生成的掩码已经是与图像同尺寸的 0/255 二值图，后续不需要再缩放和二值化
+"""
+
+import json
+import os
+
+import cv2
+import numpy as np
+
+# 掩码膨胀半径（像素）
+MASK_DILATION = int(os.environ.get('WATERMARK_MASK_DILATION', '2'))
+
+
+class Region(tuple):
+    """水印框 (x, y, w, h)，可以附带检测到的四边形 polygon（整图坐标，形状为 (N, 2)）、
+    命中的规则名 rule（见 api.rules）、识别出的文字 text 和置信度 score"""
+
+    def __new__(cls, x, y, w, h, polygon=None, rule=None, text=None, score=None):
+        region = super().__new__(cls, (int(x), int(y), int(w), int(h)))
+        region.polygon = None if polygon is None else np.asarray(polygon, dtype=np.int32).reshape(-1, 2)
+        region.rule = rule
+        region.text = text
+        region.score = None if score is None else float(score)
+        return region
+
+    def __reduce__(self):
+        return (Region, (*self, self.polygon, self.rule, self.text, self.score))
+
+    def offset(self, dx, dy):
+        polygon = None if self.polygon is None else self.polygon + (dx, dy)
+        return Region(self[0] + dx, self[1] + dy, self[2], self[3], polygon, self.rule, self.text, self.score)
+
+
+# 平移水印框，保留附带的四边形
+def offset_region(region, dx, dy):
+    if isinstance(region, Region):
+        return region.offset(dx, dy)
+    x, y, w, h = region
+    return (x + dx, y + dy, w, h)
+
+
+# 水印框对应的多边形；普通矩形框转成四个顶点
+def region_polygon(region):
+    polygon = getattr(region, 'polygon', None)
+    if polygon is not None:
+        return polygon
+    x, y, w, h = region[:4]
+    return np.array([[x, y], [x + w - 1, y], [x + w - 1, y + h - 1], [x, y + h - 1]], dtype=np.int32)
+
+
+# 用并查集合并重叠或间距不超过 gap 的框，返回合并后的 (x, y, w, h) 列表
+def merge_boxes(boxes, gap=0):
+    boxes = np.array([b[:4] for b in boxes if b[2] > 0 and b[3] > 0], dtype=np.int64).reshape(-1, 4)
+    n = len(boxes)
+    if n == 0:
+        return []
+
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+
+    # 一次性计算所有框两两之间是否相交（含间距）
+    overlap = (x1[:, None] <= x2[None, :] + gap) & (x1[None, :] <= x2[:, None] + gap) \
+        & (y1[:, None] <= y2[None, :] + gap) & (y1[None, :] <= y2[:, None] + gap)
+
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(overlap, k=1))):
+        ri, rj = find(i), find(j)
+        if ri != rj:
+            parent[rj] = ri
+
+    roots = np.array([find(i) for i in range(n)])
+    merged = []
+    for root in np.unique(roots):
+        members = roots == root
+        mx1, my1 = int(x1[members].min()), int(y1[members].min())
+        mx2, my2 = int(x2[members].max()), int(y2[members].max())
+        merged.append((mx1, my1, mx2 - mx1, my2 - my1))
+    return merged
+
+
+# 生成与图像同尺寸的二值掩码，水印区域为 0，其余为 255
+def build_mask(img_shape, regions, dilation=None):
+    if dilation is None:
+        dilation = MASK_DILATION
+    h, w = img_shape[:2]
+    mask = np.full((h, w), 255, dtype=np.uint8)
+
+    polygons = [region_polygon(region) for region in regions if region[2] > 0 and region[3] > 0]
+    if not polygons:
+        return mask
+    cv2.fillPoly(mask, polygons, 0)
+
+    # 水印区域为 0，腐蚀 255 区域即膨胀水印区域；只处理多边形外接矩形附近的区域
+    if dilation > 0:
+        points = np.concatenate(polygons)
+        x1 = max(0, int(points[:, 0].min()) - dilation)
+        y1 = max(0, int(points[:, 1].min()) - dilation)
+        x2 = min(w, int(points[:, 0].max()) + dilation + 1)
+        y2 = min(h, int(points[:, 1].max()) + dilation + 1)
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * dilation + 1, 2 * dilation + 1))
+        mask[y1:y2, x1:x2] = cv2.erode(mask[y1:y2, x1:x2], kernel, borderType=cv2.BORDER_REPLICATE)
+    return mask
+
+
+# 客户端提供的掩码（白色为水印）转成内部约定的 0/255 二值掩码（水印为 0），尺寸不一致时按最近邻缩放
+def normalize_user_mask(mask, img_shape):
+    if mask.ndim == 3:
+        mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
+    h, w = img_shape[:2]
+    if mask.shape[:2] != (h, w):
+        mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+    return np.where(mask > 127, 0, 255).astype(np.uint8)
+
+
+# 掩码中每个连通的水印区域的外接矩形
+def regions_from_mask(mask):
+    hole = (mask < 128).astype(np.uint8)
+    count, _, stats, _ = cv2.connectedComponentsWithStats(hole, connectivity=8)
+    return [
+        Region(x, y, w, h)
+        for x, y, w, h, area in stats[1:count]
+        if area > 0
+    ]
+
+
+# 解析客户端提供的水印框（JSON [[x, y, w, h], ...]），裁剪到图片范围内
+def parse_boxes(value, img_shape):
+    try:
+        boxes = json.loads(value)
+        boxes = [[int(v) for v in box[:4]] for box in boxes]
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid boxes: {e}') from None
+    if any(len(box) != 4 for box in boxes):
+        raise ValueError('Invalid boxes: each box must be [x, y, w, h]')
+
+    h, w = img_shape[:2]
+    regions = []
+    for x, y, bw, bh in boxes:
+        x1, y1 = max(0, x), max(0, y)
+        x2, y2 = min(w, x + bw), min(h, y + bh)
+        if x2 > x1 and y2 > y1:
+            regions.append(Region(x1, y1, x2 - x1, y2 - y1))
+    return regions
+
+
+# 非极大值抑制：两个框的交集占较小框面积的比例超过 threshold 时只保留置信度更高（其次面积更大）的框。
+# 分块边缘被截断的文字框完全落在另一个分块的完整框内，用较小框面积做分母才能去掉它
+def nms_regions(regions, threshold=0.5):
+    regions = list(regions)
+    if len(regions) < 2:
+        return regions
+
+    boxes = np.array([r[:4] for r in regions], dtype=np.float64)
+    scores = np.array([getattr(r, 'score', None) or 0.0 for r in regions])
+    x1, y1 = boxes[:, 0], boxes[:, 1]
+    x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+    areas = np.maximum(boxes[:, 2] * boxes[:, 3], 1.0)
+
+    iw = np.clip(np.minimum(x2[:, None], x2[None, :]) - np.maximum(x1[:, None], x1[None, :]), 0, None)
+    ih = np.clip(np.minimum(y2[:, None], y2[None, :]) - np.maximum(y1[:, None], y1[None, :]), 0, None)
+    overlap = iw * ih / np.minimum(areas[:, None], areas[None, :])
+
+    suppressed = np.zeros(len(regions), dtype=bool)
+    keep = []
+    for i in np.lexsort((-areas, -scores)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= overlap[i] > threshold
+    return [regions[i] for i in sorted(keep)]
@@ -0,0 +1,163 @@
+"""
+模型注册表
+
+EasyOCR reader 和 inpaint 推理会话都在第一次使用时才加载（线程安全），
+导入本模块不会加载 torch 或 onnxruntime，OPTIONS 请求和错误分支可以立即响应
+"""
+
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+api_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(api_dir)
+
+# OCR 语言
+OCR_LANGUAGES = ['ch_sim', 'en']
+# 本地 EasyOCR 权重目录，存在时离线加载
+OCR_MODEL_DIR = os.environ.get('WATERMARK_OCR_MODEL_DIR', os.path.join(project_root, 'models', 'easyocr'))
+# 是否允许 EasyOCR 联网下载权重，未设置时仅在本地目录不存在时下载
+OCR_ALLOW_DOWNLOAD = os.environ.get('WATERMARK_OCR_ALLOW_DOWNLOAD')
+# 显式指定的 inpaint 模型路径（fp32），未设置时在默认位置查找
+INPAINT_MODEL = os.environ.get('WATERMARK_INPAINT_MODEL')
+# inpaint 模型精度：fp32 为原模型，int8/fp16 为 benchmarks.quantize 生成的变体，变体不存在时回退到 fp32
+INPAINT_PRECISIONS = ('fp32', 'int8', 'fp16')
+INPAINT_PRECISION = os.environ.get('WATERMARK_INPAINT_PRECISION', 'fp32')
+
+_reader = None
+_reader_lock = threading.Lock()
+
+# 各模型的加载和预热耗时（秒）
+_load_stats = {}
+# 已经提示过不存在的模型变体
+_missing_variants = set()
+# inpaint 会话池大小，None 表示使用 WATERMARK_SESSION_POOL_SIZE
+_inpaint_pool_size = None
+
+
+# 模型变体的路径：与原模型同目录，文件名带精度后缀（migan_pipeline_v2.int8.onnx）
+def get_model_variant(model_path, precision):
+    if precision == 'fp32':
+        return model_path
+    name, ext = os.path.splitext(model_path)
+    return f'{name}.{precision}{ext}'
+
+
+# 获取 fp32 inpaint 模型路径
+def get_base_inpaint_model():
+    if INPAINT_MODEL:
+        return INPAINT_MODEL
+
+    # 尝试不同的模型路径
+    possible_paths = [
+        os.path.join(project_root, 'models', 'migan_pipeline_v2.onnx'),
+        os.path.join(project_root, 'migan_pipeline_v2.onnx'),
+        os.path.join(api_dir, 'models', 'migan_pipeline_v2.onnx')
+    ]
+
+    for model_path in possible_paths:
+        if os.path.exists(model_path):
+            return model_path
+
+    # 如果没有找到模型，返回默认路径
+    return os.path.join(project_root, 'models', 'migan_pipeline_v2.onnx')
+
+
+# 获取 inpaint 模型路径，按配置的精度选择量化变体
+def get_inpaint_model(precision=None):
+    if precision is None:
+        precision = INPAINT_PRECISION
+    if precision not in INPAINT_PRECISIONS:
+        raise ValueError(f"Unknown inpaint precision: {precision} (expected one of {', '.join(INPAINT_PRECISIONS)})")
+
+    model_path = get_base_inpaint_model()
+    variant = get_model_variant(model_path, precision)
+    if variant == model_path or os.path.exists(variant):
+        return variant
+    if variant not in _missing_variants:
+        _missing_variants.add(variant)
+        print(f"inpaint 模型的 {precision} 变体不存在，使用 fp32 模型: {variant}")
+    return model_path
+
+
+# 获取共享的 EasyOCR reader，第一次调用时加载
+def get_reader():
+    global _reader
+    if _reader is not None:
+        return _reader
+
+    with _reader_lock:
+        if _reader is None:
+            started = time.perf_counter()
+            import easyocr
+
+            kwargs = {'gpu': False}
+            if os.path.isdir(OCR_MODEL_DIR):
+                kwargs['model_storage_directory'] = OCR_MODEL_DIR
+                kwargs['download_enabled'] = OCR_ALLOW_DOWNLOAD == '1'
+            elif OCR_ALLOW_DOWNLOAD == '0':
+                kwargs['download_enabled'] = False
+
+            _reader = easyocr.Reader(OCR_LANGUAGES, **kwargs)
+            _load_stats['ocr_load'] = time.perf_counter() - started
+    return _reader
+
+
+# 设置 inpaint 会话池的大小（并发服务器按工作线程数设置），需要在第一次推理之前调用
+def set_inpaint_pool_size(size):
+    global _inpaint_pool_size
+    _inpaint_pool_size = size
+
+
+# 获取 inpaint 模型的会话池
+def get_inpaint_session_pool(model_path=None):
+    from api.sessions import get_session_pool
+
+    if model_path is None:
+        model_path = get_inpaint_model()
+    return get_session_pool(model_path, size=_inpaint_pool_size)
+
+
+# 用一张带文字的小图跑一遍检测和识别
+def warmup_reader():
+    reader = get_reader()
+    started = time.perf_counter()
+    dummy = np.full((64, 256, 3), 255, dtype=np.uint8)
+    cv2.putText(dummy, 'AI 2024', (16, 44), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+    reader.readtext(dummy)
+    _load_stats['ocr_warmup'] = time.perf_counter() - started
+
+
+# 创建 inpaint 会话并跑一次推理
+def warmup_inpaint(model_path=None):
+    started = time.perf_counter()
+    pool = get_inpaint_session_pool(model_path)
+    dummy = np.zeros((1, 3, 64, 64), dtype=np.uint8)
+    mask = np.full((1, 1, 64, 64), 255, dtype=np.uint8)
+    mask[:, :, 24:40, 24:40] = 0
+    with pool.acquire() as session:
+        inputs = session.get_inputs()
+        session.run(None, {inputs[0].name: dummy, inputs[1].name: mask})
+    _load_stats['inpaint_warmup'] = time.perf_counter() - started
+
+
+# 预加载并预热所有模型，返回各阶段耗时
+def warmup(ocr=True, inpaint=True):
+    if ocr:
+        warmup_reader()
+    if inpaint:
+        warmup_inpaint()
+    return get_load_stats()
+
+
+# 模型是否已经加载
+def is_loaded():
+    return _reader is not None
+
+
+# 各阶段加载耗时（秒）
+def get_load_stats():
+    return dict(_load_stats)
@@ -0,0 +1,167 @@
+"""
+multipart/form-data 解析器
+
+请求体只读取一次到预分配的缓冲区，之后所有字段都是原始缓冲区上的 memoryview 切片，
+不产生中间拷贝；文件内容可以直接交给 np.frombuffer / cv2.imdecode
+"""
+
+import os
+
+# 单个字段的最大字节数
+MAX_PART_SIZE = int(os.environ.get('WATERMARK_MAX_PART_BYTES', str(50 * 1024 * 1024)))
+# 整个请求体的最大字节数
+MAX_BODY_SIZE = int(os.environ.get('WATERMARK_MAX_BODY_BYTES', str(200 * 1024 * 1024)))
+# 读取请求体的块大小
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class MultipartError(ValueError):
+    """请求体格式错误"""
+
+
+class PartTooLarge(MultipartError):
+    """字段或请求体超过大小限制"""
+
+
+# 从 Content-Type 中解析 boundary
+def get_boundary(content_type):
+    for param in content_type.split(';')[1:]:
+        key, _, value = param.strip().partition('=')
+        if key.strip().lower() == 'boundary':
+            value = value.strip()
+            if len(value) >= 2 and value[0] == value[-1] == '"':
+                value = value[1:-1]
+            if value:
+                return value.encode('latin-1')
+    raise MultipartError('Missing multipart boundary')
+
+
+# 解析 Content-Disposition 等头部的参数，例如 form-data; name="image"; filename="a.png"
+def parse_header_params(value):
+    params = {}
+    for item in _split_params(value)[1:]:
+        key, sep, val = item.partition('=')
+        if not sep:
+            continue
+        val = val.strip()
+        if len(val) >= 2 and val[0] == val[-1] == '"':
+            val = val[1:-1].replace('\\"', '"').replace('\\\\', '\\')
+        params[key.strip().lower()] = val
+    return params
+
+
+# 按分号拆分头部参数，忽略引号内的分号
+def _split_params(value):
+    items, current, quoted, escaped = [], [], False, False
+    for ch in value:
+        if escaped:
+            current.append(ch)
+            escaped = False
+        elif ch == '\\' and quoted:
+            current.append(ch)
+            escaped = True
+        elif ch == '"':
+            current.append(ch)
+            quoted = not quoted
+        elif ch == ';' and not quoted:
+            items.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    items.append(''.join(current).strip())
+    return items
+
+
+# 从流中读取固定长度的请求体到一块预分配的缓冲区
+def read_body(stream, content_length, max_size=MAX_BODY_SIZE):
+    if content_length > max_size:
+        raise PartTooLarge(f'Request body exceeds {max_size} bytes')
+
+    buffer = bytearray(content_length)
+    view = memoryview(buffer)
+    received = 0
+    while received < content_length:
+        n = stream.readinto(view[received:received + READ_CHUNK_SIZE])
+        if not n:
+            raise MultipartError('Unexpected end of request body')
+        received += n
+    return buffer
+
+
+# 迭代各个字段，生成 (headers, content)，content 是原始缓冲区上的 memoryview
+def iter_parts(body, boundary, max_part_size=MAX_PART_SIZE):
+    # 在 bytes / bytearray 上查找分隔符；memoryview 没有 find 方法，只能先拷贝一次
+    data = body if isinstance(body, (bytes, bytearray)) else bytes(body)
+    view = memoryview(data)
+
+    delimiter = b'--' + boundary
+    pos = data.find(delimiter)
+    if pos < 0:
+        raise MultipartError('Multipart boundary not found')
+    pos += len(delimiter)
+    next_delimiter = b'\r\n' + delimiter
+
+    while True:
+        # 结束标记，之后的内容（epilogue）忽略
+        if data[pos:pos + 2] == b'--':
+            return
+        # 分隔符之后允许空格和制表符（RFC 2046 的 transport-padding）
+        while data[pos:pos + 1] in (b' ', b'\t'):
+            pos += 1
+        if data[pos:pos + 2] != b'\r\n':
+            raise MultipartError('Malformed multipart delimiter')
+        pos += 2
+
+        header_end = data.find(b'\r\n\r\n', pos)
+        if header_end < 0:
+            raise MultipartError('Malformed multipart headers')
+        headers = {}
+        for line in bytes(view[pos:header_end]).decode('utf-8', 'replace').split('\r\n'):
+            key, sep, value = line.partition(':')
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        start = header_end + 4
+
+        # 只在大小限制范围内查找下一个分隔符，超大字段不会被完整扫描
+        end = data.find(next_delimiter, start, start + max_part_size + len(next_delimiter))
+        if end < 0:
+            if len(data) - start > max_part_size + len(next_delimiter):
+                raise PartTooLarge(f'Form field exceeds {max_part_size} bytes')
+            raise MultipartError('Unterminated multipart part')
+
+        yield headers, view[start:end]
+        pos = end + len(next_delimiter)
+
+
+# 解析整个表单；文件字段为 {'filename', 'content_type', 'content'}，同名的多个文件保存为列表
+def parse_multipart(body, content_type, max_part_size=MAX_PART_SIZE):
+    boundary = get_boundary(content_type)
+    form_data = {}
+
+    for headers, content in iter_parts(body, boundary, max_part_size):
+        params = parse_header_params(headers.get('content-disposition', ''))
+        name = params.get('name')
+        if not name:
+            continue
+
+        if 'filename' in params:
+            # 文件字段
+            value = {
+                'filename': params['filename'],
+                'content_type': headers.get('content-type', 'application/octet-stream'),
+                'content': content,
+            }
+            if name in form_data:
+                if not isinstance(form_data[name], list):
+                    form_data[name] = [form_data[name]]
+                form_data[name].append(value)
+            else:
+                form_data[name] = value
+        else:
+            # 普通字段
+            try:
+                form_data[name] = bytes(content).decode('utf-8')
+            except UnicodeDecodeError:
+                raise MultipartError(f'Form field {name!r} is not valid UTF-8')
+
+    return form_data
@@ -0,0 +1,97 @@
+"""
+区域修复：只对水印框周围带上下文的裁剪块运行 inpaint 模型，再羽化贴回原图
+
+计算量和内存随水印面积而不是整张图片的面积增长，裁剪块以外的像素与输入逐位一致
+"""
+
+import cv2
+import numpy as np
+
+from api.masks import merge_boxes
+
+# 裁剪块四周保留的上下文像素
+DEFAULT_CONTEXT_PADDING = 64
+# 裁剪块宽高对齐到的倍数
+DEFAULT_ALIGN = 8
+# 羽化半径
+DEFAULT_FEATHER = 8
+
+
+# 合并相互靠近的水印框，gap 内的框视为同一簇
+def merge_regions(regions, gap=0):
+    return merge_boxes(regions, gap)
+
+
+# 将长度扩展到 align 的倍数并限制在 [0, limit] 范围内
+def _align_span(start, end, align, limit):
+    length = end - start
+    target = min(limit, -(-length // align) * align)
+    extra = target - length
+    start -= extra // 2
+    end = start + target
+    if start < 0:
+        start, end = 0, target
+    if end > limit:
+        start, end = limit - target, limit
+    return start, end
+
+
+# 为每个水印簇计算带上下文的裁剪窗口 (x1, y1, x2, y2)
+def get_crop_windows(regions, img_shape, padding=DEFAULT_CONTEXT_PADDING, align=DEFAULT_ALIGN):
+    h, w = img_shape[:2]
+    # 上下文区域重叠的簇合并为一个裁剪块
+    clusters = merge_regions(regions, gap=2 * padding)
+
+    windows = []
+    for (x, y, bw, bh) in clusters:
+        x1 = max(0, x - padding)
+        y1 = max(0, y - padding)
+        x2 = min(w, x + bw + padding)
+        y2 = min(h, y + bh + padding)
+        x1, x2 = _align_span(x1, x2, align, w)
+        y1, y2 = _align_span(y1, y2, align, h)
+        windows.append((x1, y1, x2, y2))
+    return windows
+
+
+# 生成羽化后的融合权重，水印像素为 1，向外平滑衰减到 0
+def feather_alpha(crop_mask, feather=DEFAULT_FEATHER):
+    hole = (crop_mask < 128).astype(np.float32)
+    if feather <= 0:
+        return hole
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * feather + 1, 2 * feather + 1))
+    alpha = cv2.dilate(hole, kernel)
+    alpha = cv2.GaussianBlur(alpha, (2 * feather + 1, 2 * feather + 1), 0)
+    return np.maximum(alpha, hole)
+
+
+# 切出需要修复的裁剪块，返回 [(window, crop_img, crop_mask)]
+def extract_crops(img, mask, regions, padding=DEFAULT_CONTEXT_PADDING, align=DEFAULT_ALIGN):
+    crops = []
+    for (x1, y1, x2, y2) in get_crop_windows(regions, img.shape, padding, align):
+        crop_mask = mask[y1:y2, x1:x2]
+        if not (crop_mask < 128).any():
+            continue
+        crop_img = np.ascontiguousarray(img[y1:y2, x1:x2])
+        crops.append(((x1, y1, x2, y2), crop_img, np.ascontiguousarray(crop_mask)))
+    return crops
+
+
+# 把修复后的裁剪块羽化融合回 result
+def blend_crop(result, window, crop_img, crop_mask, crop_out, feather=DEFAULT_FEATHER):
+    x1, y1, x2, y2 = window
+    alpha = feather_alpha(crop_mask, feather)
+    if crop_img.ndim == 3:
+        alpha = alpha[:, :, None]
+    blended = crop_out.astype(np.float32) * alpha + crop_img.astype(np.float32) * (1.0 - alpha)
+    result[y1:y2, x1:x2] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+
+
+# 对每个裁剪块调用 inpaint_fn(crop_img, crop_mask) 并融合回原图
+def inpaint_regions(img, mask, regions, inpaint_fn,
+                    padding=DEFAULT_CONTEXT_PADDING, align=DEFAULT_ALIGN, feather=DEFAULT_FEATHER):
+    result = img.copy()
+    for window, crop_img, crop_mask in extract_crops(img, mask, regions, padding, align):
+        crop_out = inpaint_fn(crop_img, crop_mask)
+        blend_crop(result, window, crop_img, crop_mask, crop_out, feather)
+    return result
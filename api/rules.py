@@ -0,0 +1,121 @@
+"""
+水印识别规则
+
+规则（正则、关键词、置信度阈值、区域提示）从配置文件加载一次，编译成一个组合正则：
+每条规则对应一个带命名分组的前瞻，一次匹配就能得到文本命中的所有规则，
+新增水印品牌不会增加每条 OCR 结果的处理开销。规则按配置中的顺序确定优先级
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+api_dir = os.path.dirname(os.path.abspath(__file__))
+
+# 规则配置文件
+RULES_FILE = os.environ.get('WATERMARK_RULES_FILE', os.path.join(api_dir, 'watermark_rules.json'))
+
+# 规则未指定置信度阈值时的默认值：正则规则匹配的是水印变体，关键词规则匹配的是普通文字
+VARIANT_CONFIDENCE_THRESHOLD = float(os.environ.get('WATERMARK_VARIANT_CONFIDENCE', '0'))
+OCR_CONFIDENCE_THRESHOLD = float(os.environ.get('WATERMARK_OCR_CONFIDENCE', '0.5'))
+
+
+class Rule:
+    """一条水印规则：命中任一正则或关键词，且 OCR 置信度高于阈值时视为水印"""
+
+    def __init__(self, name, patterns=(), keywords=(), min_confidence=None, regions=None):
+        if not patterns and not keywords:
+            raise ValueError(f'Rule {name!r} has no patterns or keywords')
+        self.name = name
+        self.patterns = list(patterns)
+        self.keywords = list(keywords)
+        if min_confidence is None:
+            min_confidence = VARIANT_CONFIDENCE_THRESHOLD if self.patterns else OCR_CONFIDENCE_THRESHOLD
+        self.min_confidence = float(min_confidence)
+        # 区域提示：只接受中心落在这些候选区域（见 api.detection.ROI_FRACTIONS）内的框，None 表示不限制
+        self.regions = list(regions) if regions else None
+
+    # 规则对应的正则，关键词按字面量转义
+    def expression(self):
+        alternatives = self.patterns + [re.escape(keyword) for keyword in self.keywords]
+        return '|'.join(f'(?:{alternative})' for alternative in alternatives)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'patterns': self.patterns,
+            'keywords': self.keywords,
+            'min_confidence': self.min_confidence,
+            'regions': self.regions,
+        }
+
+
+class RuleSet:
+    """编译后的规则集合"""
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        self.by_name = {}
+        for rule in self.rules:
+            if rule.name in self.by_name:
+                raise ValueError(f'Duplicate rule name: {rule.name}')
+            self.by_name[rule.name] = rule
+
+        # 每条规则一个可选的前瞻，从文本开头一次匹配即可记录所有命中的规则
+        self.group_names = [f'r{i}' for i in range(len(self.rules))]
+        expression = ''.join(
+            f'(?:(?=.*?(?P<{group}>{rule.expression()})))?'
+            for group, rule in zip(self.group_names, self.rules)
+        )
+        self.matcher = re.compile(expression, re.DOTALL)
+        # 规则内容的摘要，用于检测结果的缓存键
+        encoded = json.dumps([rule.to_dict() for rule in self.rules], sort_keys=True).encode('utf-8')
+        self.fingerprint = hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+    def __len__(self):
+        return len(self.rules)
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    # 返回文本命中的优先级最高的规则，没有命中时返回 None
+    def match(self, text):
+        if not self.rules:
+            return None
+        groups = self.matcher.match(text)
+        for group, rule in zip(self.group_names, self.rules):
+            if groups.group(group) is not None:
+                return rule
+        return None
+
+    # 判断一条 OCR 结果是否为水印，返回命中的规则或 None
+    def classify(self, text, prob):
+        rule = self.match(text)
+        if rule is not None and prob > rule.min_confidence:
+            return rule
+        return None
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(Rule(**rule) for rule in config.get('rules', []))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_config(json.load(f))
+
+
+_rule_set = None
+_rule_set_lock = threading.Lock()
+
+
+# 获取默认规则集合，第一次调用时从配置文件加载
+def get_rule_set():
+    global _rule_set
+    if _rule_set is None:
+        with _rule_set_lock:
+            if _rule_set is None:
+                _rule_set = RuleSet.load(RULES_FILE)
+    return _rule_set
@@ -0,0 +1,103 @@
+"""
+分辨率自适应修复
+
+超过工作分辨率上限的图像先缩小后修复，再把结果放大，只将掩码覆盖的像素（带羽化）
+合成回原分辨率图像，掩码以外的高频细节保持原样
+"""
+
+import os
+
+import cv2
+import numpy as np
+
+from api.regions import feather_alpha
+
+# 放大时可选的插值方式
+INTERPOLATIONS = {
+    'nearest': cv2.INTER_NEAREST,
+    'linear': cv2.INTER_LINEAR,
+    'cubic': cv2.INTER_CUBIC,
+    'area': cv2.INTER_AREA,
+    'lanczos': cv2.INTER_LANCZOS4,
+}
+
+# 默认策略，可通过环境变量或单次请求覆盖；max_side 为 0 时始终使用原分辨率
+DEFAULT_POLICY = {
+    'max_side': int(os.environ.get('WATERMARK_INPAINT_MAX_SIDE', '1024')),
+    'interpolation': os.environ.get('WATERMARK_INPAINT_INTERPOLATION', 'cubic'),
+    'blend_radius': int(os.environ.get('WATERMARK_INPAINT_BLEND_RADIUS', '4')),
+}
+
+
+# 合并默认策略和覆盖项，忽略值为 None 的覆盖项
+def get_policy(overrides=None):
+    policy = dict(DEFAULT_POLICY)
+    if overrides:
+        policy.update({k: v for k, v in overrides.items() if k in DEFAULT_POLICY and v is not None})
+    if policy['interpolation'] not in INTERPOLATIONS:
+        raise ValueError(f"Unknown interpolation: {policy['interpolation']}")
+    policy['max_side'] = max(0, int(policy['max_side']))
+    policy['blend_radius'] = max(0, int(policy['blend_radius']))
+    return policy
+
+
+# 从请求参数中读取策略覆盖项
+def parse_policy_params(params):
+    overrides = {}
+    for key in ('max_side', 'blend_radius'):
+        value = (params or {}).get(key)
+        if value not in (None, ''):
+            overrides[key] = int(value)
+    interpolation = (params or {}).get('interpolation')
+    if interpolation:
+        overrides['interpolation'] = interpolation.lower()
+    return overrides
+
+
+# 缩小掩码：原图中只要有水印像素落入的位置都视为水印，保证修复范围不会变小
+def downscale_mask(mask, size):
+    hole = (mask < 128).astype(np.float32)
+    hole_small = cv2.resize(hole, size, interpolation=cv2.INTER_AREA)
+    return np.where(hole_small > 0, 0, 255).astype(np.uint8)
+
+
+# 在工作分辨率下运行 inpaint_fn(img, mask)，再合成回原分辨率
+def inpaint_at_scale(img, mask, inpaint_fn, policy=None):
+    policy = get_policy(policy)
+    h, w = img.shape[:2]
+    max_side = policy['max_side']
+    if not max_side or max(h, w) <= max_side:
+        return inpaint_fn(img, mask)
+
+    scale = max_side / float(max(h, w))
+    small_size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    img_small = cv2.resize(img, small_size, interpolation=cv2.INTER_AREA)
+    mask_small = downscale_mask(mask, small_size)
+
+    output_small = inpaint_fn(img_small, mask_small)
+    output = cv2.resize(output_small, (w, h), interpolation=INTERPOLATIONS[policy['interpolation']])
+
+    # 只把掩码区域合成回原图，其余像素保持原分辨率的细节
+    return recomposite(img, mask, output, policy['blend_radius'])
+
+
+# 在掩码的外接矩形内羽化合成，矩形以外的像素直接复制原图
+def recomposite(img, mask, output, blend_radius):
+    hole = mask < 128
+    rows = np.flatnonzero(hole.any(axis=1))
+    cols = np.flatnonzero(hole.any(axis=0))
+    result = img.copy()
+    if not len(rows):
+        return result
+
+    pad = 2 * blend_radius + 1
+    y1, y2 = max(0, rows[0] - pad), min(img.shape[0], rows[-1] + 1 + pad)
+    x1, x2 = max(0, cols[0] - pad), min(img.shape[1], cols[-1] + 1 + pad)
+
+    alpha = feather_alpha(mask[y1:y2, x1:x2], blend_radius)
+    if img.ndim == 3:
+        alpha = alpha[:, :, None]
+    blended = output[y1:y2, x1:x2].astype(np.float32) * alpha \
+        + img[y1:y2, x1:x2].astype(np.float32) * (1.0 - alpha)
+    result[y1:y2, x1:x2] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+    return result
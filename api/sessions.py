@@ -0,0 +1,300 @@
+"""
+ONNX Runtime 推理会话管理
+
+每个模型在进程内只加载一次，按模型路径维护一个有界的会话池供并发请求复用，
+并把图优化后的模型序列化到磁盘，热启动时跳过图优化
+"""
+
+import hashlib
+import math
+import os
+import queue
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+import onnxruntime as ort
+
+from api.tracing import stage
+
+# 图优化级别
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+# 默认配置，可通过环境变量覆盖
+DEFAULT_POOL_SIZE = int(os.environ.get('WATERMARK_SESSION_POOL_SIZE', '1'))
+# intra-op 线程数为 0 时按可用 CPU 和同时推理的会话数自动选择
+DEFAULT_INTRA_OP_THREADS = int(os.environ.get('WATERMARK_ORT_INTRA_OP_THREADS', '0'))
+DEFAULT_INTER_OP_THREADS = int(os.environ.get('WATERMARK_ORT_INTER_OP_THREADS', '0'))
+DEFAULT_OPTIMIZATION_LEVEL = os.environ.get('WATERMARK_ORT_OPTIMIZATION_LEVEL', 'extended')
+# 同时运行推理的工作进程数，多进程部署（批处理 CLI、视频工作进程）时由父进程设置
+WORKER_PROCESSES = int(os.environ.get('WATERMARK_WORKER_PROCESSES', '1'))
+# 每个线程最多保留的张量缓冲区个数（不同形状的输入、掩码、输出各占一个）
+TENSOR_BUFFER_ENTRIES = int(os.environ.get('WATERMARK_TENSOR_BUFFERS', '6'))
+# Serverless 环境只有临时目录可写，优化后的模型默认缓存到临时目录
+DEFAULT_CACHE_DIR = os.environ.get(
+    'WATERMARK_ORT_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'watermark-remover-ort')
+)
+
+
+# 当前进程可用的 CPU 数：考虑 CPU 亲和性和容器的 cgroup CPU 配额
+def available_cpus():
+    try:
+        count = len(os.sched_getaffinity(0))
+    except AttributeError:
+        count = os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            count = min(count, max(1, math.floor(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return count
+
+
+# 多进程工作进程的初始化（批处理 CLI、视频工作进程共用）：推理线程数按工作进程数平分可用 CPU，
+# inter-op 和 OpenMP 线程固定为 1，避免线程超额订阅；已经显式设置的环境变量保持不变
+def configure_worker_process(processes=1):
+    global WORKER_PROCESSES, DEFAULT_INTER_OP_THREADS
+    os.environ.setdefault('WATERMARK_WORKER_PROCESSES', str(processes))
+    os.environ.setdefault('WATERMARK_ORT_INTER_OP_THREADS', '1')
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    # 本模块可能在设置环境变量之前就已导入，同步更新模块级的默认值
+    WORKER_PROCESSES = int(os.environ['WATERMARK_WORKER_PROCESSES'])
+    DEFAULT_INTER_OP_THREADS = int(os.environ['WATERMARK_ORT_INTER_OP_THREADS'])
+
+
+# 自动选择单个会话的 intra-op 线程数：可用 CPU 平均分给同时推理的会话（每个进程的会话数 × 工作进程数），
+# 避免并发请求超额订阅 CPU
+def auto_intra_op_threads(sessions=1, processes=None):
+    if processes is None:
+        processes = WORKER_PROCESSES
+    return max(1, available_cpus() // max(1, sessions * processes))
+
+
+# 构建会话选项
+def build_session_options(intra_op_threads=None, inter_op_threads=None,
+                          optimization_level=None, optimized_model_path=None):
+    if intra_op_threads is None:
+        intra_op_threads = DEFAULT_INTRA_OP_THREADS
+    if inter_op_threads is None:
+        inter_op_threads = DEFAULT_INTER_OP_THREADS
+    if optimization_level is None:
+        optimization_level = DEFAULT_OPTIMIZATION_LEVEL
+
+    if not intra_op_threads:
+        intra_op_threads = auto_intra_op_threads()
+
+    options = ort.SessionOptions()
+    # inter-op 线程数为 0 表示由 ORT 自行决定
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[optimization_level]
+    if optimized_model_path:
+        options.optimized_model_filepath = optimized_model_path
+    return options
+
+
+# 原模型的指纹：绝对路径、大小、修改时间（纳秒）和 ORT 版本，任何一项变化都会使用新的缓存文件
+def model_fingerprint(model_path):
+    stat = os.stat(model_path)
+    key = f'{os.path.abspath(model_path)}:{stat.st_size}:{stat.st_mtime_ns}:{ort.__version__}'
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=8).hexdigest()
+
+
+# 计算优化后模型的缓存路径，文件名带原模型的指纹，同名的不同模型不会共用缓存
+def get_optimized_model_path(model_path, optimization_level, cache_dir=None):
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+    if not cache_dir:
+        return None
+    name, ext = os.path.splitext(os.path.basename(model_path))
+    return os.path.join(cache_dir, f'{name}.{model_fingerprint(model_path)}.{optimization_level}.opt{ext}')
+
+
+# 创建单个推理会话，优先加载磁盘上已优化的模型
+def create_session(model_path, intra_op_threads=None, inter_op_threads=None,
+                   optimization_level=None, cache_dir=None, providers=None):
+    if optimization_level is None:
+        optimization_level = DEFAULT_OPTIMIZATION_LEVEL
+    if providers is None:
+        providers = ['CPUExecutionProvider']
+
+    optimized_path = None
+    if optimization_level != 'disable':
+        optimized_path = get_optimized_model_path(model_path, optimization_level, cache_dir)
+
+    # 缓存存在时直接加载并关闭图优化（指纹已经保证缓存来自当前的原模型）
+    if optimized_path and os.path.exists(optimized_path):
+        options = build_session_options(intra_op_threads, inter_op_threads, 'disable')
+        try:
+            return ort.InferenceSession(optimized_path, sess_options=options, providers=providers)
+        except Exception as e:
+            # 缓存损坏时回退到原模型并重新生成缓存
+            print(f"Failed to load optimized model cache {optimized_path}: {e}")
+
+    if optimized_path:
+        try:
+            os.makedirs(os.path.dirname(optimized_path), exist_ok=True)
+        except OSError:
+            optimized_path = None
+
+    options = build_session_options(intra_op_threads, inter_op_threads,
+                                    optimization_level, optimized_path)
+    return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+
+
+class SessionPool:
+    """单个模型的有界会话池，会话按需创建，最多创建 size 个"""
+
+    def __init__(self, model_path, size=None, **session_kwargs):
+        self.model_path = model_path
+        self.size = max(1, size if size is not None else DEFAULT_POOL_SIZE)
+        # 池中的会话可能同时推理，自动线程数按池大小平分 CPU
+        if not session_kwargs.get('intra_op_threads') and not DEFAULT_INTRA_OP_THREADS:
+            session_kwargs['intra_op_threads'] = auto_intra_op_threads(self.size)
+        self.session_kwargs = session_kwargs
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _checkout(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+
+        if can_create:
+            try:
+                with stage('session'):
+                    return create_session(self.model_path, **self.session_kwargs)
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # 池已满，等待其他请求归还会话
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f'No inference session available for {self.model_path}')
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        session = self._checkout(timeout)
+        try:
+            yield session
+        finally:
+            self._idle.put(session)
+
+    # 预先创建一个会话，避免首个请求承担加载开销
+    def warmup(self):
+        with self.acquire():
+            pass
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# 获取模型对应的进程级会话池
+def get_session_pool(model_path, size=None, **session_kwargs):
+    key = os.path.abspath(model_path)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = SessionPool(key, size=size, **session_kwargs)
+            _pools[key] = pool
+    return pool
+
+
+# 释放所有缓存的会话（模型文件更新后调用）
+def clear_session_pools():
+    with _pools_lock:
+        _pools.clear()
+
+
+# ORT 张量类型对应的 numpy 类型
+ORT_DTYPES = {
+    'tensor(uint8)': np.uint8,
+    'tensor(float)': np.float32,
+    'tensor(float16)': np.float16,
+}
+
+
+class TensorBuffers:
+    """按 (名称, 形状, dtype) 复用的张量缓冲区，最多保留 max_entries 个，最久未使用的先释放"""
+
+    def __init__(self, max_entries=None):
+        self.max_entries = TENSOR_BUFFER_ENTRIES if max_entries is None else max_entries
+        self.buffers = OrderedDict()
+        self.stats = {'hits': 0, 'allocations': 0}
+
+    def get(self, name, shape, dtype=np.uint8):
+        key = (name, tuple(shape), np.dtype(dtype).str)
+        buffer = self.buffers.get(key)
+        if buffer is not None:
+            self.buffers.move_to_end(key)
+            self.stats['hits'] += 1
+            return buffer
+        buffer = np.empty(shape, dtype=dtype)
+        self.stats['allocations'] += 1
+        if self.max_entries > 0:
+            self.buffers[key] = buffer
+            while len(self.buffers) > self.max_entries:
+                self.buffers.popitem(last=False)
+        return buffer
+
+
+# 每个线程独立的缓冲区：同一时刻只有当前线程在使用，不需要加锁
+_buffers = threading.local()
+
+
+def get_tensor_buffers():
+    buffers = getattr(_buffers, 'value', None)
+    if buffers is None:
+        buffers = _buffers.value = TensorBuffers()
+    return buffers
+
+
+# 根据输出元数据推断输出形状，符号维度（批大小、高、宽）取输入在同一位置的大小；无法推断时返回 None
+def infer_output_shape(output_meta, input_shape):
+    if len(output_meta.shape) != len(input_shape):
+        return None
+    return tuple(dim if isinstance(dim, int) else input_shape[i] for i, dim in enumerate(output_meta.shape))
+
+
+# 通过 IOBinding 运行：输入直接绑定调用方的数组，第一个输出写入按形状复用的缓冲区，
+# 返回该缓冲区（下一次调用前有效）；输出类型或形状未知时由 ORT 分配输出
+def run_with_buffers(session, inputs, buffers=None):
+    binding = session.io_binding()
+    # 绑定的数组在推理结束前必须保持存活
+    inputs = [np.ascontiguousarray(array) for array in inputs]
+    for meta, array in zip(session.get_inputs(), inputs):
+        binding.bind_cpu_input(meta.name, array)
+
+    output_meta = session.get_outputs()[0]
+    shape = infer_output_shape(output_meta, inputs[0].shape)
+    dtype = ORT_DTYPES.get(output_meta.type)
+    if buffers is None or shape is None or dtype is None:
+        binding.bind_output(output_meta.name, 'cpu')
+        session.run_with_iobinding(binding)
+        return binding.copy_outputs_to_cpu()[0]
+
+    output = buffers.get('output', shape, dtype)
+    binding.bind_output(output_meta.name, 'cpu', 0, dtype, shape, output.ctypes.data)
+    session.run_with_iobinding(binding)
+    return output
@@ -0,0 +1,159 @@
+"""
+进程间图像传输
+
+解码后的图像放在 multiprocessing.shared_memory 中，跨进程只传递 (名称, 形状, dtype) 描述符，
+工作进程直接在共享内存上原地写回修复结果，不再 pickle 整张图像（8K RGB 约 100 MB）。
+共享内存块由 SlabAllocator 按 2 的幂大小分级回收复用，连续的请求不会反复申请和释放大块内存
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+# 空闲共享内存块的总字节数上限，超过时直接释放
+SLAB_CACHE_BYTES = int(os.environ.get('WATERMARK_SLAB_CACHE_BYTES', str(1024 * 1024 * 1024)))
+# 最小分配粒度
+MIN_SLAB_BYTES = 64 * 1024
+
+
+# 向上取整到 2 的幂，作为共享内存块的大小等级
+def slab_size(nbytes):
+    return max(MIN_SLAB_BYTES, 1 << (max(1, int(nbytes)) - 1).bit_length())
+
+
+class SharedArray:
+    """共享内存块上的 ndarray；只有描述符会跨进程传递"""
+
+    def __init__(self, block, shape, dtype):
+        self.block = block
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=block.buf)
+
+    @property
+    def descriptor(self):
+        return (self.block.name, self.shape, self.dtype.str)
+
+
+class SlabAllocator:
+    """按大小等级回收共享内存块的分配器，线程安全"""
+
+    def __init__(self, cache_bytes=None):
+        self.cache_bytes = SLAB_CACHE_BYTES if cache_bytes is None else cache_bytes
+        self.free = {}
+        self.free_bytes = 0
+        self.stats = {'allocated': 0, 'reused': 0, 'released': 0}
+        self._lock = threading.Lock()
+
+    def allocate(self, shape, dtype=np.uint8):
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size = slab_size(nbytes)
+        with self._lock:
+            blocks = self.free.get(size)
+            block = blocks.pop() if blocks else None
+            if block is not None:
+                self.free_bytes -= size
+                self.stats['reused'] += 1
+            else:
+                self.stats['allocated'] += 1
+        if block is None:
+            block = shared_memory.SharedMemory(create=True, size=size)
+        return SharedArray(block, shape, dtype)
+
+    # 从 ndarray 复制到新分配的共享内存
+    def from_array(self, array):
+        shared = self.allocate(array.shape, array.dtype)
+        np.copyto(shared.array, array)
+        return shared
+
+    # 归还共享内存块；空闲块超过上限时直接释放
+    def release(self, shared):
+        block, size = shared.block, slab_size(shared.array.nbytes)
+        shared.array = None
+        with self._lock:
+            if self.free_bytes + size <= self.cache_bytes:
+                self.free.setdefault(size, []).append(block)
+                self.free_bytes += size
+                return
+            self.stats['released'] += 1
+        _destroy(block)
+
+    def close(self):
+        with self._lock:
+            blocks = [block for blocks in self.free.values() for block in blocks]
+            self.free = {}
+            self.free_bytes = 0
+        for block in blocks:
+            _destroy(block)
+
+
+def _destroy(block):
+    block.close()
+    try:
+        block.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# 工作进程中已经打开的共享内存块，共享内存块会被分配器复用，按名称缓存
+_attached = {}
+# 工作进程最多保持打开的共享内存块数，超过时关闭最早打开的（主进程可能已经释放了它）
+MAX_ATTACHED = 64
+
+
+# 在工作进程中按描述符打开共享内存，返回 ndarray 视图
+def attach(descriptor):
+    name, shape, dtype = descriptor
+    block = _attached.get(name)
+    if block is None:
+        # 工作进程由主进程 spawn，与主进程共用同一个 resource_tracker，重复登记不会导致共享内存被提前删除
+        block = shared_memory.SharedMemory(name=name)
+        if len(_attached) >= MAX_ATTACHED:
+            _attached.pop(next(iter(_attached))).close()
+        _attached[name] = block
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+
+
+# 工作进程入口：在共享内存中的图像上运行 target(image, *args)，结果原地写回
+def _run_in_place(target, descriptor, args):
+    image = attach(descriptor)
+    result = target(image, *args)
+    if result is not image:
+        if result.shape != image.shape:
+            raise ValueError(f'Result shape {result.shape} does not match input {image.shape}')
+        np.copyto(image, result)
+
+
+class SharedImagePool:
+    """进程池：图像经由共享内存传给工作进程，处理结果原地写回"""
+
+    def __init__(self, processes=None, initializer=None, allocator=None):
+        self.processes = processes or os.cpu_count() or 1
+        self.allocator = allocator or SlabAllocator()
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=get_context('spawn'),
+            initializer=initializer
+        )
+
+    # 提交任务：image 复制到共享内存后由 target(image, *args) 原地处理，
+    # 返回 (SharedArray, Future)；结果读取完后需要调用 release 归还共享内存
+    def submit(self, target, image, *args):
+        shared = self.allocator.from_array(image)
+        return shared, self.executor.submit(_run_in_place, target, shared.descriptor, args)
+
+    def release(self, shared):
+        self.allocator.release(shared)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.allocator.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
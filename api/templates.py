@@ -0,0 +1,165 @@
+"""
+水印模板匹配
+
+对已知的水印字形（"豆包AI生成" 及其变体在不同字体和字号下的渲染结果）做多尺度
+归一化模板匹配，命中时直接返回与 OCR 相同格式的 (x, y, w, h) 框，跳过 OCR
+"""
+
+import hashlib
+import os
+import threading
+
+import cv2
+import numpy as np
+
+from api.masks import Region
+
+api_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(api_dir)
+
+# 模板目录，目录下的每张图片都是一个水印模板
+TEMPLATE_DIR = os.environ.get(
+    'WATERMARK_TEMPLATE_DIR',
+    os.path.join(project_root, 'models', 'watermark_templates')
+)
+# 匹配置信度阈值，低于该值时交给 OCR
+TEMPLATE_THRESHOLD = float(os.environ.get('WATERMARK_TEMPLATE_THRESHOLD', '0.8'))
+# 模板缩放比例
+TEMPLATE_SCALES = tuple(np.round(np.geomspace(0.5, 2.0, 13), 3))
+# 不同模板的命中框重叠超过该比例时只保留得分高的
+NMS_IOU = 0.3
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp')
+
+
+# 转成单通道灰度图
+def to_gray(img):
+    if img.ndim == 2:
+        return img
+    if img.shape[2] == 4:
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+
+
+# 计算两个 (x, y, w, h) 框的交并比
+def box_iou(a, b):
+    ix = max(0, min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1]))
+    inter = ix * iy
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union > 0 else 0.0
+
+
+class TemplateLibrary:
+    """水印模板库，可以从目录加载，也可以在运行时追加模板"""
+
+    def __init__(self, scales=TEMPLATE_SCALES):
+        self.scales = scales
+        self.templates = {}
+        # 每个模板灰度图内容的摘要
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.templates)
+
+    # 模板名称和内容的摘要，用于检测结果的缓存键；替换同名模板的图片也会改变摘要
+    @property
+    def fingerprint(self):
+        with self._lock:
+            items = sorted(self._digests.items())
+        encoded = ';'.join(f'{name}:{digest}' for name, digest in items).encode('utf-8')
+        return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+    # 添加模板，预先生成各个缩放比例的灰度图
+    def add(self, name, image):
+        gray = to_gray(image)
+        digest = hashlib.blake2b(f'{gray.shape}:{gray.dtype}'.encode('utf-8'), digest_size=8)
+        digest.update(np.ascontiguousarray(gray).tobytes())
+        pyramid = []
+        for scale in self.scales:
+            tw = int(round(gray.shape[1] * scale))
+            th = int(round(gray.shape[0] * scale))
+            if tw < 8 or th < 8:
+                continue
+            interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR
+            resized = cv2.resize(gray, (tw, th), interpolation=interpolation)
+            # 纯色模板的归一化相关系数没有意义
+            if resized.std() < 1e-3:
+                continue
+            pyramid.append(resized)
+        with self._lock:
+            self.templates[name] = pyramid
+            self._digests[name] = digest.hexdigest()
+
+    # 加载目录下的所有模板图片
+    def load_dir(self, directory):
+        if not os.path.isdir(directory):
+            return
+        for filename in sorted(os.listdir(directory)):
+            if not filename.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            image = cv2.imread(os.path.join(directory, filename), cv2.IMREAD_UNCHANGED)
+            if image is not None:
+                self.add(os.path.splitext(filename)[0], image)
+
+    # 在区域内匹配所有模板，返回 [(x, y, w, h, score, name)]，按得分从高到低排列
+    def match(self, region, threshold=None):
+        if threshold is None:
+            threshold = TEMPLATE_THRESHOLD
+
+        gray = to_gray(region)
+        gh, gw = gray.shape[:2]
+
+        with self._lock:
+            templates = list(self.templates.items())
+
+        candidates = []
+        for name, pyramid in templates:
+            best = None
+            for template in pyramid:
+                th, tw = template.shape[:2]
+                if th > gh or tw > gw:
+                    continue
+                scores = cv2.matchTemplate(gray, template, cv2.TM_CCOEFF_NORMED)
+                _, score, _, (x, y) = cv2.minMaxLoc(scores)
+                if best is None or score > best[4]:
+                    best = (x, y, tw, th, float(score), name)
+            if best is not None and best[4] >= threshold:
+                candidates.append(best)
+
+        # 不同模板命中同一位置时只保留得分最高的
+        candidates.sort(key=lambda c: c[4], reverse=True)
+        matches = []
+        for candidate in candidates:
+            if all(box_iou(candidate[:4], kept[:4]) <= NMS_IOU for kept in matches):
+                matches.append(candidate)
+        return matches
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+# 获取默认模板库，第一次调用时从模板目录加载
+def get_template_library():
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                library = TemplateLibrary()
+                library.load_dir(TEMPLATE_DIR)
+                _library = library
+    return _library
+
+
+# 模板匹配检测，返回 (x, y, w, h) 列表，命中的模板名和得分记录在 rule、score 中；没有模板或置信度不足时返回空列表
+def match_templates(region, threshold=None, library=None):
+    if library is None:
+        library = get_template_library()
+    if not len(library):
+        return []
+    return [
+        Region(x, y, w, h, rule=f'template:{name}', score=score)
+        for (x, y, w, h, score, name) in library.match(region, threshold)
+    ]
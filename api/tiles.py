@@ -0,0 +1,82 @@
+"""
+图像分块
+
+把大图切成固定大小、相邻块互相重叠的分块，检测和修复都可以逐块进行，
+内存占用只取决于分块大小而与输入尺寸无关
+"""
+
+import numpy as np
+
+
+# 一维方向上的分块起点：相邻分块重叠 overlap 像素，最后一块与边缘对齐
+def tile_starts(length, tile, overlap):
+    if length <= tile:
+        return [0]
+    step = max(1, tile - overlap)
+    starts = list(range(0, length - tile, step))
+    starts.append(length - tile)
+    return starts
+
+
+# 覆盖整张图片的分块 (x1, y1, x2, y2) 列表，按行优先排列
+def tile_boxes(shape, tile, overlap):
+    h, w = shape[:2]
+    return [
+        (x, y, min(w, x + tile), min(h, y + tile))
+        for y in tile_starts(h, tile, overlap)
+        for x in tile_starts(w, tile, overlap)
+    ]
+
+
+# 分块边缘的混合权重：距离内侧边缘 d 像素处的权重，从 0 过渡到 1
+def ramp(distance, overlap, blend='linear'):
+    if overlap <= 0:
+        return np.ones_like(distance, dtype=np.float32)
+    if blend == 'gaussian':
+        sigma = overlap / 3.0
+        return (1.0 - np.exp(-0.5 * (distance / sigma) ** 2)).astype(np.float32)
+    return np.clip((distance + 0.5) / overlap, 0.0, 1.0).astype(np.float32)
+
+
+# 分块的二维混合权重：分块按行优先顺序写入，只在左侧和上侧（与先写入的分块重叠的一侧）渐变，
+# 右侧和下侧保持为 1，由之后的分块负责过渡，重叠区域不会混入原图
+def tile_weights(box, overlap, blend='linear'):
+    x1, y1, x2, y2 = box
+    wx = ramp(np.arange(x2 - x1, dtype=np.float32), overlap, blend) if x1 > 0 else np.ones(x2 - x1, np.float32)
+    wy = ramp(np.arange(y2 - y1, dtype=np.float32), overlap, blend) if y1 > 0 else np.ones(y2 - y1, np.float32)
+    return wy[:, None] * wx[None, :]
+
+
+# 分块修复：只处理包含掩码（值为 0）像素的分块，每 batch_size 个分块调用一次
+# inpaint_batch_fn(imgs, masks)，按行优先顺序用渐变权重把结果拼接到输出上，重叠区域平滑过渡；
+# 返回 (拼接结果, 统计信息)，统计信息中列出没有掩码而被跳过的分块
+def inpaint_tiled(img, mask, inpaint_batch_fn, tile, overlap, batch_size=4, blend='linear'):
+    boxes = tile_boxes(img.shape, tile, overlap)
+    active, skipped = [], []
+    for box in boxes:
+        x1, y1, x2, y2 = box
+        (active if (mask[y1:y2, x1:x2] < 128).any() else skipped).append(box)
+
+    result = img.copy()
+    for start in range(0, len(active), max(1, batch_size)):
+        chunk = active[start:start + batch_size]
+        outputs = inpaint_batch_fn(
+            [img[y1:y2, x1:x2] for x1, y1, x2, y2 in chunk],
+            [mask[y1:y2, x1:x2] for x1, y1, x2, y2 in chunk]
+        )
+        for box, output in zip(chunk, outputs):
+            x1, y1, x2, y2 = box
+            weights = tile_weights(box, overlap, blend)
+            if img.ndim == 3:
+                weights = weights[:, :, None]
+            current = result[y1:y2, x1:x2].astype(np.float32)
+            blended = current + (output.astype(np.float32) - current) * weights
+            result[y1:y2, x1:x2] = np.clip(blended + 0.5, 0, 255).astype(np.uint8)
+
+    report = {
+        'tiles': len(boxes),
+        'inpainted': len(active),
+        'skipped': len(skipped),
+        'skipped_tiles': [list(box) for box in skipped],
+    }
+    return result, report
@@ -0,0 +1,199 @@
+"""
+流水线分阶段耗时与内存统计
+
+每个阶段记录墙钟时间和进程峰值 RSS 的增量，单次请求的结果可以通过 Server-Timing 响应头
+或调试 JSON 字段返回，全局直方图可以导出为 Prometheus 文本格式。
+未开启统计且当前请求没有要求调试时，stage() 只做一次判断并返回空的上下文管理器
+"""
+
+import contextvars
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# 是否开启全局统计（直方图）
+TRACING_ENABLED = os.environ.get('WATERMARK_TRACING', '0') == '1'
+
+# 直方图分桶（秒）
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# ru_maxrss 在 macOS 上以字节为单位，在 Linux 上以 KB 为单位
+_RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+_NULL_STAGE = nullcontext()
+_current = contextvars.ContextVar('watermark_trace', default=None)
+
+
+# 进程峰值 RSS（字节）
+def peak_rss():
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT
+
+
+class Trace:
+    """单次请求的各阶段统计，同名阶段的耗时累加；分块检测等会在多个线程中同时记录"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        # 阶段之外的附加信息，例如分块修复跳过的分块
+        self.notes = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds, rss_delta):
+        with self._lock:
+            entry = self.stages.get(name)
+            if entry is None:
+                self.stages[name] = {'seconds': seconds, 'rss_delta_bytes': rss_delta, 'count': 1}
+            else:
+                entry['seconds'] += seconds
+                entry['rss_delta_bytes'] += rss_delta
+                entry['count'] += 1
+
+    def total_seconds(self):
+        return time.perf_counter() - self.started
+
+    # Server-Timing 响应头，例如 ocr;dur=812.3, inference;dur=95.1
+    def server_timing(self):
+        items = [f'{name};dur={entry["seconds"] * 1000:.1f}' for name, entry in self.stages.items()]
+        items.append(f'total;dur={self.total_seconds() * 1000:.1f}')
+        return ', '.join(items)
+
+    def to_dict(self):
+        result = {
+            'total_ms': round(self.total_seconds() * 1000, 3),
+            'stages': {
+                name: {
+                    'ms': round(entry['seconds'] * 1000, 3),
+                    'rss_delta_bytes': entry['rss_delta_bytes'],
+                    'count': entry['count'],
+                }
+                for name, entry in self.stages.items()
+            },
+        }
+        if self.notes:
+            result['notes'] = self.notes
+        return result
+
+
+class Histogram:
+    """累积分桶直方图"""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class _Registry:
+    """按阶段名保存耗时直方图和峰值 RSS 增量"""
+
+    def __init__(self):
+        self.durations = {}
+        self.rss_deltas = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, seconds, rss_delta):
+        with self._lock:
+            histogram = self.durations.get(name)
+            if histogram is None:
+                histogram = self.durations[name] = Histogram()
+            histogram.observe(seconds)
+            self.rss_deltas[name] = self.rss_deltas.get(name, 0) + rss_delta
+
+    def render_prometheus(self):
+        lines = [
+            '# HELP watermark_stage_duration_seconds Wall time spent in each pipeline stage.',
+            '# TYPE watermark_stage_duration_seconds histogram',
+        ]
+        with self._lock:
+            for name in sorted(self.durations):
+                histogram = self.durations[name]
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'watermark_stage_duration_seconds_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'watermark_stage_duration_seconds_bucket{{stage="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'watermark_stage_duration_seconds_sum{{stage="{name}"}} {histogram.sum:.6f}')
+                lines.append(f'watermark_stage_duration_seconds_count{{stage="{name}"}} {histogram.count}')
+
+            lines.append('# HELP watermark_stage_peak_rss_increase_bytes Growth of the process peak RSS attributed to each stage.')
+            lines.append('# TYPE watermark_stage_peak_rss_increase_bytes counter')
+            for name in sorted(self.rss_deltas):
+                lines.append(f'watermark_stage_peak_rss_increase_bytes{{stage="{name}"}} {self.rss_deltas[name]}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = _Registry()
+
+
+class _Stage:
+    def __init__(self, name, trace):
+        self.name = name
+        self.trace = trace
+
+    def __enter__(self):
+        self.rss = peak_rss()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        rss_delta = peak_rss() - self.rss
+        if self.trace is not None:
+            self.trace.record(self.name, seconds, rss_delta)
+        if TRACING_ENABLED:
+            registry.observe(self.name, seconds, rss_delta)
+        return False
+
+
+# 统计一个阶段，用法: with stage('ocr'): ...
+def stage(name):
+    trace = _current.get()
+    if trace is None and not TRACING_ENABLED:
+        return _NULL_STAGE
+    return _Stage(name, trace)
+
+
+# 开始统计当前请求，返回 (trace, token)，结束时调用 end_trace(token)
+def start_trace():
+    trace = Trace()
+    return trace, _current.set(trace)
+
+
+def end_trace(token):
+    _current.reset(token)
+
+
+# 当前请求的统计，没有时返回 None
+def current_trace():
+    return _current.get()
+
+
+# 在当前请求的统计中记录附加信息，没有统计时忽略
+def annotate(name, value):
+    trace = _current.get()
+    if trace is not None:
+        trace.notes[name] = value
+
+
+# 导出 Prometheus 文本格式的全局直方图
+def render_prometheus():
+    return registry.render_prometheus()
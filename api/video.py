@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+视频和动图去水印
+
+逐帧解码后直接送入编码器，不保留整段视频的帧：只在关键帧上运行水印检测，之后的帧复用
+同一个掩码，直到水印附近的画面变化超过阈值（或超过最大关键帧间隔）才重新检测；
+每帧只修复掩码覆盖的裁剪块，没有水印的帧原样写出。
+MP4 使用 OpenCV 流式读写，内存占用与视频长度无关；Pillow 的 GIF/WebP 编码器需要在保存时
+拿到全部帧，因此动图的输出帧会保留到编码结束（GIF 帧先转换为调色板图像以减少内存）
+
+用法:
+    python -m api.video INPUT OUTPUT [--keyframe-interval 120] [--change-threshold 12]
+"""
+
+import argparse
+import functools
+import os
+import shutil
+import sys
+import tempfile
+from collections import deque
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image, ImageSequence
+
+from api.backends import uses_model
+from api.masks import build_mask
+from api.shm import SharedImagePool
+
+# 支持的容器格式：扩展名、MIME 类型
+CONTAINERS = {
+    'gif': ('.gif', 'image/gif'),
+    'webp': ('.webp', 'image/webp'),
+    'mp4': ('.mp4', 'video/mp4'),
+}
+
+# MP4 的主品牌（ftyp 盒）；HEIC、AVIF、MOV、3GP 等同样以 ftyp 开头，不按视频处理
+MP4_BRANDS = {
+    b'isom', b'iso2', b'iso3', b'iso4', b'iso5', b'iso6', b'mp41', b'mp42', b'mp71',
+    b'avc1', b'dash', b'M4V ', b'MSNV',
+}
+
+# 最多间隔多少帧强制重新检测，0 表示只由画面变化触发
+KEYFRAME_INTERVAL = int(os.environ.get('WATERMARK_VIDEO_KEYFRAME_INTERVAL', '120'))
+# 画面变化阈值：水印附近缩略图的平均灰度差（0-255）
+CHANGE_THRESHOLD = float(os.environ.get('WATERMARK_VIDEO_CHANGE_THRESHOLD', '12'))
+# 变化检测使用的缩略图边长
+SIGNATURE_SIZE = 32
+# 动图帧没有记录时长时使用的默认值（毫秒）
+DEFAULT_FRAME_DURATION = 100
+DEFAULT_FPS = 25.0
+
+
+class VideoDecodeError(ValueError):
+    """输入的视频或动图无法解码"""
+
+
+# 根据文件头判断是否为视频或多帧动图，返回容器格式，普通图片返回 None；
+# GIF 需要读取全部帧头才能知道帧数，source 为文件路径时不必把整个文件读入内存
+def detect_container(data, source=None):
+    head = bytes(data[:32])
+    if head[4:8] == b'ftyp':
+        return 'mp4' if head[8:12] in MP4_BRANDS else None
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        # VP8X 扩展头的动画标志位
+        return 'webp' if head[12:16] == b'VP8X' and len(head) > 20 and head[20] & 0x02 else None
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        try:
+            with Image.open(source or BytesIO(data)) as im:
+                return 'gif' if getattr(im, 'n_frames', 1) > 1 else None
+        except (OSError, SyntaxError):
+            # 损坏的 GIF 交给图片解码流程报错
+            return None
+    return None
+
+
+# 逐帧解码，生成 (BGR 帧, 时长毫秒)
+def iter_frames(path, container):
+    if container == 'mp4':
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            raise VideoDecodeError('Failed to open video')
+        duration = 1000.0 / (capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS)
+        try:
+            while True:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                yield frame, duration
+        finally:
+            capture.release()
+        return
+
+    try:
+        im = Image.open(path)
+    except (OSError, SyntaxError) as e:
+        raise VideoDecodeError(f'Failed to open animation: {e}') from e
+    with im:
+        frames = ImageSequence.Iterator(im)
+        while True:
+            try:
+                frame = next(frames)
+                rgb = np.asarray(frame.convert('RGB'))
+            except StopIteration:
+                break
+            except (OSError, SyntaxError) as e:
+                raise VideoDecodeError(f'Failed to decode animation frame: {e}') from e
+            yield cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR), frame.info.get('duration', DEFAULT_FRAME_DURATION)
+
+
+# 读取容器的基本信息：帧率（MP4）和循环次数（动图）
+def get_stream_info(path, container):
+    if container == 'mp4':
+        capture = cv2.VideoCapture(path)
+        try:
+            return {'fps': capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS}
+        finally:
+            capture.release()
+    try:
+        with Image.open(path) as im:
+            return {'loop': im.info.get('loop', 0)}
+    except (OSError, SyntaxError) as e:
+        raise VideoDecodeError(f'Failed to open animation: {e}') from e
+
+
+class FrameWriter:
+    """把帧写入输出文件：MP4 逐帧写入，动图在 close 时一次性保存"""
+
+    def __init__(self, path, container, info):
+        self.path = path
+        self.container = container
+        self.info = info
+        self.writer = None
+        self.frames = []
+        self.durations = []
+
+    def write(self, frame, duration):
+        if self.container == 'mp4':
+            if self.writer is None:
+                h, w = frame.shape[:2]
+                fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+                self.writer = cv2.VideoWriter(self.path, fourcc, self.info['fps'], (w, h))
+                if not self.writer.isOpened():
+                    raise ValueError('Failed to open video encoder')
+            self.writer.write(frame)
+            return
+
+        image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        if self.container == 'gif':
+            image = image.convert('P', palette=Image.Palette.ADAPTIVE)
+        self.frames.append(image)
+        self.durations.append(int(round(duration)))
+
+    def close(self):
+        if self.container == 'mp4':
+            if self.writer is not None:
+                self.writer.release()
+            return
+        if not self.frames:
+            raise ValueError('No frames to encode')
+        options = {'lossless': False, 'quality': 90} if self.container == 'webp' else {'disposal': 2}
+        self.frames[0].save(
+            self.path,
+            format=self.container.upper(),
+            save_all=True,
+            append_images=self.frames[1:],
+            duration=self.durations,
+            loop=self.info.get('loop', 0),
+            **options
+        )
+        self.frames = []
+
+
+class TemporalDetector:
+    """在关键帧上检测水印，画面变化不大时后续帧复用同一组水印框和掩码"""
+
+    def __init__(self, detect_fn, keyframe_interval=None, change_threshold=None):
+        self.detect_fn = detect_fn
+        self.keyframe_interval = KEYFRAME_INTERVAL if keyframe_interval is None else keyframe_interval
+        self.change_threshold = CHANGE_THRESHOLD if change_threshold is None else change_threshold
+        self.regions = []
+        self.mask = None
+        self.watch_box = None
+        self.signature = None
+        self.since_keyframe = 0
+        self.keyframes = 0
+
+    # 监视区域：水印框外扩一倍尺寸后的外接矩形，没有水印时监视整帧
+    def _watch_box(self, shape):
+        h, w = shape[:2]
+        if not self.regions:
+            return 0, 0, w, h
+        x1 = min(r[0] for r in self.regions)
+        y1 = min(r[1] for r in self.regions)
+        x2 = max(r[0] + r[2] for r in self.regions)
+        y2 = max(r[1] + r[3] for r in self.regions)
+        pad_x, pad_y = x2 - x1, y2 - y1
+        return max(0, x1 - pad_x), max(0, y1 - pad_y), min(w, x2 + pad_x), min(h, y2 + pad_y)
+
+    # 监视区域的灰度缩略图
+    def _signature(self, frame):
+        x1, y1, x2, y2 = self.watch_box
+        crop = frame[y1:y2, x1:x2]
+        gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+        return cv2.resize(gray, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def _changed(self, frame):
+        if self.signature is None or self.mask is None or self.mask.shape[:2] != frame.shape[:2]:
+            return True
+        if self.keyframe_interval and self.since_keyframe >= self.keyframe_interval:
+            return True
+        diff = np.abs(self._signature(frame) - self.signature).mean()
+        return diff > self.change_threshold
+
+    # 返回当前帧的 (水印框, 掩码, 是否为关键帧)
+    def update(self, frame):
+        if not self._changed(frame):
+            self.since_keyframe += 1
+            return self.regions, self.mask, False
+
+        self.regions = list(self.detect_fn(frame))
+        self.mask = build_mask(frame.shape, self.regions)
+        self.watch_box = self._watch_box(frame.shape)
+        self.signature = self._signature(frame)
+        self.since_keyframe = 0
+        self.keyframes += 1
+        return self.regions, self.mask, True
+
+
+# 流式处理：detect_fn(frame) 返回水印框，inpaint_fn(frame, regions, mask) 返回修复后的帧。
+# 传入 pool（api.shm.SharedImagePool）时帧经由共享内存交给工作进程修复，inpaint_fn 必须可以 pickle，
+# 并且收到的 mask 为 None（工作进程自己根据水印框生成掩码）；按输入顺序写出，最多同时处理 2 倍进程数的帧
+def process_file(src, dst, container, detect_fn, inpaint_fn, keyframe_interval=None, change_threshold=None,
+                 pool=None):
+    detector = TemporalDetector(detect_fn, keyframe_interval, change_threshold)
+    writer = FrameWriter(dst, container, get_stream_info(src, container))
+    stats = {'frames': 0, 'inpainted': 0}
+    window = 2 * pool.processes if pool is not None else 0
+    pending = deque()
+
+    # 写出最早的一帧，共享内存中的帧写出后归还给分配器
+    def flush():
+        shared, result, duration = pending.popleft()
+        if shared is None:
+            writer.write(result, duration)
+            return
+        try:
+            result.result()
+            writer.write(shared.array, duration)
+        finally:
+            pool.release(shared)
+
+    try:
+        for frame, duration in iter_frames(src, container):
+            regions, mask, _ = detector.update(frame)
+            if regions:
+                stats['inpainted'] += 1
+                if pool is not None:
+                    shared, future = pool.submit(inpaint_fn, frame, regions, None)
+                    pending.append((shared, future, duration))
+                else:
+                    pending.append((None, inpaint_fn(frame, regions, mask), duration))
+            else:
+                pending.append((None, frame, duration))
+            stats['frames'] += 1
+            while len(pending) > window:
+                flush()
+        while pending:
+            flush()
+    finally:
+        # 出错时也要归还还在处理中的帧
+        for shared, result, _ in pending:
+            if shared is not None:
+                result.cancel()
+                pool.release(shared)
+    writer.close()
+    stats['keyframes'] = detector.keyframes
+    return stats
+
+
+# 工作进程初始化：线程配置与批处理 CLI 的工作进程相同
+def init_worker(processes=1):
+    from api.sessions import configure_worker_process
+
+    configure_worker_process(processes)
+    cv2.setNumThreads(1)
+
+
+# 处理内存中的视频或动图，返回 (输出字节, 统计信息)；解码器需要文件路径，使用临时目录中转
+def process_bytes(data, container, detect_fn, inpaint_fn, keyframe_interval=None, change_threshold=None):
+    ext = CONTAINERS[container][0]
+    tmp_dir = tempfile.mkdtemp(prefix='watermark-video-')
+    try:
+        src = os.path.join(tmp_dir, 'input' + ext)
+        dst = os.path.join(tmp_dir, 'output' + ext)
+        with open(src, 'wb') as f:
+            f.write(data)
+        stats = process_file(src, dst, container, detect_fn, inpaint_fn, keyframe_interval, change_threshold)
+        with open(dst, 'rb') as f:
+            return f.read(), stats
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='移除视频和动图中的水印')
+    parser.add_argument('input', help='输入文件（MP4、GIF 或动态 WebP）')
+    parser.add_argument('output', help='输出文件，格式与输入相同')
+    parser.add_argument('--keyframe-interval', type=int, default=None, help='最多间隔多少帧重新检测')
+    parser.add_argument('--change-threshold', type=float, default=None, help='触发重新检测的画面变化阈值')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='修复帧的工作进程数，帧通过共享内存传递；默认在当前进程内修复')
+    parser.add_argument('--backend', choices=['auto', 'migan', 'telea', 'ns', 'fill'], default=None,
+                        help='修复后端，默认按区域自动选择')
+    args = parser.parse_args(argv)
+
+    from api.index import detect_watermark_regions, inpaint_frame, warmup
+
+    with open(args.input, 'rb') as f:
+        container = detect_container(f.read(32), args.input)
+    if container is None:
+        print(f"不是视频或多帧动图: {args.input}", file=sys.stderr)
+        return 1
+
+    pool = None
+    if args.processes > 0:
+        pool = SharedImagePool(args.processes, initializer=functools.partial(init_worker, args.processes))
+    try:
+        # 工作进程各自加载模型；只使用 OpenCV 或填充后端时不需要模型文件
+        warmup(inpaint=pool is None and uses_model(args.backend))
+        stats = process_file(
+            args.input, args.output, container, detect_watermark_regions,
+            functools.partial(inpaint_frame, backend=args.backend),
+            args.keyframe_interval, args.change_threshold, pool
+        )
+    finally:
+        if pool is not None:
+            pool.close()
+    print(f"完成: {stats['frames']} 帧，关键帧 {stats['keyframes']}，修复 {stats['inpainted']} 帧")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
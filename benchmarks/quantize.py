@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+inpaint 模型的量化变体和精度/速度校准
+
+由 fp32 的 MI-GAN 模型生成 int8（静态 QDQ 量化，激活范围用合成水印图片校准）和 fp16 变体，
+保存在原模型旁边（migan_pipeline_v2.int8.onnx、migan_pipeline_v2.fp16.onnx），
+运行时通过 WATERMARK_INPAINT_PRECISION 选择。校准步骤在合成水印图片的修复裁剪块上分别运行 fp32 和各变体，
+以没有水印的背景为参考报告 PSNR/SSIM 及其相对 fp32 的差值，并报告延迟和加速比（JSON）
+
+用法:
+    python -m benchmarks.quantize [--model PATH] [--precisions int8,fp16] [--method static]
+                                  [--resolution 1080p] [--samples 8] [--iterations 5]
+                                  [--threads N] [--evaluate-only] [--output report.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(bench_dir)
+sys.path.insert(0, project_root)
+
+from api.masks import build_mask
+from api.models import get_base_inpaint_model, get_model_variant
+from api.regions import extract_crops
+from api.sessions import auto_intra_op_threads, create_session
+from benchmarks.run import get_environment, percentile
+from benchmarks.synthetic import generate_sample
+
+PRECISIONS = ['int8', 'fp16']
+
+
+# 生成校准和评估用的修复裁剪块：{'image', 'mask', 'reference'}，reference 为同一位置没有水印的背景
+def build_samples(resolution, count, seed=0, font=None):
+    samples = []
+    for i in range(count):
+        img, boxes, background = generate_sample(resolution, seed + i, font)
+        mask = build_mask(img.shape, boxes)
+        for (x1, y1, x2, y2), crop_img, crop_mask in extract_crops(img, mask, boxes):
+            samples.append({'image': crop_img, 'mask': crop_mask, 'reference': background[y1:y2, x1:x2]})
+    return samples
+
+
+# 模型输入：与线上推理相同的预处理
+def model_feeds(input_names, sample):
+    from api.index import preprocess_image, preprocess_mask
+
+    image = preprocess_image(sample['image'])
+    mask = preprocess_mask(sample['mask'], sample['image'].shape)
+    return {input_names[0]: np.ascontiguousarray(image), input_names[1]: np.ascontiguousarray(mask)}
+
+
+def _input_names(model_path):
+    import onnx
+
+    model = onnx.load(model_path, load_external_data=False)
+    initializers = {init.name for init in model.graph.initializer}
+    return [i.name for i in model.graph.input if i.name not in initializers]
+
+
+# int8 量化：static 用合成图片校准激活范围后生成 QDQ 模型，dynamic 只量化权重
+def quantize_int8(src, dst, samples, method='static'):
+    from onnxruntime.quantization import (CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic,
+                                          quantize_static)
+
+    if method == 'dynamic':
+        quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+        return
+
+    input_names = _input_names(src)
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.feeds = iter([model_feeds(input_names, sample) for sample in samples])
+
+        def get_next(self):
+            return next(self.feeds, None)
+
+    quantize_static(
+        src, dst, Reader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True
+    )
+
+
+# fp16 转换：模型输入输出保持原类型，内部的浮点张量转换为 fp16
+def convert_fp16(src, dst):
+    import onnx
+    from onnxruntime.transformers.float16 import convert_float_to_float16
+
+    model = convert_float_to_float16(onnx.load(src), keep_io_types=True)
+    onnx.save(model, dst)
+
+
+# PSNR（dB），两张图片完全相同时返回 inf
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+# SSIM：11x11 高斯窗口（sigma 1.5），多通道取平均
+def ssim(a, b):
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+
+    def blur(x):
+        return cv2.GaussianBlur(x, (11, 11), 1.5)
+
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+
+# 在所有样本上运行模型，返回 (每个样本合成后的修复结果, 延迟毫秒列表)
+def run_model(model_path, samples, iterations, threads):
+    from api.index import postprocess_output
+
+    # 不读写优化模型缓存，每个变体都从原始文件加载
+    session = create_session(model_path, intra_op_threads=threads, cache_dir='')
+    input_names = [i.name for i in session.get_inputs()]
+    outputs, latencies = [], []
+    for sample in samples:
+        feeds = model_feeds(input_names, sample)
+        output = session.run(None, feeds)[0]
+        for _ in range(iterations):
+            t0 = time.perf_counter()
+            session.run(None, feeds)
+            latencies.append((time.perf_counter() - t0) * 1000)
+        inpainted = postprocess_output(output, sample['image'].shape)
+        # 只有掩码区域会写回原图
+        hole = sample['mask'] < 128
+        outputs.append(np.where(hole[:, :, None], inpainted, sample['image']))
+    return outputs, latencies
+
+
+# 评估一个模型：延迟、相对无水印背景的 PSNR/SSIM，传入 fp32 的结果时附带差值和与 fp32 输出的一致程度
+def evaluate(model_path, samples, iterations, threads, baseline=None):
+    outputs, latencies = run_model(model_path, samples, iterations, threads)
+    report = {
+        'model': model_path,
+        'size_bytes': os.path.getsize(model_path),
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'mean_ms': sum(latencies) / len(latencies),
+        'psnr_db': float(np.mean([psnr(out, s['reference']) for out, s in zip(outputs, samples)])),
+        'ssim': float(np.mean([ssim(out, s['reference']) for out, s in zip(outputs, samples)])),
+    }
+    if baseline is not None:
+        base_report, base_outputs = baseline
+        report['psnr_delta_db'] = report['psnr_db'] - base_report['psnr_db']
+        report['ssim_delta'] = report['ssim'] - base_report['ssim']
+        report['psnr_vs_fp32_db'] = float(np.mean([psnr(a, b) for a, b in zip(outputs, base_outputs)]))
+        report['ssim_vs_fp32'] = float(np.mean([ssim(a, b) for a, b in zip(outputs, base_outputs)]))
+        report['speedup'] = base_report['p50_ms'] / report['p50_ms'] if report['p50_ms'] > 0 else 0.0
+    return report, outputs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='生成 inpaint 模型的量化变体并校准精度和速度')
+    parser.add_argument('--model', default=None, help='fp32 模型路径，默认与线上使用的模型相同')
+    parser.add_argument('--precisions', default=','.join(PRECISIONS), help='要生成和评估的精度: int8,fp16')
+    parser.add_argument('--method', choices=['static', 'dynamic'], default='static', help='int8 量化方式')
+    parser.add_argument('--resolution', default='1080p', help='合成图片的分辨率')
+    parser.add_argument('--samples', type=int, default=8, help='合成图片数量（校准和评估共用）')
+    parser.add_argument('--iterations', type=int, default=5, help='每个裁剪块的计时次数')
+    parser.add_argument('--seed', type=int, default=0, help='合成图片的随机种子')
+    parser.add_argument('--font', default=None, help='用于渲染水印的中文字体')
+    parser.add_argument('--threads', type=int, default=None, help='intra-op 线程数，默认按可用 CPU 自动选择')
+    parser.add_argument('--evaluate-only', action='store_true', help='只评估已经存在的变体，不重新生成')
+    parser.add_argument('--output', default=None, help='报告 JSON 输出路径，默认输出到标准输出')
+    args = parser.parse_args(argv)
+
+    model_path = args.model or get_base_inpaint_model()
+    if not os.path.exists(model_path):
+        print(f'模型不存在: {model_path}', file=sys.stderr)
+        return 1
+    precisions = [p.strip() for p in args.precisions.split(',') if p.strip()]
+    unknown = [p for p in precisions if p not in PRECISIONS]
+    if unknown:
+        print(f"未知的精度: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+    threads = args.threads or auto_intra_op_threads()
+
+    samples = build_samples(args.resolution, args.samples, args.seed, args.font)
+    if not samples:
+        print('合成图片中没有可修复的区域', file=sys.stderr)
+        return 1
+
+    variants = {}
+    for precision in precisions:
+        path = get_model_variant(model_path, precision)
+        if not args.evaluate_only:
+            print(f'generating {precision} -> {path} ...', file=sys.stderr)
+            if precision == 'int8':
+                quantize_int8(model_path, path, samples, args.method)
+            else:
+                convert_fp16(model_path, path)
+        if not os.path.exists(path):
+            print(f'变体不存在，跳过: {path}', file=sys.stderr)
+            continue
+        variants[precision] = path
+
+    print('evaluating fp32 ...', file=sys.stderr)
+    base_report, base_outputs = evaluate(model_path, samples, args.iterations, threads)
+    results = {'fp32': base_report}
+    for precision, path in variants.items():
+        print(f'evaluating {precision} ...', file=sys.stderr)
+        results[precision], _ = evaluate(path, samples, args.iterations, threads, (base_report, base_outputs))
+
+    report = {
+        'environment': get_environment(),
+        'config': {
+            'resolution': args.resolution,
+            'samples': args.samples,
+            'crops': len(samples),
+            'iterations': args.iterations,
+            'seed': args.seed,
+            'method': args.method,
+            'intra_op_threads': threads,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
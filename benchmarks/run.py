@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+去水印流水线性能基准
+
+在 512、1080p、4K、8K 的合成水印图片上分别测量仅检测、仅修复和端到端三条路径，
+输出吞吐量、p50/p95/p99 延迟和峰值内存（JSON），并与基线文件比较，出现回退时返回非零退出码。
+每个用例在独立的子进程中运行，峰值内存互不影响
+
+用法:
+    python -m benchmarks.run [--paths detect,inpaint,e2e] [--resolutions 512,1080p]
+                             [--iterations 10] [--baseline benchmarks/baseline.json]
+                             [--update-baseline] [--output result.json]
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import platform
+import queue
+import sys
+import time
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(bench_dir)
+sys.path.insert(0, project_root)
+
+PATHS = ['detect', 'inpaint', 'e2e']
+DEFAULT_BASELINE = os.path.join(bench_dir, 'baseline.json')
+# 允许的性能波动比例
+DEFAULT_TOLERANCE = 0.15
+
+
+# 计算百分位数（线性插值）
+def percentile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * q / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+# 子进程：运行单个用例，返回统计结果
+def _run_case(path, resolution, iterations, warmup_iterations, seed, font):
+    # 基准测试需要每次都真正执行流水线
+    os.environ['WATERMARK_CACHE'] = '0'
+
+    from api import index
+    from api.tracing import peak_rss
+    from benchmarks.synthetic import generate_image
+
+    # 生成若干张不同的图片循环使用
+    samples = [generate_image(resolution, seed + i, font) for i in range(min(iterations, 4))]
+
+    def run_once(img, boxes):
+        if path == 'detect':
+            index.detect_watermark_regions(img)
+        elif path == 'inpaint':
+            index.inpaint_watermark(img, boxes)
+        else:
+            index.remove_watermark(img)
+
+    index.warmup(ocr=path != 'inpaint', inpaint=path != 'detect')
+    for i in range(warmup_iterations):
+        run_once(*samples[i % len(samples)])
+
+    rss_before = peak_rss()
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        img, boxes = samples[i % len(samples)]
+        t0 = time.perf_counter()
+        run_once(img, boxes)
+        latencies.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+
+    return {
+        'iterations': iterations,
+        'throughput_per_s': iterations / elapsed if elapsed > 0 else 0.0,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'mean_ms': sum(latencies) / len(latencies),
+        'peak_rss_bytes': peak_rss(),
+        'peak_rss_increase_bytes': peak_rss() - rss_before,
+    }
+
+
+def _case_entry(queue, *args):
+    try:
+        queue.put(('ok', _run_case(*args)))
+    except Exception as e:
+        import traceback
+        queue.put(('error', f'{e}\n{traceback.format_exc()}'))
+
+
+# 在独立子进程中运行用例；子进程没有返回结果就退出（例如被 OOM 杀死）时抛出 RuntimeError
+def run_case(*args):
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    process = ctx.Process(target=_case_entry, args=(results, *args))
+    process.start()
+    while True:
+        try:
+            status, payload = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                # 进程退出前放入的结果可能还在管道中
+                try:
+                    status, payload = results.get(timeout=1.0)
+                    break
+                except queue.Empty:
+                    raise RuntimeError(f'case process exited with code {process.exitcode} without a result')
+    process.join()
+    if status != 'ok':
+        raise RuntimeError(payload)
+    return payload
+
+
+# 运行环境信息
+def get_environment():
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+    for module in ('numpy', 'cv2', 'onnxruntime', 'easyocr'):
+        try:
+            info[module] = __import__(module).__version__
+        except Exception:
+            info[module] = None
+    return info
+
+
+# 与基线比较，返回回退列表
+def compare(results, baseline, tolerance):
+    regressions = []
+    for key, current in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        if current['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p50 {current['p50_ms']:.1f}ms > baseline {base['p50_ms']:.1f}ms")
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {current['p95_ms']:.1f}ms > baseline {base['p95_ms']:.1f}ms")
+        if current['throughput_per_s'] < base['throughput_per_s'] / (1 + tolerance):
+            regressions.append(
+                f"{key}: throughput {current['throughput_per_s']:.2f}/s < baseline {base['throughput_per_s']:.2f}/s"
+            )
+        if base.get('peak_rss_increase_bytes') and \
+                current['peak_rss_increase_bytes'] > base['peak_rss_increase_bytes'] * (1 + tolerance):
+            regressions.append(
+                f"{key}: peak RSS increase {current['peak_rss_increase_bytes']} > "
+                f"baseline {base['peak_rss_increase_bytes']}"
+            )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='去水印流水线性能基准')
+    parser.add_argument('--paths', default=','.join(PATHS), help='要测试的路径: detect,inpaint,e2e')
+    parser.add_argument('--resolutions', default='512,1080p,4k,8k', help='要测试的分辨率')
+    parser.add_argument('--iterations', type=int, default=10, help='每个用例的计时次数')
+    parser.add_argument('--warmup', type=int, default=2, help='每个用例的预热次数')
+    parser.add_argument('--seed', type=int, default=0, help='合成图片的随机种子')
+    parser.add_argument('--font', default=None, help='用于渲染水印的中文字体')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='基线文件')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE, help='允许的波动比例')
+    parser.add_argument('--update-baseline', action='store_true', help='用本次结果覆盖基线文件')
+    parser.add_argument('--output', default=None, help='结果 JSON 输出路径，默认输出到标准输出')
+    args = parser.parse_args(argv)
+
+    paths = [p.strip() for p in args.paths.split(',') if p.strip()]
+    resolutions = [r.strip() for r in args.resolutions.split(',') if r.strip()]
+
+    results = {}
+    failures = {}
+    for path in paths:
+        for resolution in resolutions:
+            key = f'{path}/{resolution}'
+            print(f'running {key} ...', file=sys.stderr)
+            try:
+                results[key] = run_case(path, resolution, args.iterations, args.warmup, args.seed, args.font)
+            except RuntimeError as e:
+                print(f'{key} failed: {e}', file=sys.stderr)
+                failures[key] = str(e)
+
+    report = {
+        'environment': get_environment(),
+        'config': {'iterations': args.iterations, 'warmup': args.warmup, 'seed': args.seed},
+        'results': results,
+    }
+    if failures:
+        report['failures'] = failures
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    # 有用例失败时不写基线，直接以非零退出码结束
+    if failures:
+        print(f'{len(failures)} case(s) failed: {", ".join(failures)}', file=sys.stderr)
+        return 1
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+        print(f'baseline written to {args.baseline}', file=sys.stderr)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f'no baseline at {args.baseline}; run with --update-baseline to create one', file=sys.stderr)
+        return 0
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f).get('results', {})
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print('PERFORMANCE REGRESSION:', file=sys.stderr)
+        for line in regressions:
+            print(f'  {line}', file=sys.stderr)
+        return 1
+    print('no regressions against baseline', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
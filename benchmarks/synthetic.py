@@ -0,0 +1,106 @@
+"""
+离线生成带 "豆包AI生成" 水印的合成测试图片
+
+背景由固定随机种子生成（渐变 + 色块 + 噪声），水印以半透明白字渲染在右下角，
+同一种子和分辨率生成的图片逐像素一致
+"""
+
+import os
+
+import cv2
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# 水印文字及其常见变体
+WATERMARK_TEXTS = ['豆包AI生成', '豆包Ai生成', '豆包A1生成', '豆包AI']
+
+# 测试分辨率 (宽, 高)
+RESOLUTIONS = {
+    '512': (512, 512),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+
+# 常见的中文字体路径，也可以通过 WATERMARK_BENCH_FONT 指定
+FONT_CANDIDATES = [
+    '/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-microhei.ttc',
+    '/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc',
+    '/System/Library/Fonts/PingFang.ttc',
+    '/System/Library/Fonts/STHeiti Medium.ttc',
+    'C:\\Windows\\Fonts\\msyh.ttc',
+    'C:\\Windows\\Fonts\\simhei.ttf',
+]
+
+
+# 查找可以渲染中文的字体
+def find_font(path=None):
+    candidates = [path or os.environ.get('WATERMARK_BENCH_FONT')] + FONT_CANDIDATES
+    for candidate in candidates:
+        if candidate and os.path.exists(candidate):
+            return candidate
+    raise FileNotFoundError(
+        'No CJK font found; pass --font or set WATERMARK_BENCH_FONT to a font that can render 豆包AI生成'
+    )
+
+
+# 生成随机背景
+def make_background(width, height, rng):
+    # 双线性渐变
+    corners = rng.integers(0, 256, size=(2, 2, 3)).astype(np.float32)
+    background = cv2.resize(corners, (width, height), interpolation=cv2.INTER_LINEAR)
+
+    # 随机色块
+    for _ in range(12):
+        x1, x2 = sorted(rng.integers(0, width, size=2))
+        y1, y2 = sorted(rng.integers(0, height, size=2))
+        color = rng.integers(0, 256, size=3).tolist()
+        cv2.rectangle(background, (int(x1), int(y1)), (int(x2), int(y2)), color, -1)
+    background = cv2.GaussianBlur(background, (0, 0), sigmaX=max(width, height) / 200)
+
+    # 高频噪声
+    background += rng.normal(0, 12, size=background.shape).astype(np.float32)
+    return np.clip(background, 0, 255).astype(np.uint8)
+
+
+# 在右下角渲染半透明水印，返回 (BGR 图片, [(x, y, w, h)])
+def render_watermark(img, text, font_path, rng):
+    height, width = img.shape[:2]
+    font_size = max(12, int(width * 0.018))
+    font = ImageFont.truetype(font_path, font_size)
+
+    overlay = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    text_w, text_h = right - left, bottom - top
+
+    margin = int(font_size * (1.0 + rng.random()))
+    x = width - text_w - margin
+    y = height - text_h - margin
+    alpha = int(rng.integers(150, 230))
+    draw.text((x - left + 1, y - top + 1), text, font=font, fill=(0, 0, 0, alpha // 3))
+    draw.text((x - left, y - top), text, font=font, fill=(255, 255, 255, alpha))
+
+    base = Image.fromarray(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)).convert('RGBA')
+    composed = Image.alpha_composite(base, overlay).convert('RGB')
+    result = cv2.cvtColor(np.asarray(composed), cv2.COLOR_RGB2BGR)
+    return result, [(x, y, text_w + 1, text_h + 1)]
+
+
+# 生成一张合成测试图片，返回 (BGR 图片, 水印框列表, 没有水印的背景)，背景可以作为修复结果的参考
+def generate_sample(resolution, seed=0, font_path=None, text=None):
+    width, height = RESOLUTIONS[resolution] if isinstance(resolution, str) else resolution
+    rng = np.random.default_rng(seed)
+    if text is None:
+        text = WATERMARK_TEXTS[seed % len(WATERMARK_TEXTS)]
+    background = make_background(width, height, rng)
+    img, boxes = render_watermark(background, text, find_font(font_path), rng)
+    return img, boxes, background
+
+
+# 生成一张合成测试图片，返回 (BGR 图片, 水印框列表)
+def generate_image(resolution, seed=0, font_path=None, text=None):
+    img, boxes, _ = generate_sample(resolution, seed, font_path, text)
+    return img, boxes
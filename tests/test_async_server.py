@@ -0,0 +1,39 @@
+"""
+并发服务器：非法的 Content-Length 返回 400，过大的请求体返回 413
+"""
+
+import asyncio
+
+import pytest
+
+from api.async_server import AsyncServer
+from api.multipart import MAX_BODY_SIZE
+
+
+async def send(request):
+    app = AsyncServer(workers=1)
+    server = await asyncio.start_server(app.handle_connection, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(request)
+        await writer.drain()
+        response = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        return response
+    finally:
+        server.close()
+        await server.wait_closed()
+        app.executor.shutdown(wait=False)
+
+
+@pytest.mark.parametrize('length, status', [
+    ('abc', b'400'),
+    ('-5', b'400'),
+    (str(MAX_BODY_SIZE + 1), b'413'),
+])
+def test_rejects_bad_content_length(length, status):
+    request = f'POST /api HTTP/1.1\r\nHost: test\r\nContent-Length: {length}\r\n\r\n'.encode('latin-1')
+    response = asyncio.run(send(request))
+    assert response.split(b' ', 2)[1] == status
+    assert b'Connection: close' in response
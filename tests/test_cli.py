@@ -0,0 +1,45 @@
+"""
+批处理命令行：只使用填充后端时不需要 inpaint 模型文件
+
+工作进程通过 spawn 启动，测试在 sys.path 中放入一个替身 easyocr 模块，每张图片识别出一个水印框
+"""
+
+import textwrap
+
+import cv2
+import numpy as np
+
+from api.cli import run_pipeline
+
+FAKE_EASYOCR = '''
+class Reader:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def readtext(self, img, **kwargs):
+        h, w = img.shape[:2]
+        box = [[w - 60, h - 30], [w - 10, h - 30], [w - 10, h - 10], [w - 60, h - 10]]
+        return [(box, '豆包AI生成', 0.9)]
+'''
+
+
+def test_fill_backend_without_model(tmp_path, monkeypatch):
+    fake_dir = tmp_path / 'fake'
+    fake_dir.mkdir()
+    (fake_dir / 'easyocr.py').write_text(textwrap.dedent(FAKE_EASYOCR), encoding='utf-8')
+    # spawn 启动的子进程沿用父进程的 sys.path
+    monkeypatch.syspath_prepend(str(fake_dir))
+    monkeypatch.setenv('WATERMARK_INPAINT_MODEL', str(tmp_path / 'missing.onnx'))
+    monkeypatch.setenv('WATERMARK_CACHE', '0')
+
+    src = tmp_path / 'in'
+    src.mkdir()
+    for i in range(3):
+        img = np.full((120, 160, 3), 180, dtype=np.uint8)
+        cv2.putText(img, 'AI', (110, 105), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        cv2.imwrite(str(src / f'{i}.png'), img)
+
+    stats = run_pipeline(str(src), str(tmp_path / 'out'), workers=1, backend='fill')
+    assert stats['written'] == 3
+    assert stats['crashed_workers'] == 0
+    assert len(list((tmp_path / 'out').iterdir())) == 3
@@ -0,0 +1,33 @@
+"""
+检测：分块线程中的阶段耗时记入当前请求的 trace，模板摘要随内容变化
+"""
+
+import numpy as np
+
+from api.detection import detect_tiled
+from api.tracing import end_trace, stage, start_trace
+
+
+def test_tile_threads_record_into_request_trace():
+    def detect_fn(tile):
+        with stage('ocr'):
+            return []
+
+    region = np.zeros((300, 300, 3), dtype=np.uint8)
+    trace, token = start_trace()
+    try:
+        detect_tiled(region, detect_fn, tile_size=100, overlap=10, workers=4)
+    finally:
+        end_trace(token)
+    assert trace.stages['ocr']['count'] > 1
+
+
+def test_template_fingerprint_tracks_content():
+    from api.templates import TemplateLibrary
+
+    rng = np.random.default_rng(0)
+    library = TemplateLibrary()
+    library.add('mark', rng.integers(0, 256, (20, 60), dtype=np.uint8))
+    before = library.fingerprint
+    library.add('mark', rng.integers(0, 256, (20, 60), dtype=np.uint8))
+    assert library.fingerprint != before
@@ -0,0 +1,73 @@
+"""
+修复流程的回归测试：结果保持输入的通道布局（灰度、BGR、BGRA），批量处理中单张图片出错不影响其他图片
+
+用一个原样输出图像的替身 ONNX 模型代替 MI-GAN，覆盖 region、tiled、full 三种修复模式
+"""
+
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip('onnx')
+
+from api import index
+from api.sessions import get_session_pool
+
+
+# 替身模型：uint8 的 image/mask 输入，输出与 image 相同的 result
+@pytest.fixture
+def stand_in_model(tmp_path, monkeypatch):
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [helper.make_node('Identity', ['image'], ['result'])],
+        'stand_in',
+        [helper.make_tensor_value_info('image', TensorProto.UINT8, ['B', 3, 'H', 'W']),
+         helper.make_tensor_value_info('mask', TensorProto.UINT8, ['B', 1, 'H', 'W'])],
+        [helper.make_tensor_value_info('result', TensorProto.UINT8, ['B', 3, 'H', 'W'])]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)])
+    model.ir_version = 8
+    path = str(tmp_path / 'stand_in.onnx')
+    onnx.save(model, path)
+    pool = get_session_pool(path, cache_dir=str(tmp_path / 'ort'))
+    monkeypatch.setattr(index, 'get_inpaint_session_pool', lambda: pool)
+
+
+def make_images():
+    rng = np.random.default_rng(0)
+    bgr = rng.integers(0, 255, (240, 320, 3), dtype=np.uint8)
+    alpha = np.full((240, 320, 1), 200, dtype=np.uint8)
+    return {'gray': bgr[:, :, 0].copy(), 'bgr': bgr, 'bgra': np.concatenate([bgr, alpha], axis=2)}
+
+
+@pytest.mark.parametrize('layout', ['gray', 'bgr', 'bgra'])
+@pytest.mark.parametrize('inpaint_mode', ['region', 'tiled', 'full'])
+def test_inpaint_keeps_channel_layout(stand_in_model, layout, inpaint_mode):
+    img = make_images()[layout]
+    result = index.inpaint_watermark(img, [(200, 190, 100, 30)], inpaint_mode, backend='migan')
+    assert result.shape == img.shape
+    if layout == 'bgra':
+        assert (result[:, :, 3] == 200).all()
+
+
+def test_batch_keeps_channel_layout(stand_in_model, monkeypatch):
+    images = list(make_images().values())
+    monkeypatch.setattr(index, 'detect_in_rois_batch', lambda imgs, *args: [[(200, 190, 100, 30)] for _ in imgs])
+    outputs = index.remove_watermarks(images, backend='migan')
+    assert [output['result'].shape for output in outputs] == [img.shape for img in images]
+
+
+def test_batch_isolates_placement_errors(stand_in_model, monkeypatch):
+    images = list(make_images().values())
+    monkeypatch.setattr(index, 'detect_in_rois_batch', lambda imgs, *args: [[(200, 190, 100, 30)] for _ in imgs])
+    original = index.place_inpainted
+
+    def place_inpainted(output, window, img, mask, inpainted):
+        if img.ndim == 2:
+            raise ValueError('placement failed')
+        original(output, window, img, mask, inpainted)
+
+    monkeypatch.setattr(index, 'place_inpainted', place_inpainted)
+    outputs = index.remove_watermarks(images, backend='migan')
+    assert outputs[0] == {'error': 'placement failed'}
+    assert [output['result'].shape for output in outputs[1:]] == [img.shape for img in images[1:]]
@@ -0,0 +1,52 @@
+"""
+任务模式：结果的格式默认与输入相同
+"""
+
+import json
+
+import cv2
+import numpy as np
+
+from api import index
+from api.jobs import JobManager, JobStore
+
+
+def submit_event(data, accept=''):
+    boundary = '----job'
+    body = (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="input.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + data + f'\r\n--{boundary}--\r\n'.encode()
+    return {
+        'httpMethod': 'POST',
+        'headers': {'content-type': f'multipart/form-data; boundary={boundary}', 'accept': accept},
+        'body': body,
+        'path': '/api/jobs',
+        'queryStringParameters': {},
+        'rawResponseBody': True,
+    }
+
+
+def test_job_result_keeps_input_format(tmp_path, monkeypatch):
+    manager = JobManager(index.process_job, JobStore(str(tmp_path)), workers=1).start()
+    monkeypatch.setattr(index, 'get_job_manager', lambda: manager)
+    monkeypatch.setattr(index, 'detect_watermark_regions', lambda img, *args, **kwargs: [])
+    try:
+        ok, jpeg = cv2.imencode('.jpg', np.full((64, 64, 3), 128, dtype=np.uint8))
+        response = index.handler(submit_event(jpeg.tobytes(), 'application/json'), None)
+        assert response['statusCode'] == 202
+        job_id = json.loads(response['body'])['id']
+        assert manager.wait(job_id, 10)['status'] == 'done'
+
+        result = index.handler({
+            'httpMethod': 'GET',
+            'headers': {},
+            'path': f'/api/jobs/{job_id}/result',
+            'queryStringParameters': {},
+            'rawResponseBody': True,
+        }, None)
+        assert result['statusCode'] == 200
+        assert result['headers']['Content-Type'] == 'image/jpeg'
+        assert result['body'][:3] == b'\xff\xd8\xff'
+    finally:
+        manager.stop()
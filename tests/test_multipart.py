@@ -0,0 +1,144 @@
+"""
+零拷贝 multipart/form-data 解析器
+"""
+
+import io
+import json
+
+import pytest
+
+from api import index
+from api.multipart import MultipartError, PartTooLarge, parse_multipart, read_body
+
+BOUNDARY = 'xYzBoundary'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def file_part(name, filename, content):
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    ).encode() + content + b'\r\n'
+
+
+def text_part(name, value):
+    value = value if isinstance(value, bytes) else value.encode('utf-8')
+    return f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value + b'\r\n'
+
+
+def close():
+    return f'--{BOUNDARY}--\r\n'.encode()
+
+
+class ChunkedStream(io.RawIOBase):
+    """每次最多返回 size 字节的流，模拟分隔符被拆在多次读取之间"""
+
+    def __init__(self, data, size):
+        self.data = data
+        self.pos = 0
+        self.size = size
+
+    def readinto(self, buffer):
+        n = min(len(buffer), self.size, len(self.data) - self.pos)
+        buffer[:n] = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return n
+
+
+def test_fields_are_views_of_the_body():
+    body = bytearray(file_part('image', 'a.png', b'\x89PNG binary') + text_part('boxes', '[[1, 2, 3, 4]]') + close())
+    form = parse_multipart(body, CONTENT_TYPE)
+    assert form['boxes'] == '[[1, 2, 3, 4]]'
+    assert form['image']['filename'] == 'a.png'
+    assert isinstance(form['image']['content'], memoryview)
+    assert form['image']['content'].obj is body
+    assert bytes(form['image']['content']) == b'\x89PNG binary'
+
+
+def test_repeated_file_fields_become_a_list():
+    body = file_part('image', 'a.png', b'a') + file_part('image', 'b.png', b'b') + close()
+    form = parse_multipart(body, CONTENT_TYPE)
+    assert [bytes(item['content']) for item in form['image']] == [b'a', b'b']
+
+
+@pytest.mark.parametrize('chunk', [1, 7, len(BOUNDARY) + 3])
+def test_boundary_split_across_reads(chunk):
+    # 内容中包含分隔符的前缀，读取块的边界落在分隔符中间
+    content = b'--' + BOUNDARY[:5].encode() + b'\r\n--' + BOUNDARY[:-1].encode()
+    data = file_part('image', 'a.bin', content) + text_part('mode', 'x') + close()
+    body = read_body(ChunkedStream(data, chunk), len(data))
+    form = parse_multipart(body, CONTENT_TYPE)
+    assert bytes(form['image']['content']) == content
+    assert form['mode'] == 'x'
+
+
+def test_preamble_and_epilogue_are_ignored():
+    body = b'This is the preamble.\r\n' + text_part('a', '1') + close() + b'This is the epilogue.\r\n'
+    assert parse_multipart(body, CONTENT_TYPE) == {'a': '1'}
+
+
+def test_transport_padding_after_delimiter():
+    body = text_part('a', '1').replace(BOUNDARY.encode() + b'\r\n', BOUNDARY.encode() + b' \t \r\n') + close()
+    assert parse_multipart(body, CONTENT_TYPE) == {'a': '1'}
+
+
+def test_quoted_boundary_and_filename_with_semicolon():
+    body = file_part('image', 'a;b.png', b'x') + close()
+    form = parse_multipart(body, f'multipart/form-data; boundary="{BOUNDARY}"')
+    assert form['image']['filename'] == 'a;b.png'
+
+
+@pytest.mark.parametrize('body, error', [
+    (b'no delimiter here', 'boundary not found'),
+    (text_part('a', '1')[:-2], 'Unterminated'),
+    (f'--{BOUNDARY}garbage\r\n'.encode(), 'Malformed multipart delimiter'),
+    (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="a"\r\n'.encode(), 'Malformed multipart headers'),
+])
+def test_malformed_bodies(body, error):
+    with pytest.raises(MultipartError, match=error):
+        parse_multipart(body, CONTENT_TYPE)
+
+
+def test_missing_boundary():
+    with pytest.raises(MultipartError, match='Missing multipart boundary'):
+        parse_multipart(close(), 'multipart/form-data')
+
+
+def test_non_utf8_text_field():
+    with pytest.raises(MultipartError, match='not valid UTF-8'):
+        parse_multipart(text_part('boxes', b'\xff\xfe') + close(), CONTENT_TYPE)
+
+
+def test_part_size_limit():
+    body = file_part('image', 'a.bin', b'x' * 100) + close()
+    assert bytes(parse_multipart(body, CONTENT_TYPE, max_part_size=100)['image']['content']) == b'x' * 100
+    with pytest.raises(PartTooLarge):
+        parse_multipart(body, CONTENT_TYPE, max_part_size=99)
+
+
+def test_body_size_limit():
+    with pytest.raises(PartTooLarge):
+        read_body(io.BytesIO(b'x' * 10), 10, max_size=9)
+    with pytest.raises(MultipartError, match='Unexpected end'):
+        read_body(io.BytesIO(b'x' * 5), 10)
+
+
+def post(body):
+    return index.handler({
+        'httpMethod': 'POST',
+        'headers': {'content-type': CONTENT_TYPE},
+        'body': body,
+        'queryStringParameters': {},
+    }, None)
+
+
+@pytest.mark.parametrize('body', [
+    text_part('boxes', b'\xff') + close(),
+    text_part('images', 'not a file') + close(),
+    text_part('image', 'not a file') + close(),
+    text_part('images', '') + file_part('images', 'a.png', b'x') + close(),
+])
+def test_handler_rejects_bad_fields(body):
+    response = post(body)
+    assert response['statusCode'] == 400, response['body']
+    assert 'error' in json.loads(response['body'])
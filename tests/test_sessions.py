@@ -0,0 +1,56 @@
+"""
+优化模型缓存：同名的不同模型不会加载彼此的缓存；工作进程的线程配置
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+onnx = pytest.importorskip('onnx')
+
+from api.sessions import create_session
+
+
+def make_model(path, op_type):
+    from onnx import TensorProto, helper
+
+    graph = helper.make_graph(
+        [helper.make_node(op_type, ['x'], ['y'])],
+        'model',
+        [helper.make_tensor_value_info('x', TensorProto.FLOAT, [2])],
+        [helper.make_tensor_value_info('y', TensorProto.FLOAT, [2])]
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 17)])
+    model.ir_version = 8
+    path.parent.mkdir(parents=True, exist_ok=True)
+    onnx.save(model, str(path))
+    return str(path)
+
+
+def test_optimized_cache_is_keyed_by_model(tmp_path):
+    cache_dir = str(tmp_path / 'ort')
+    negate = make_model(tmp_path / 'b' / 'model.onnx', 'Neg')
+    # 第二个模型更旧，只按修改时间判断缓存是否新鲜时会加载到第一个模型的缓存
+    os.utime(negate, (1, 1))
+    identity = make_model(tmp_path / 'a' / 'model.onnx', 'Identity')
+    x = np.ones(2, dtype=np.float32)
+
+    for _ in range(2):
+        assert create_session(identity, cache_dir=cache_dir).run(None, {'x': x})[0].tolist() == [1, 1]
+        assert create_session(negate, cache_dir=cache_dir).run(None, {'x': x})[0].tolist() == [-1, -1]
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_configure_worker_process_updates_defaults(monkeypatch):
+    from api import sessions
+
+    for name in ('WATERMARK_WORKER_PROCESSES', 'WATERMARK_ORT_INTER_OP_THREADS', 'OMP_NUM_THREADS'):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(sessions, 'WORKER_PROCESSES', 1)
+    monkeypatch.setattr(sessions, 'DEFAULT_INTER_OP_THREADS', 0)
+
+    sessions.configure_worker_process(4)
+    assert os.environ['OMP_NUM_THREADS'] == '1'
+    assert sessions.WORKER_PROCESSES == 4
+    assert sessions.DEFAULT_INTER_OP_THREADS == 1